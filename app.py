@@ -1,13 +1,45 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file, jsonify, send_from_directory, g, has_app_context, has_request_context, abort, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+import sqlalchemy as sa
+from sqlalchemy.ext.hybrid import hybrid_property
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 import os
 import csv
 import json
+import sys
+import threading
+import time
+import gzip
+import hashlib
+import heapq
+import mimetypes
+import re
+import uuid
+import queue
+import cProfile
+import pstats
+from array import array
+from functools import wraps
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import ClosingIterator
+import io
 from io import StringIO, BytesIO
 from openpyxl import Workbook
+from markupsafe import Markup
+import click
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from validacion_carga import mapear_columnas, parsear_fila, validar_lote, combinar_lotes, COLUMNAS_NUMERICAS
+
+try:
+    import brotli
+except ImportError:  # Brotli es opcional: sin él se comprime sólo con gzip
+    brotli = None
 
 # Crear la aplicación Flask primero
 app = Flask(__name__)
@@ -29,27 +61,278 @@ def get_database_url():
     print("⚠️  Usando SQLite (modo emergencia)")
     return 'sqlite:///combustibles.db'
 
+# Perfil de SQLite para concurrencia (WAL, pragmas, espera ante bloqueos)
+SQLITE_AJUSTADO = os.environ.get('SQLITE_AJUSTADO', '1') != '0'
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', '15'))
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': -1024 * int(os.environ.get('SQLITE_CACHE_MB', '64')),
+    'mmap_size': 1024 * 1024 * int(os.environ.get('SQLITE_MMAP_MB', '256')),
+    'temp_store': 'MEMORY',
+    'busy_timeout': int(SQLITE_BUSY_TIMEOUT * 1000),
+}
+SQLITE_REINTENTOS_ESCRITURA = int(os.environ.get('SQLITE_REINTENTOS_ESCRITURA', '5'))
+
+def get_replica_url():
+    # Réplica de sólo lectura opcional para dashboards, exportaciones y API
+    replica_url = os.environ.get('DATABASE_REPLICA_URL')
+    if not replica_url:
+        return None
+    if replica_url.startswith('postgres://'):
+        replica_url = replica_url.replace('postgres://', 'postgresql://', 1)
+    print(f"✅ Usando réplica de lectura: {replica_url.split('@')[1] if '@' in replica_url else replica_url}")
+    return replica_url
+
+def opciones_motor(url):
+    # Configuración mejorada para PostgreSQL
+    if url.startswith('postgresql://'):
+        return {
+            'pool_recycle': 300,
+            'pool_pre_ping': True,
+            'connect_args': {
+                'connect_timeout': 10,
+                'application_name': 'sistema_combustibles'
+            }
+        }
+    if url.startswith('sqlite') and SQLITE_AJUSTADO:
+        return {
+            'connect_args': {
+                'timeout': SQLITE_BUSY_TIMEOUT,
+                'check_same_thread': False
+            }
+        }
+    return {}
+
 app.config['SQLALCHEMY_DATABASE_URI'] = get_database_url()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Configuración mejorada para PostgreSQL
-if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql://'):
-    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-        'pool_recycle': 300,
-        'pool_pre_ping': True,
-        'connect_args': {
-            'connect_timeout': 10,
-            'application_name': 'sistema_combustibles'
-        }
+if opciones_motor(app.config['SQLALCHEMY_DATABASE_URI']):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opciones_motor(app.config['SQLALCHEMY_DATABASE_URI'])
+
+REPLICA_URL = get_replica_url()
+if REPLICA_URL:
+    # Las opciones por bind reemplazan a SQLALCHEMY_ENGINE_OPTIONS, incluidas las connect_args
+    app.config['SQLALCHEMY_BINDS'] = {
+        'replica': {'url': REPLICA_URL, 'pool_pre_ping': True, 'connect_args': {},
+                    **opciones_motor(REPLICA_URL)}
     }
+# Segundos que una sesión lee del primario después de escribir (read-after-write)
+app.config['REPLICA_VENTANA_ESCRITURA'] = int(os.environ.get('REPLICA_VENTANA_ESCRITURA', '30'))
+# Segundos que se recuerda el resultado de la verificación de la réplica
+app.config['REPLICA_INTERVALO_VERIFICACION'] = int(os.environ.get('REPLICA_INTERVALO_VERIFICACION', '15'))
 
 # CONFIGURACIONES FALTANTES - AGREGADAS
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['ALLOWED_EXTENSIONS'] = {'csv', 'xlsx', 'xls'}
 
+# Retención del historial: días de registros crudos antes de compactarlos (0 = desactivado)
+app.config['RETENCION_DIAS'] = int(os.environ.get('RETENCION_DIAS', '0'))
+
+# Compresión de respuestas (gzip, y brotli si está instalado)
+app.config['COMPRESION_HABILITADA'] = os.environ.get('COMPRESION', '1') != '0'
+app.config['COMPRESION_MIN_BYTES'] = int(os.environ.get('COMPRESION_MIN_BYTES', '1024'))
+app.config['COMPRESION_NIVEL_GZIP'] = 6
+app.config['COMPRESION_NIVEL_BROTLI'] = 5
+# Caché de estáticos sin huella en la URL (las URL con huella son inmutables)
+app.config['CACHE_ESTATICOS_SEGUNDOS'] = 86400
+
+# Caché de fragmentos del panel de administración (0 = desactivada)
+app.config['FRAGMENTOS_CACHE_MB'] = int(os.environ.get('FRAGMENTOS_CACHE_MB', '16'))
+app.config['FRAGMENTOS_TTL'] = int(os.environ.get('FRAGMENTOS_TTL', '60'))
+
+# Alertas de stock bajo: umbral por nivel (total, dos, ges o un producto) e histéresis de salida
+app.config['ALERTA_UMBRALES'] = os.environ.get('ALERTA_UMBRALES', 'total=3000,dos=3000,ges=3000')
+app.config['ALERTA_HISTERESIS'] = float(os.environ.get('ALERTA_HISTERESIS', '0.1'))
+
+# Pronóstico de consumo: vida media (horas) de la media exponencial de la tasa
+app.config['CONSUMO_VIDA_MEDIA_HORAS'] = float(os.environ.get('CONSUMO_VIDA_MEDIA_HORAS', '24'))
+
+# Carga por fragmentos: tamaño máximo de cada fragmento y vida de una carga sin actividad
+app.config['CARGA_FRAGMENTO_MB'] = int(os.environ.get('CARGA_FRAGMENTO_MB', '8'))
+app.config['CARGA_PARCIAL_HORAS'] = int(os.environ.get('CARGA_PARCIAL_HORAS', '24'))
+
+# Procesos que validan los lotes de la simulación de carga (?simular=1)
+app.config['CARGA_VALIDACION_PROCESOS'] = int(os.environ.get('CARGA_VALIDACION_PROCESOS', str(min(4, os.cpu_count() or 1))))
+
+# Escritura agrupada: las actualizaciones de estaciones se confirman en lotes
+# cada ESCRITURA_AGRUPADA_MS milisegundos o ESCRITURA_AGRUPADA_MAX registros
+app.config['ESCRITURA_AGRUPADA'] = os.environ.get('ESCRITURA_AGRUPADA', '0') == '1'
+app.config['ESCRITURA_AGRUPADA_MS'] = float(os.environ.get('ESCRITURA_AGRUPADA_MS', '5'))
+app.config['ESCRITURA_AGRUPADA_MAX'] = int(os.environ.get('ESCRITURA_AGRUPADA_MAX', '200'))
+# Segundos que una petición espera la confirmación de su lote
+app.config['ESCRITURA_AGRUPADA_ESPERA'] = 30
+
+# Estado actual de las estaciones en memoria para los paneles, y segundos entre sondeos de cambios
+app.config['ESTADO_MEMORIA'] = os.environ.get('ESTADO_MEMORIA', '1') != '0'
+app.config['ESTADO_MEMORIA_SONDEO'] = float(os.environ.get('ESTADO_MEMORIA_SONDEO', '2'))
+
+# Exportaciones en segundo plano: hilos por proceso, trabajos en cola por
+# proceso, tamaño máximo de la carpeta de resultados, segundos que las rutas
+# /admin/export/csv y /excel esperan el archivo antes de devolver el control, y
+# segundos durante los que un resultado se reutiliza para la misma versión de datos
+app.config['EXPORTACION_CARPETA'] = os.environ.get('EXPORTACION_CARPETA', os.path.join('uploads', 'exportaciones'))
+app.config['EXPORTACION_HILOS'] = int(os.environ.get('EXPORTACION_HILOS', '2'))
+app.config['EXPORTACION_PENDIENTES'] = int(os.environ.get('EXPORTACION_PENDIENTES', '16'))
+app.config['EXPORTACION_CACHE_MB'] = int(os.environ.get('EXPORTACION_CACHE_MB', '512'))
+app.config['EXPORTACION_ESPERA'] = float(os.environ.get('EXPORTACION_ESPERA', '20'))
+app.config['EXPORTACION_VIDA'] = int(os.environ.get('EXPORTACION_VIDA', '600'))
+
+# Política de contraseñas: método y costo de werkzeug (los hashes con otra
+# política se recalculan al iniciar sesión), hilos que verifican, verificaciones
+# que pueden esperar turno y segundos de espera antes de rechazar el inicio de sesión
+app.config['CONTRASENA_METODO'] = os.environ.get('CONTRASENA_METODO', 'pbkdf2:sha256:600000')
+app.config['CONTRASENA_HILOS'] = int(os.environ.get('CONTRASENA_HILOS', '1'))
+app.config['CONTRASENA_COLA'] = int(os.environ.get('CONTRASENA_COLA', '8'))
+app.config['CONTRASENA_ESPERA'] = float(os.environ.get('CONTRASENA_ESPERA', '10'))
+
+# Perfilado a pedido (?perfilar=1 o cabecera X-Perfilar, sólo administradores)
+app.config['PERFILADO'] = os.environ.get('PERFILADO', '1') != '0'
+app.config['PERFILADO_MODO'] = os.environ.get('PERFILADO_MODO', 'muestreo')
+app.config['PERFILADO_MUESTREO_MS'] = float(os.environ.get('PERFILADO_MUESTREO_MS', '5'))
+app.config['PERFILADO_CARPETA'] = os.environ.get('PERFILADO_CARPETA', 'perfiles')
+app.config['PERFILADO_MAX_MB'] = int(os.environ.get('PERFILADO_MAX_MB', '64'))
+app.config['PERFILADO_MAX_ARCHIVOS'] = int(os.environ.get('PERFILADO_MAX_ARCHIVOS', '200'))
+# Sentencias SQL distintas que se detallan por perfil; el resto se suma en una sola entrada
+app.config['PERFILADO_SQL_MAX'] = 200
+
+# ================= ENRUTAMIENTO LECTURA/ESCRITURA =================
+class EstadoReplica:
+    """Recuerda si la réplica respondió en la última verificación"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.disponible = True
+        self.verificada_en = 0.0
+
+    def marcar_caida(self):
+        with self.lock:
+            self.disponible = False
+            self.verificada_en = time.monotonic()
+
+    def esta_disponible(self, engine):
+        with self.lock:
+            if time.monotonic() - self.verificada_en < app.config['REPLICA_INTERVALO_VERIFICACION']:
+                return self.disponible
+            self.verificada_en = time.monotonic()
+        try:
+            with engine.connect() as conexion:
+                conexion.execute(sa.text('SELECT 1'))
+            disponible = True
+        except Exception as e:
+            print(f"⚠️  Réplica no disponible, usando primario: {e}")
+            disponible = False
+        with self.lock:
+            self.disponible = disponible
+        return disponible
+
+estado_replica = EstadoReplica()
+
+class SesionEnrutada(FlaskSQLAlchemySession):
+    """Envía los SELECT de las rutas marcadas con @lectura_replica a la réplica.
+
+    Escrituras, flushes y cualquier lectura posterior a una escritura en la
+    misma petición siguen en el primario. Los trabajos en segundo plano que
+    heredan la decisión de una ruta la fijan en g.usar_replica de su contexto.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._usar_replica(clause):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _usar_replica(self, clause):
+        if not REPLICA_URL or self._flushing or not has_app_context():
+            return False
+        if not g.get('usar_replica') or g.get('hubo_escritura'):
+            return False
+        if clause is None or not getattr(clause, 'is_select', False):
+            return False
+        return estado_replica.esta_disponible(self._db.engines['replica'])
+
 # Inicializar SQLAlchemy después de configurar la app
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': SesionEnrutada})
+
+# ================= PERFIL SQLITE PARA CONCURRENCIA =================
+_contexto_escritura = threading.local()
+
+@contextmanager
+def transaccion_escritura():
+    """Las transacciones abiertas dentro de este contexto toman el bloqueo de escritura al empezar.
+
+    También sirve como decorador de rutas: @transaccion_escritura()
+    """
+    anterior = getattr(_contexto_escritura, 'activo', False)
+    _contexto_escritura.activo = True
+    try:
+        yield
+    finally:
+        _contexto_escritura.activo = anterior
+
+def configurar_sqlite(engine):
+    """Aplica los pragmas al conectar y controla el BEGIN de cada transacción.
+
+    pysqlite abre las transacciones de forma diferida: una transacción que lee
+    y luego escribe falla con "database is locked" si otro hilo confirmó en el
+    medio. Las transacciones de escritura usan BEGIN IMMEDIATE, que espera el
+    bloqueo con busy_timeout y se reintenta con espera creciente.
+    """
+    @sa.event.listens_for(engine, 'connect')
+    def _al_conectar(conexion_dbapi, registro_conexion):
+        conexion_dbapi.isolation_level = None
+        cursor = conexion_dbapi.cursor()
+        for pragma, valor in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma}={valor}')
+        cursor.close()
+
+    @sa.event.listens_for(engine, 'begin')
+    def _al_empezar(conexion):
+        if not getattr(_contexto_escritura, 'activo', False):
+            conexion.exec_driver_sql('BEGIN')
+            return
+        for intento in range(SQLITE_REINTENTOS_ESCRITURA + 1):
+            try:
+                conexion.exec_driver_sql('BEGIN IMMEDIATE')
+                return
+            except sa.exc.OperationalError as e:
+                if 'locked' not in str(e) or intento == SQLITE_REINTENTOS_ESCRITURA:
+                    raise
+                time.sleep(min(0.05 * 2 ** intento, 1.0))
+
+if SQLITE_AJUSTADO:
+    with app.app_context():
+        for _engine in db.engines.values():
+            if _engine.dialect.name == 'sqlite':
+                configurar_sqlite(_engine)
+
+if REPLICA_URL:
+    with app.app_context():
+        @sa.event.listens_for(db.engines['replica'], 'handle_error')
+        def _replica_con_error(contexto):
+            # Un fallo de conexión manda las lecturas al primario hasta la próxima verificación
+            if contexto.is_disconnect or isinstance(contexto.original_exception, sa.exc.OperationalError):
+                estado_replica.marcar_caida()
+
+@sa.event.listens_for(SesionEnrutada, 'after_flush')
+def _registrar_escritura(sesion, contexto_flush):
+    if has_request_context():
+        g.hubo_escritura = True
+
+@app.after_request
+def _recordar_escritura(response):
+    if g.get('hubo_escritura') and REPLICA_URL:
+        session['ultima_escritura'] = time.time()
+    return response
+
+def lectura_replica(vista):
+    """Marca una ruta de sólo lectura cuyas consultas pueden ir a la réplica"""
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        ultima_escritura = session.get('ultima_escritura', 0)
+        g.usar_replica = time.time() - ultima_escritura > app.config['REPLICA_VENTANA_ESCRITURA']
+        return vista(*args, **kwargs)
+    return envoltura
 
 # Crear directorio de uploads si no existe
 try:
@@ -67,17 +350,28 @@ class Usuario(db.Model):
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=app.config['CONTRASENA_METODO'])
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def hash_desactualizado(self):
+        """True si el hash no usa el método y costo de CONTRASENA_METODO"""
+        return self.password_hash.split('$', 1)[0] != prefijo_politica_contrasena()
+
 class CargaArchivo(db.Model):
+    __table_args__ = (
+        db.Index('ix_carga_hash_archivo', 'hash_archivo', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     fecha_hora = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     usuario = db.Column(db.String(100), nullable=False)
     nombre_archivo = db.Column(db.String(200), nullable=False)
     registros_procesados = db.Column(db.Integer, default=0)
+    hash_archivo = db.Column(db.String(64))  # sha256 del contenido
+    registros_sin_cambios = db.Column(db.Integer, default=0)
+    registros_rechazados = db.Column(db.Integer, default=0)
 
 class AsignacionEstacion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -88,6 +382,11 @@ class AsignacionEstacion(db.Model):
     usuario = db.relationship('Usuario', backref=db.backref('asignaciones', lazy=True))
 
 class RegistroCombustible(db.Model):
+    __table_args__ = (
+        db.Index('ix_registro_codigo_fecha_hora', 'codigo', 'fecha_hora'),
+        db.Index('ix_registro_fecha_hora', 'fecha_hora'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     codigo = db.Column(db.String(50), nullable=False)
     razon_social = db.Column(db.String(200), nullable=False)
@@ -115,6 +414,29 @@ class RegistroCombustible(db.Model):
     def calcular_ges(self):
         return self.ge_ge_plus + self.gp_plus + self.gp_ultra_100
 
+    # Las mismas cuentas como atributos, que en consultas se calculan en SQL
+    @hybrid_property
+    def volumen_total(self):
+        return self.do_do_plus + self.do_uls_plus + self.ge_ge_plus + self.gp_plus + self.gp_ultra_100
+
+    @hybrid_property
+    def volumen_dos(self):
+        return self.do_do_plus + self.do_uls_plus
+
+    @hybrid_property
+    def volumen_ges(self):
+        return self.ge_ge_plus + self.gp_plus + self.gp_ultra_100
+
+    @hybrid_property
+    def estado_volumen(self):
+        return texto_estado_volumen(self.volumen_total)
+
+    @estado_volumen.expression
+    def estado_volumen(cls):
+        # Mismos umbrales que calcular_estado
+        total = cls.volumen_total
+        return db.case((total > 7000, 'ALTO'), (total >= 3000, 'MEDIO'), else_='BAJO')
+
     def get_estado_volumen(self):
         total = self.calcular_volumen_total()
         if total > 7000:
@@ -148,12 +470,193 @@ class RegistroCombustible(db.Model):
             'usuarioActualizacion': self.usuario_actualizacion
         }
 
+class ResumenDiarioCombustible(db.Model):
+    """Resumen por estación y día de los registros crudos ya compactados"""
+    __table_args__ = (
+        db.UniqueConstraint('codigo', 'fecha', name='uq_resumen_codigo_fecha'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    codigo = db.Column(db.String(50), nullable=False)
+    fecha = db.Column(db.Date, nullable=False, index=True)
+    razon_social = db.Column(db.String(200), nullable=False)
+    zona = db.Column(db.String(100), nullable=False)
+    provincia = db.Column(db.String(100), nullable=False)
+    municipio = db.Column(db.String(100), nullable=False)
+    funcionario = db.Column(db.String(100))
+    # Valores del último registro del día (cierre)
+    do_do_plus = db.Column(db.Integer, default=0)
+    do_uls_plus = db.Column(db.Integer, default=0)
+    ge_ge_plus = db.Column(db.Integer, default=0)
+    gp_plus = db.Column(db.Integer, default=0)
+    gp_ultra_100 = db.Column(db.Integer, default=0)
+    filas_do_do_plus = db.Column(db.Integer, default=0)
+    filas_ge_ge_plus = db.Column(db.Integer, default=0)
+    fecha_hora_ultima = db.Column(db.DateTime, nullable=False)
+    # Agregados del día
+    registros = db.Column(db.Integer, default=0)
+    volumen_total_min = db.Column(db.Integer, default=0)
+    volumen_total_max = db.Column(db.Integer, default=0)
+    volumen_total_suma = db.Column(db.BigInteger, default=0)
+    # Mayor id crudo resumido (informativo: los resumidos se eliminan en la misma transacción)
+    ultimo_id = db.Column(db.Integer, nullable=False, default=0)
+
+    def volumen_total_promedio(self):
+        return self.volumen_total_suma / self.registros if self.registros else 0
+
+class VersionDatos(db.Model):
+    """Contadores que cambian con cada modificación de un grupo de datos"""
+    clave = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class EstadoAlertaEstacion(db.Model):
+    """Último estado evaluado de cada estación en cada nivel de alerta"""
+    codigo = db.Column(db.String(50), primary_key=True)
+    nivel = db.Column(db.String(20), primary_key=True)
+    en_alerta = db.Column(db.Boolean, nullable=False, default=False)
+    valor = db.Column(db.Integer, nullable=False, default=0)
+    registro_id = db.Column(db.Integer)
+    fecha_hora = db.Column(db.DateTime, nullable=False)
+
+class TasaConsumoEstacion(db.Model):
+    """Consumo estimado por estación y producto en litros/hora (media exponencial)"""
+    __table_args__ = (
+        db.Index('ix_tasa_vacio_estimado', 'vacio_estimado'),
+    )
+
+    codigo = db.Column(db.String(50), primary_key=True)
+    producto = db.Column(db.String(20), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False, default=0)  # última lectura
+    fecha_hora = db.Column(db.DateTime, nullable=False)
+    registro_id = db.Column(db.Integer)
+    tasa = db.Column(db.Float)  # None hasta tener dos lecturas
+    vacio_estimado = db.Column(db.DateTime)
+
+    @staticmethod
+    def estimar_vacio(valor, fecha_hora, tasa):
+        if tasa and tasa > 0:
+            return fecha_hora + timedelta(hours=valor / tasa)
+        return None
+
+class AlertaCombustible(db.Model):
+    """Transiciones de alerta; el id creciente es el cursor del feed"""
+    __table_args__ = (
+        db.Index('ix_alerta_codigo_id', 'codigo', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    codigo = db.Column(db.String(50), nullable=False)
+    razon_social = db.Column(db.String(200))
+    nivel = db.Column(db.String(20), nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)  # BAJO o RECUPERADO
+    valor = db.Column(db.Integer, nullable=False)
+    umbral = db.Column(db.Integer, nullable=False)
+    registro_id = db.Column(db.Integer)
+    fecha_hora = db.Column(db.DateTime, nullable=False)
+    creada = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'codigo': self.codigo,
+            'razonSocial': self.razon_social,
+            'nivel': self.nivel,
+            'tipo': self.tipo,
+            'valor': self.valor,
+            'umbral': self.umbral,
+            'registroId': self.registro_id,
+            'fechaHora': self.fecha_hora.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+# ================= VERIFICACIÓN DE CONTRASEÑAS =================
+_prefijos_politica = {}
+
+def prefijo_politica_contrasena():
+    """Prefijo 'método:parámetros' que genera CONTRASENA_METODO.
+
+    Se obtiene de un hash de prueba, para comparar con los parámetros que
+    werkzeug completa por defecto (p. ej. 'scrypt' -> 'scrypt:32768:8:1').
+    """
+    metodo = app.config['CONTRASENA_METODO']
+    prefijo = _prefijos_politica.get(metodo)
+    if prefijo is None:
+        prefijo = _prefijos_politica[metodo] = generate_password_hash('', method=metodo).split('$', 1)[0]
+    return prefijo
+
+class VerificacionOcupada(Exception):
+    pass
+
+class VerificadorContrasenas:
+    """Verifica contraseñas en un pool acotado de hilos.
+
+    PBKDF2 y scrypt no retienen el GIL, pero ocupan un núcleo cada uno: el pool
+    limita cuántos corren a la vez y deja CPU para los paneles. Si ya hay
+    hilos + cola verificaciones en curso, el inicio de sesión se rechaza de
+    inmediato en lugar de ocupar otro hilo de gunicorn esperando.
+    """
+
+    def __init__(self, hilos, cola):
+        self.hilos = hilos
+        self.ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='contrasena') if hilos else None
+        self.lugares = threading.BoundedSemaphore(hilos + cola) if hilos else None
+
+    def ejecutar(self, funcion, *args, espera=None):
+        if self.ejecutor is None:
+            return funcion(*args)
+        if not self.lugares.acquire(blocking=False):
+            raise VerificacionOcupada()
+        try:
+            futuro = self.ejecutor.submit(funcion, *args)
+        except Exception:
+            self.lugares.release()
+            raise
+        futuro.add_done_callback(lambda _: self.lugares.release())
+        try:
+            return futuro.result(timeout=espera)
+        except TimeoutError:
+            raise VerificacionOcupada()
+
+verificador_contrasenas = VerificadorContrasenas(app.config['CONTRASENA_HILOS'], app.config['CONTRASENA_COLA'])
+
+def _verificar_y_recalcular(password_hash, password, desactualizado):
+    """(válida, hash nuevo o None). Corre en el pool: ambos hashes cuestan lo mismo"""
+    if not check_password_hash(password_hash, password):
+        return False, None
+    if desactualizado:
+        return True, generate_password_hash(password, method=app.config['CONTRASENA_METODO'])
+    return True, None
+
+def autenticar_usuario(usuario, password):
+    """Verifica la contraseña y, si el hash usa otra política, lo reemplaza.
+
+    Lanza VerificacionOcupada si el pool está lleno o no respondió a tiempo.
+    """
+    if not password:
+        return False
+    valida, hash_nuevo = verificador_contrasenas.ejecutar(
+        _verificar_y_recalcular, usuario.password_hash, password, usuario.hash_desactualizado(),
+        espera=app.config['CONTRASENA_ESPERA'])
+    if hash_nuevo:
+        try:
+            # Se cierra la transacción de lectura del login y se escribe en una
+            # propia. UPDATE sobre la tabla, sin el ORM: el hash no aparece en
+            # ningún fragmento del panel y no debe invalidar la versión 'usuarios'.
+            db.session.commit()
+            with transaccion_escritura():
+                tabla = Usuario.__table__
+                db.session.execute(tabla.update().where(tabla.c.id == usuario.id).values(password_hash=hash_nuevo))
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ No se pudo actualizar el hash de {usuario.username}: {e}")
+    return valida
+
 # ================= FUNCIONES DE UTILIDAD =================
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-def crear_usuario_desde_funcionario(nombre_funcionario):
+def crear_usuario_desde_funcionario(nombre_funcionario, confirmar=True):
     username = nombre_funcionario.split()[0].lower()
     password = username + "1234"
     
@@ -166,7 +669,8 @@ def crear_usuario_desde_funcionario(nombre_funcionario):
         )
         nuevo_usuario.set_password(password)
         db.session.add(nuevo_usuario)
-        db.session.commit()
+        if confirmar:
+            db.session.commit()
         print(f"✅ Usuario creado: {username} / {password}")
         return nuevo_usuario
     else:
@@ -182,6 +686,14 @@ def calcular_estado(total):
     else:
         return {'class': 'volume-low', 'text': 'BAJO', 'color': 'danger'}
 
+def texto_estado_volumen(total):
+    """El 'text' de calcular_estado sin armar el diccionario"""
+    if total > 7000:
+        return 'ALTO'
+    elif total >= 3000:
+        return 'MEDIO'
+    return 'BAJO'
+
 def calcular_estadisticas():
     # Esta función calcula estadísticas para el dashboard de usuario
     # Por ahora retorna valores dummy - puedes implementar la lógica real después
@@ -198,37 +710,53 @@ def calcular_estadisticas():
 app.jinja_env.globals.update(calcular_estado=calcular_estado)
 app.jinja_env.globals.update(calcular_estadisticas=calcular_estadisticas)
 
-def obtener_ultimos_registros(fecha_inicio=None, fecha_fin=None, hora_inicio=None, hora_fin=None):
-    subquery = db.session.query(
-        RegistroCombustible.codigo,
-        db.func.max(RegistroCombustible.fecha_hora).label('max_fecha')
-    )
+def limites_rango_fechas(fecha_inicio=None, fecha_fin=None, hora_inicio=None, hora_fin=None):
+    """(desde, hasta) del filtro de fechas y horas; None donde no hay límite"""
+    fecha_inicio_completa = None
+    fecha_fin_completa = None
     
     if fecha_inicio:
         if hora_inicio:
             fecha_inicio_completa = datetime.combine(fecha_inicio, datetime.strptime(hora_inicio, '%H:%M').time())
         else:
             fecha_inicio_completa = datetime.combine(fecha_inicio, datetime.min.time())
-        subquery = subquery.filter(RegistroCombustible.fecha_hora >= fecha_inicio_completa)
     
     if fecha_fin:
         if hora_fin:
             fecha_fin_completa = datetime.combine(fecha_fin, datetime.strptime(hora_fin, '%H:%M').time())
         else:
             fecha_fin_completa = datetime.combine(fecha_fin, datetime.max.time())
-        subquery = subquery.filter(RegistroCombustible.fecha_hora <= fecha_fin_completa)
     
-    subquery = subquery.group_by(RegistroCombustible.codigo).subquery()
+    return fecha_inicio_completa, fecha_fin_completa
+
+def filtros_rango_fechas(fecha_inicio=None, fecha_fin=None, hora_inicio=None, hora_fin=None):
+    filtros_fecha = []
+    desde, hasta = limites_rango_fechas(fecha_inicio, fecha_fin, hora_inicio, hora_fin)
+    if desde:
+        filtros_fecha.append(RegistroCombustible.fecha_hora >= desde)
+    if hasta:
+        filtros_fecha.append(RegistroCombustible.fecha_hora <= hasta)
+    return filtros_fecha
+
+def consulta_ultimos(filtros_fecha, *entidades):
+    """Consulta sobre el último registro de cada estación dentro del rango"""
+    subquery = db.session.query(
+        RegistroCombustible.codigo,
+        db.func.max(RegistroCombustible.fecha_hora).label('max_fecha')
+    ).filter(*filtros_fecha).group_by(RegistroCombustible.codigo).subquery()
     
-    registros = db.session.query(RegistroCombustible).join(
+    # Repetir el rango en la consulta externa permite descartar particiones en PostgreSQL
+    return db.session.query(*(entidades or (RegistroCombustible,))).join(
         subquery,
         db.and_(
             RegistroCombustible.codigo == subquery.c.codigo,
             RegistroCombustible.fecha_hora == subquery.c.max_fecha
         )
-    ).all()
-    
-    return registros
+    ).filter(*filtros_fecha)
+
+def obtener_ultimos_registros(fecha_inicio=None, fecha_fin=None, hora_inicio=None, hora_fin=None):
+    filtros_fecha = filtros_rango_fechas(fecha_inicio, fecha_fin, hora_inicio, hora_fin)
+    return consulta_ultimos(filtros_fecha).all()
 
 def calcular_estadisticas_globales(registros, fecha_inicio=None, fecha_fin=None):
     if not registros:
@@ -258,32 +786,29 @@ def calcular_estadisticas_globales(registros, fecha_inicio=None, fecha_fin=None)
             }
         }
     
+    # Sirve para instancias del modelo y para filas proyectadas: sólo usa atributos
     total_estaciones = len(registros)
-    total_volumen = sum(r.calcular_volumen_total() for r in registros)
+    total_volumen = sum(r.volumen_total for r in registros)
     
     # Calcular estaciones GES y DOS
-    estaciones_ges = [r for r in registros if r.calcular_ges() > 0]
-    estaciones_dos = [r for r in registros if r.calcular_dos() > 0]
-    total_estaciones_ges = len(estaciones_ges)
-    total_estaciones_dos = len(estaciones_dos)
+    total_estaciones_ges = sum(1 for r in registros if r.volumen_ges > 0)
+    total_estaciones_dos = sum(1 for r in registros if r.volumen_dos > 0)
     
     # Calcular volúmenes GES y DOS
-    total_volumen_ges = sum(r.calcular_ges() for r in registros)
-    total_volumen_dos = sum(r.calcular_dos() for r in registros)
+    total_volumen_ges = sum(r.volumen_ges for r in registros)
+    total_volumen_dos = sum(r.volumen_dos for r in registros)
     
     # Estaciones en rojo (total < 3000)
-    estaciones_rojo = sum(1 for r in registros if r.calcular_volumen_total() < 3000)
-    estaciones_rojo_ges = sum(1 for r in registros if r.calcular_ges() < 3000 and r.calcular_ges() > 0)
-    estaciones_rojo_dos = sum(1 for r in registros if r.calcular_dos() < 3000 and r.calcular_dos() > 0)
+    estaciones_rojo = sum(1 for r in registros if r.volumen_total < 3000)
+    estaciones_rojo_ges = sum(1 for r in registros if 0 < r.volumen_ges < 3000)
+    estaciones_rojo_dos = sum(1 for r in registros if 0 < r.volumen_dos < 3000)
     
     filas_ciudad = [r.filas_do_do_plus + r.filas_ge_ge_plus for r in registros]
     promedio_filas_ciudad = sum(filas_ciudad) / len(filas_ciudad) if filas_ciudad else 0
     
     provincias = {}
-    for r in registros:
-        if r.provincia not in provincias:
-            provincias[r.provincia] = []
-        provincias[r.provincia].append(r.filas_do_do_plus + r.filas_ge_ge_plus)
+    for r, filas in zip(registros, filas_ciudad):
+        provincias.setdefault(r.provincia, []).append(filas)
     
     promedios_provincia = {prov: sum(filas) / len(filas) for prov, filas in provincias.items()}
     promedio_filas_provincia = sum(promedios_provincia.values()) / len(promedios_provincia) if promedios_provincia else 0
@@ -297,25 +822,26 @@ def calcular_estadisticas_globales(registros, fecha_inicio=None, fecha_fin=None)
     }
     
     volumen_por_grupo = {
-        'dos': sum(r.calcular_dos() for r in registros),
-        'ges': sum(r.calcular_ges() for r in registros)
+        'dos': total_volumen_dos,
+        'ges': total_volumen_ges
     }
     
-    top_15_do_do = sorted(registros, key=lambda x: x.do_do_plus, reverse=True)[:15]
-    top_15_gp = sorted(registros, key=lambda x: x.gp_plus, reverse=True)[:15]
-    top_15_total = sorted(registros, key=lambda x: x.calcular_volumen_total(), reverse=True)[:15]
-    top_15_dos = sorted(registros, key=lambda x: x.calcular_dos(), reverse=True)[:15]
-    top_15_ges = sorted(registros, key=lambda x: x.calcular_ges(), reverse=True)[:15]
+    # nlargest equivale a sorted(..., reverse=True)[:n], empates incluidos
+    top_15_do_do = heapq.nlargest(15, registros, key=lambda x: x.do_do_plus)
+    top_15_gp = heapq.nlargest(15, registros, key=lambda x: x.gp_plus)
+    top_15_total = heapq.nlargest(15, registros, key=lambda x: x.volumen_total)
+    top_15_dos = heapq.nlargest(15, registros, key=lambda x: x.volumen_dos)
+    top_15_ges = heapq.nlargest(15, registros, key=lambda x: x.volumen_ges)
     
-    registros_recientes = sorted(registros, key=lambda x: x.fecha_hora, reverse=True)[:10]
+    registros_recientes = heapq.nlargest(10, registros, key=lambda x: x.fecha_hora)
     registros_recientes.reverse()
     
     evolucion_temporal = []
     for registro in registros_recientes:
         evolucion_temporal.append({
             'fecha_hora': registro.fecha_hora.strftime('%m-%d %H:%M'),
-            'dos': registro.calcular_dos(),
-            'ges': registro.calcular_ges()
+            'dos': registro.volumen_dos,
+            'ges': registro.volumen_ges
         })
     
     return {
@@ -335,11 +861,11 @@ def calcular_estadisticas_globales(registros, fecha_inicio=None, fecha_fin=None)
         'top_estaciones': {
             'do_do_plus': [{'nombre': r.razon_social, 'volumen': r.do_do_plus} for r in top_15_do_do],
             'gp_plus': [{'nombre': r.razon_social, 'volumen': r.gp_plus} for r in top_15_gp],
-            'total': [{'nombre': r.razon_social, 'volumen': r.calcular_volumen_total()} for r in top_15_total]
+            'total': [{'nombre': r.razon_social, 'volumen': r.volumen_total} for r in top_15_total]
         },
         'top_estaciones_grupo': {
-            'dos': [{'nombre': r.razon_social, 'volumen': r.calcular_dos()} for r in top_15_dos],
-            'ges': [{'nombre': r.razon_social, 'volumen': r.calcular_ges()} for r in top_15_ges]
+            'dos': [{'nombre': r.razon_social, 'volumen': r.volumen_dos} for r in top_15_dos],
+            'ges': [{'nombre': r.razon_social, 'volumen': r.volumen_ges} for r in top_15_ges]
         },
         'evolucion_temporal': evolucion_temporal,
         'rango_fechas': {
@@ -348,160 +874,1963 @@ def calcular_estadisticas_globales(registros, fecha_inicio=None, fecha_fin=None)
         }
     }
 
-# ================= RUTAS PRINCIPALES =================
-@app.route('/')
-def index():
-    return redirect(url_for('login'))
+# ================= AGREGADOS GEOGRÁFICOS =================
+NIVELES_GEOGRAFICOS = ('zona', 'provincia', 'municipio')
+PRODUCTOS = ('do_do_plus', 'do_uls_plus', 'ge_ge_plus', 'gp_plus', 'gp_ultra_100')
 
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    try:
-        if 'user' in session:
-            if session.get('role') == 'admin':
-                return redirect(url_for('admin_dashboard'))
-            return redirect(url_for('user_dashboard'))
-        
-        if request.method == 'POST':
-            username = request.form.get('username')
-            password = request.form.get('password')
-            
-            usuario = Usuario.query.filter_by(username=username).first()
-            
-            if usuario and usuario.check_password(password):
-                session['user'] = usuario.username
-                session['role'] = usuario.rol
-                session['funcionario'] = usuario.funcionario
-                session['login_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                
-                if usuario.rol == 'admin':
-                    flash('¡Bienvenido Administrador!', 'success')
-                    return redirect(url_for('admin_dashboard'))
-                else:
-                    flash(f'Bienvenido {usuario.funcionario}', 'success')
-                    return redirect(url_for('user_dashboard'))
-            else:
-                flash('Credenciales incorrectas. Intente nuevamente.', 'error')
-        
-        return render_template('login.html')
-        
-    except Exception as e:
-        print(f"❌ ERROR en login: {str(e)}")
-        import traceback
-        print(f"🔍 TRACEBACK: {traceback.format_exc()}")
-        flash('Error interno del servidor', 'error')
-        return render_template('login.html')
+def agregar_por_nivel(nivel, filtros_fecha=None, filtros_geo=None):
+    """Totales del estado actual de las estaciones agrupados por nivel geográfico.
 
-@app.route('/admin/dashboard')
-def admin_dashboard():
-    if 'user' not in session or session.get('role') != 'admin':
-        flash('Acceso denegado', 'error')
-        return redirect(url_for('login'))
-    
-    try:
-        fecha_inicio_str = request.args.get('fecha_inicio')
-        fecha_fin_str = request.args.get('fecha_fin')
-        hora_inicio_str = request.args.get('hora_inicio')
-        hora_fin_str = request.args.get('hora_fin')
-        
-        fecha_inicio = None
-        fecha_fin = None
-        
-        if fecha_inicio_str:
-            fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d')
-        if fecha_fin_str:
-            fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d')
-        
-        if not fecha_inicio and not fecha_fin:
-            fecha_fin = datetime.now()
-            fecha_inicio = fecha_fin - timedelta(days=7)
-        
-        registros = obtener_ultimos_registros(fecha_inicio, fecha_fin, hora_inicio_str, hora_fin_str)
-        fuel_data = [registro.to_dict() for registro in registros]
-        
-        stats = calcular_estadisticas_globales(registros, fecha_inicio, fecha_fin)
-        
-        usuarios = Usuario.query.all()
-        
-        # OBTENER ÚLTIMA CARGA DE ARCHIVO
-        ultima_carga = CargaArchivo.query.order_by(CargaArchivo.fecha_hora.desc()).first()
-        
-        return render_template('admin_dashboard.html', 
-                             fuel_data=fuel_data, 
-                             stats=stats,
-                             usuarios=usuarios,
-                             username=session['user'],
-                             fecha_inicio=fecha_inicio_str or fecha_inicio.strftime('%Y-%m-%d') if fecha_inicio else '',
-                             fecha_fin=fecha_fin_str or fecha_fin.strftime('%Y-%m-%d') if fecha_fin else '',
-                             hora_inicio=hora_inicio_str or '',
-                             hora_fin=hora_fin_str or '',
-                             ultima_carga=ultima_carga)  # NUEVO PARÁMETRO
-    except Exception as e:
-        flash(f'Error al cargar datos: {str(e)}', 'error')
-        return redirect(url_for('login'))
+    Se calcula todo en SQL. El resultado es columnar: cada métrica es una
+    lista alineada con 'grupos', lista para usarse como dataset de un gráfico.
+    """
+    columna = getattr(RegistroCombustible, nivel)
+    total = _volumen_total_sql()
+    dos = RegistroCombustible.do_do_plus + RegistroCombustible.do_uls_plus
+    ges = RegistroCombustible.ge_ge_plus + RegistroCombustible.gp_plus + RegistroCombustible.gp_ultra_100
 
-@app.route('/user/dashboard')
-def user_dashboard():
-    if 'user' not in session:
-        flash('Debe iniciar sesión para acceder a esta página', 'error')
-        return redirect(url_for('login'))
-    
-    try:
-        funcionario = session.get('funcionario')
-        
-        # Obtener estaciones asignadas al usuario
-        asignaciones = AsignacionEstacion.query.filter_by(usuario_id=session.get('user_id')).all()
-        codigos_estaciones = [asignacion.codigo_estacion for asignacion in asignaciones]
-        
-        if not codigos_estaciones:
-            # Si no tiene asignaciones, usar el método anterior
-            subquery = db.session.query(
-                RegistroCombustible.codigo,
-                db.func.max(RegistroCombustible.fecha_hora).label('max_fecha')
-            ).filter(RegistroCombustible.funcionario == funcionario).group_by(RegistroCombustible.codigo).subquery()
-            
-            registros = db.session.query(RegistroCombustible).join(
-                subquery,
-                db.and_(
-                    RegistroCombustible.codigo == subquery.c.codigo,
-                    RegistroCombustible.fecha_hora == subquery.c.max_fecha
-                )
-            ).filter(RegistroCombustible.funcionario == funcionario).all()
-        else:
-            # Usar estaciones asignadas
-            subquery = db.session.query(
-                RegistroCombustible.codigo,
-                db.func.max(RegistroCombustible.fecha_hora).label('max_fecha')
-            ).filter(RegistroCombustible.codigo.in_(codigos_estaciones)).group_by(RegistroCombustible.codigo).subquery()
-            
-            registros = db.session.query(RegistroCombustible).join(
-                subquery,
-                db.and_(
-                    RegistroCombustible.codigo == subquery.c.codigo,
-                    RegistroCombustible.fecha_hora == subquery.c.max_fecha
-                )
-            ).filter(RegistroCombustible.codigo.in_(codigos_estaciones)).all()
-        
-        fuel_data = [registro.to_dict() for registro in registros]
-        
-        return render_template('user_dashboard.html', 
-                             fuel_data=fuel_data,
-                             username=session['user'],
-                             funcionario=funcionario)
-    except Exception as e:
-        flash(f'Error al cargar datos: {str(e)}', 'error')
-        return redirect(url_for('login'))
+    def contar(condicion):
+        return db.func.sum(db.case((condicion, 1), else_=0))
 
-@app.route('/logout')
-def logout():
-    username = session.get('user', 'Usuario')
-    session.clear()
-    flash(f'Sesión cerrada correctamente. ¡Hasta pronto {username}!', 'info')
-    return redirect(url_for('login'))
+    consulta = consulta_ultimos(
+        filtros_fecha or [],
+        columna,
+        db.func.count(RegistroCombustible.id),
+        *[db.func.sum(getattr(RegistroCombustible, producto)) for producto in PRODUCTOS],
+        db.func.sum(dos),
+        db.func.sum(ges),
+        db.func.sum(total),
+        # Mismos umbrales que calcular_estado
+        contar(total > 7000),
+        contar(db.and_(total >= 3000, total <= 7000)),
+        contar(total < 3000),
+        db.func.avg(RegistroCombustible.filas_do_do_plus),
+        db.func.avg(RegistroCombustible.filas_ge_ge_plus)
+    )
+    for campo, valor in (filtros_geo or {}).items():
+        consulta = consulta.filter(getattr(RegistroCombustible, campo) == valor)
+    filas = consulta.group_by(columna).order_by(columna).all()
 
-# ================= RUTAS DE GESTIÓN DE USUARIOS =================
-@app.route('/admin/crear_usuario', methods=['POST'])
-def crear_usuario():
-    if 'user' not in session or session.get('role') != 'admin':
+    columnas = list(zip(*filas)) if filas else [()] * 15
+    enteros = [[int(v or 0) for v in c] for c in columnas[1:13]]
+    promedios = [[round(float(v or 0), 1) for v in c] for c in columnas[13:]]
+    return {
+        'nivel': nivel,
+        'grupos': list(columnas[0]),
+        'estaciones': enteros[0],
+        'volumen_por_producto': dict(zip(PRODUCTOS, enteros[1:6])),
+        'volumen_por_grupo': {'dos': enteros[6], 'ges': enteros[7]},
+        'volumen_total': enteros[8],
+        'estaciones_por_estado': {'ALTO': enteros[9], 'MEDIO': enteros[10], 'BAJO': enteros[11]},
+        'promedio_filas': {'do_do_plus': promedios[0], 'ge_ge_plus': promedios[1]}
+    }
+
+# ================= PROYECCIÓN DE LECTURA =================
+# Sólo las columnas que usan paneles, exportaciones y estadísticas, como tuplas.
+# Los volúmenes agrupados y el estado salen calculados de la base.
+COLUMNAS_PROYECCION = ('id', 'codigo', 'razon_social', 'zona', 'provincia', 'municipio', *PRODUCTOS,
+                       'funcionario', 'filas_do_do_plus', 'filas_ge_ge_plus', 'fecha_hora',
+                       'usuario_actualizacion', 'volumen_total', 'volumen_dos', 'volumen_ges', 'estado_volumen')
+FilaEstacion = namedtuple('FilaEstacion', COLUMNAS_PROYECCION)
+ESTADOS_VOLUMEN = {estado['text']: estado for estado in map(calcular_estado, (7001, 3000, 0))}
+
+CABECERA_EXPORTACION = [
+    'CODIGO', 'RAZON SOCIAL ANH', 'ZONA', 'PROVINCIA', 'MUNICIPIO',
+    'DO/DO+ (LTS)', 'DO ULS+ (LTS)', 'GE/GE+ (LTS)', 'GP+ (LTS)', 
+    'GPULTRA100 (LTS)', 'VOLUMEN TOTAL', 'ESTADO', 'FUNCIONARIO',
+    'FILAS DO/DO+', 'FILAS GE/GE+', 'FECHA Y HORA DE ACTUALIZACION', 'USUARIO_ACTUALIZACION'
+]
+
+def columnas_proyeccion(modelo=RegistroCombustible, sufijo=''):
+    return [getattr(modelo, nombre).label(nombre + sufijo) for nombre in COLUMNAS_PROYECCION]
+
+def nueva_fila_estacion(id, codigo, razon_social, zona, provincia, municipio, productos, funcionario,
+                        filas_do_do_plus, filas_ge_ge_plus, fecha_hora, usuario_actualizacion):
+    """FilaEstacion armada fuera de la base: volúmenes agrupados y estado calculados aquí"""
+    dos = productos[0] + productos[1]
+    ges = productos[2] + productos[3] + productos[4]
+    return FilaEstacion(id, codigo, razon_social, zona, provincia, municipio, *productos, funcionario,
+                        filas_do_do_plus, filas_ge_ge_plus, fecha_hora, usuario_actualizacion,
+                        dos + ges, dos, ges, texto_estado_volumen(dos + ges))
+
+def filas_proyectadas(consulta):
+    """FilaEstacion de cada fila: los atributos de una namedtuple se leen más rápido que los de Row"""
+    return list(map(FilaEstacion._make, consulta))
+
+def obtener_ultimas_filas(fecha_inicio=None, fecha_fin=None, hora_inicio=None, hora_fin=None):
+    """Lo mismo que obtener_ultimos_registros, en filas de COLUMNAS_PROYECCION"""
+    filtros_fecha = filtros_rango_fechas(fecha_inicio, fecha_fin, hora_inicio, hora_fin)
+    return filas_proyectadas(consulta_ultimos(filtros_fecha, *columnas_proyeccion()))
+
+def fila_a_dict(fila):
+    """RegistroCombustible.to_dict() a partir de una fila proyectada"""
+    return {
+        'id': fila.id,
+        'codigo': fila.codigo,
+        'razonSocial': fila.razon_social,
+        'zona': fila.zona,
+        'provincia': fila.provincia,
+        'municipio': fila.municipio,
+        'doDoPlus': fila.do_do_plus,
+        'doUlsPlus': fila.do_uls_plus,
+        'geGePlus': fila.ge_ge_plus,
+        'gpPlus': fila.gp_plus,
+        'gpUltra100': fila.gp_ultra_100,
+        'funcionario': fila.funcionario,
+        'filasDoDoPlus': fila.filas_do_do_plus,
+        'filasGeGePlus': fila.filas_ge_ge_plus,
+        'volumenTotal': fila.volumen_total,
+        'volumenDOS': fila.volumen_dos,
+        'volumenGES': fila.volumen_ges,
+        'estadoVolumen': ESTADOS_VOLUMEN[fila.estado_volumen],
+        'fechaHora': fila.fecha_hora.strftime('%Y-%m-%d %H:%M:%S'),
+        'usuarioActualizacion': fila.usuario_actualizacion
+    }
+
+def fila_exportacion(fila):
+    """Valores de CABECERA_EXPORTACION para CSV y Excel"""
+    return [
+        fila.codigo,
+        fila.razon_social,
+        fila.zona,
+        fila.provincia,
+        fila.municipio,
+        fila.do_do_plus,
+        fila.do_uls_plus,
+        fila.ge_ge_plus,
+        fila.gp_plus,
+        fila.gp_ultra_100,
+        fila.volumen_total,
+        fila.estado_volumen,
+        fila.funcionario,
+        fila.filas_do_do_plus,
+        fila.filas_ge_ge_plus,
+        fila.fecha_hora.strftime('%Y-%m-%d %H:%M:%S'),
+        fila.usuario_actualizacion or ''
+    ]
+
+# ================= ALERTAS DE STOCK BAJO =================
+NIVELES_ALERTA = {
+    'total': RegistroCombustible.calcular_volumen_total,
+    'dos': RegistroCombustible.calcular_dos,
+    'ges': RegistroCombustible.calcular_ges,
+    **{producto: (lambda registro, producto=producto: getattr(registro, producto)) for producto in PRODUCTOS}
+}
+LOCK_ALERTAS = 7340301  # pg_advisory_xact_lock: las alertas se confirman en orden de id
+
+def leer_umbrales_alerta(texto):
+    """'total=3000,dos=3000' -> {'total': 3000, 'dos': 3000}"""
+    umbrales = {}
+    for parte in texto.split(','):
+        if not parte.strip():
+            continue
+        nivel, _, valor = parte.partition('=')
+        nivel = nivel.strip().lower()
+        if nivel not in NIVELES_ALERTA:
+            raise ValueError(f'Nivel de alerta desconocido: {nivel}')
+        umbrales[nivel] = int(valor)
+    return umbrales
+
+def leer_estados_estaciones(modelo, campo, primeros, filas_iniciales):
+    """Filas de estado de las estaciones, bloqueadas hasta el commit (FOR UPDATE).
+
+    primeros: {codigo: primer registro escrito de la estación}. Las filas que
+    faltan se crean con filas_iniciales(registro) mediante INSERT ... ON
+    CONFLICT DO NOTHING: si otra escritura crea la misma fila a la vez, ésta
+    espera su commit y continúa desde la fila ganadora.
+    """
+    estados = {}
+
+    def leer(codigos):
+        for i in range(0, len(codigos), 500):
+            for estado in modelo.query.filter(modelo.codigo.in_(codigos[i:i + 500])).with_for_update():
+                estados[(estado.codigo, getattr(estado, campo))] = estado
+
+    codigos = sorted(primeros)
+    leer(codigos)
+    faltantes = [fila for codigo in codigos for fila in filas_iniciales(primeros[codigo])
+                 if (codigo, fila[campo]) not in estados]
+    if faltantes:
+        if es_postgresql():
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        db.session.execute(insert(modelo.__table__).on_conflict_do_nothing(), faltantes)
+        leer(sorted({fila['codigo'] for fila in faltantes}))
+    return estados
+
+def evaluar_alertas(registros):
+    """Actualiza el estado de alerta de las estaciones de los registros recién escritos.
+
+    Se llama antes del commit, así estado y alertas quedan en la misma
+    transacción que los registros. Sólo se lee el estado de las estaciones
+    afectadas. Se entra en alerta por debajo del umbral y se sale al superar
+    el umbral más la histéresis. En DOS, GES y productos un valor 0 no cambia
+    el estado (la estación puede no vender ese producto).
+    """
+    umbrales = leer_umbrales_alerta(app.config['ALERTA_UMBRALES'])
+    if not registros or not umbrales:
+        return []
+    histeresis = app.config['ALERTA_HISTERESIS']
+    db.session.flush()
+
+    registros = sorted(registros, key=lambda r: (r.fecha_hora, r.id))
+    primeros = {}
+    for registro in registros:
+        primeros.setdefault(registro.codigo, registro)
+    estados = leer_estados_estaciones(EstadoAlertaEstacion, 'nivel', primeros, lambda registro: [
+        {'codigo': registro.codigo, 'nivel': nivel, 'en_alerta': False, 'valor': 0, 'fecha_hora': registro.fecha_hora}
+        for nivel in umbrales
+    ])
+
+    transiciones = []
+    for registro in registros:
+        for nivel, umbral in umbrales.items():
+            estado = estados[(registro.codigo, nivel)]
+            if registro.fecha_hora < estado.fecha_hora:
+                continue  # registro histórico: no cambia el estado actual
+            valor = NIVELES_ALERTA[nivel](registro)
+            estado.valor = valor
+            estado.fecha_hora = registro.fecha_hora
+            estado.registro_id = registro.id
+            if nivel != 'total' and valor == 0:
+                continue
+            if not estado.en_alerta and valor < umbral:
+                tipo = 'BAJO'
+            elif estado.en_alerta and valor >= round(umbral * (1 + histeresis), 6):  # 3000 * 1.1 no es exacto
+                tipo = 'RECUPERADO'
+            else:
+                continue
+            estado.en_alerta = tipo == 'BAJO'
+            transiciones.append((registro, nivel, tipo, valor, umbral))
+
+    if transiciones and es_postgresql():
+        db.session.execute(sa.text('SELECT pg_advisory_xact_lock(:clave)'), {'clave': LOCK_ALERTAS})
+    alertas = []
+    for registro, nivel, tipo, valor, umbral in transiciones:
+        alerta = AlertaCombustible(
+            codigo=registro.codigo, razon_social=registro.razon_social, nivel=nivel, tipo=tipo,
+            valor=valor, umbral=umbral, registro_id=registro.id, fecha_hora=registro.fecha_hora
+        )
+        db.session.add(alerta)
+        alertas.append(alerta)
+    return alertas
+
+def inicializar_alertas(lote=1000):
+    """Evalúa el estado actual de todas las estaciones (p. ej. tras activar las alertas)"""
+    ids = [fila[0] for fila in consulta_ultimos([], RegistroCombustible.id).order_by(RegistroCombustible.id)]
+    db.session.rollback()  # cerrar la lectura: cada lote abre su propia transacción de escritura
+    generadas = 0
+    for i in range(0, len(ids), lote):
+        with transaccion_escritura():
+            registros = RegistroCombustible.query.filter(RegistroCombustible.id.in_(ids[i:i + lote])).all()
+            generadas += len(evaluar_alertas(registros))
+            db.session.commit()
+    return {'estaciones': len(ids), 'alertas': generadas}
+
+# ================= PRONÓSTICO DE CONSUMO =================
+EPOCA = datetime(1970, 1, 1)
+
+def _actualizar_tasa(estado, valor, fecha_hora, vida_media):
+    """Un paso de la media exponencial, con peso según el tiempo transcurrido"""
+    horas = (fecha_hora - estado.fecha_hora).total_seconds() / 3600
+    consumo = estado.valor - valor
+    # Una recarga (consumo negativo) sólo mueve la lectura de referencia
+    if horas > 0 and consumo >= 0:
+        observada = consumo / horas
+        if estado.tasa is None:
+            estado.tasa = observada
+        else:
+            alfa = 1 - 0.5 ** (horas / vida_media)
+            estado.tasa += alfa * (observada - estado.tasa)
+    estado.valor = valor
+    estado.fecha_hora = fecha_hora
+
+def actualizar_tasas_consumo(registros):
+    """Actualiza la tasa de consumo de cada producto de las estaciones escritas.
+
+    O(1) por registro y producto: sólo se lee la fila de tasa de cada estación.
+    """
+    if not registros:
+        return
+    vida_media = app.config['CONSUMO_VIDA_MEDIA_HORAS']
+    db.session.flush()
+
+    registros = sorted(registros, key=lambda r: (r.fecha_hora, r.id))
+    primeros = {}
+    for registro in registros:
+        primeros.setdefault(registro.codigo, registro)
+    # Una estación nueva parte de su primera lectura, todavía sin tasa
+    estados = leer_estados_estaciones(TasaConsumoEstacion, 'producto', primeros, lambda registro: [
+        {'codigo': registro.codigo, 'producto': producto, 'valor': getattr(registro, producto) or 0,
+         'fecha_hora': registro.fecha_hora}
+        for producto in PRODUCTOS
+    ])
+
+    for registro in registros:
+        for producto in PRODUCTOS:
+            estado = estados[(registro.codigo, producto)]
+            if registro.fecha_hora < estado.fecha_hora:
+                continue  # registro histórico: lo incorpora recalcular_tasas_consumo
+            _actualizar_tasa(estado, getattr(registro, producto) or 0, registro.fecha_hora, vida_media)
+            estado.registro_id = registro.id
+            estado.vacio_estimado = TasaConsumoEstacion.estimar_vacio(estado.valor, estado.fecha_hora, estado.tasa)
+
+def recalcular_tasas_consumo():
+    """Recalcula todas las tasas desde el historial completo con numpy.
+
+    Equivale a aplicar _actualizar_tasa registro por registro. La media se
+    escribe como suma ponderada: cada observación pesa alfa * 0.5^(vidas
+    medias válidas hasta la última lectura de la estación), lo que se resuelve
+    con sumas acumuladas en lugar de un bucle por registro.
+    """
+    import numpy as np  # sólo lo usa este proceso por lotes
+
+    vida_media = app.config['CONSUMO_VIDA_MEDIA_HORAS']
+    with transaccion_escritura():
+        if es_postgresql():
+            # Las escrituras concurrentes esperan y continúan desde el resultado
+            db.session.execute(sa.text(f'LOCK TABLE {TasaConsumoEstacion.__tablename__} IN EXCLUSIVE MODE'))
+        filas = db.session.query(
+            RegistroCombustible.codigo,
+            RegistroCombustible.fecha_hora,
+            RegistroCombustible.id,
+            *[getattr(RegistroCombustible, producto) for producto in PRODUCTOS]
+        ).order_by(RegistroCombustible.codigo, RegistroCombustible.fecha_hora, RegistroCombustible.id).all()
+        TasaConsumoEstacion.query.delete()
+        if not filas:
+            db.session.commit()
+            return {'estaciones': 0, 'registros': 0}
+
+        n = len(filas)
+        codigos = [fila[0] for fila in filas]
+        # La fila anterior es de la misma estación
+        misma = np.zeros(n, dtype=bool)
+        misma[1:] = np.array(codigos[1:], dtype=object) == np.array(codigos[:-1], dtype=object)
+        grupo = np.cumsum(~misma) - 1
+        ultimas = np.r_[np.flatnonzero(~misma)[1:] - 1, n - 1]
+        n_grupos = len(ultimas)
+
+        horas = np.array([(fila[1] - EPOCA).total_seconds() for fila in filas]) / 3600
+        dt = np.zeros(n)
+        dt[1:] = np.diff(horas)
+
+        nuevas = [{'codigo': codigos[k], 'fecha_hora': filas[k][1], 'registro_id': filas[k][2]} for k in ultimas]
+        filas_tasa = []
+        for j, producto in enumerate(PRODUCTOS):
+            valores = np.array([fila[3 + j] or 0 for fila in filas], dtype=float)
+            consumo = np.zeros(n)
+            consumo[1:] = valores[:-1] - valores[1:]
+            valida = misma & (dt > 0) & (consumo >= 0)
+            observada = np.where(valida, consumo / np.where(valida, dt, 1), 0.0)
+            vidas = np.where(valida, dt / vida_media, 0.0)
+            alfa = np.where(valida, 1 - 0.5 ** vidas, 0.0)
+
+            # La primera observación válida de cada estación inicializa la media
+            acumuladas = np.cumsum(valida)
+            previas = np.r_[0, acumuladas][np.flatnonzero(~misma)][grupo]
+            alfa[valida & (acumuladas - previas == 1)] = 1.0
+
+            decaimiento = np.cumsum(vidas)
+            peso = alfa * 0.5 ** (decaimiento[ultimas][grupo] - decaimiento)
+            tasas = np.bincount(grupo, weights=peso * observada, minlength=n_grupos)
+            con_tasa = np.bincount(grupo, weights=valida, minlength=n_grupos) > 0
+
+            for g, k in enumerate(ultimas):
+                tasa = float(tasas[g]) if con_tasa[g] else None
+                valor = int(valores[k])
+                filas_tasa.append({
+                    **nuevas[g], 'producto': producto, 'valor': valor, 'tasa': tasa,
+                    'vacio_estimado': TasaConsumoEstacion.estimar_vacio(valor, nuevas[g]['fecha_hora'], tasa)
+                })
+
+        for i in range(0, len(filas_tasa), 5000):
+            db.session.execute(sa.insert(TasaConsumoEstacion), filas_tasa[i:i + 5000])
+        db.session.commit()
+    return {'estaciones': n_grupos, 'registros': n}
+
+def obtener_pronostico(horas=24, limite=100, codigo=None):
+    """Productos que se estima quedarán vacíos dentro de las próximas horas"""
+    consulta = db.session.query(TasaConsumoEstacion, RegistroCombustible.razon_social).join(
+        RegistroCombustible, RegistroCombustible.id == TasaConsumoEstacion.registro_id
+    )
+    if codigo:
+        consulta = consulta.filter(TasaConsumoEstacion.codigo == codigo)
+    else:
+        # Los productos ya en 0 los cubren las alertas de stock bajo
+        consulta = consulta.filter(
+            TasaConsumoEstacion.valor > 0,
+            TasaConsumoEstacion.vacio_estimado <= datetime.utcnow() + timedelta(hours=horas)
+        )
+    ahora = datetime.utcnow()
+    return [{
+        'codigo': tasa.codigo,
+        'razonSocial': razon_social,
+        'producto': tasa.producto,
+        'litros': tasa.valor,
+        'fechaHora': tasa.fecha_hora.strftime('%Y-%m-%d %H:%M:%S'),
+        'tasaLitrosHora': round(tasa.tasa, 1) if tasa.tasa is not None else None,
+        'vacioEstimado': tasa.vacio_estimado.strftime('%Y-%m-%d %H:%M') if tasa.vacio_estimado else None,
+        'horasRestantes': round((tasa.vacio_estimado - ahora).total_seconds() / 3600, 1) if tasa.vacio_estimado else None
+    } for tasa, razon_social in consulta.order_by(
+        TasaConsumoEstacion.vacio_estimado, TasaConsumoEstacion.codigo
+    ).limit(limite)]
+
+# ================= HISTORIAL POR ESTACIÓN =================
+# Hasta puntos * HISTORIAL_FILAS_POR_PUNTO filas se leen todas; con más, el
+# rango se muestrea con una búsqueda en el índice por sub-intervalo.
+HISTORIAL_FILAS_POR_PUNTO = 20
+HISTORIAL_MUESTRAS_POR_PUNTO = 4
+HISTORIAL_LOTE_MUESTREO = 400  # SQLite admite hasta 500 términos en un UNION ALL
+
+def lttb(serie, umbral):
+    """Largest-Triangle-Three-Buckets: reduce la serie [(x, y), ...] a `umbral` puntos conservando su forma"""
+    n = len(serie)
+    if umbral >= n or umbral < 3:
+        return list(serie)
+    salida = [serie[0]]
+    ancho = (n - 2) / (umbral - 2)
+    anterior = 0
+    for i in range(umbral - 2):
+        inicio_sig = int((i + 1) * ancho) + 1
+        fin_sig = min(int((i + 2) * ancho) + 1, n)
+        prom_x = sum(p[0] for p in serie[inicio_sig:fin_sig]) / (fin_sig - inicio_sig)
+        prom_y = sum(p[1] for p in serie[inicio_sig:fin_sig]) / (fin_sig - inicio_sig)
+        ax, ay = serie[anterior]
+        mejor, area_max = inicio_sig - 1, -1.0
+        for j in range(int(i * ancho) + 1, inicio_sig):
+            area = abs((ax - prom_x) * (serie[j][1] - ay) - (ax - serie[j][0]) * (prom_y - ay))
+            if area > area_max:
+                mejor, area_max = j, area
+        salida.append(serie[mejor])
+        anterior = mejor
+    salida.append(serie[-1])
+    return salida
+
+def _columnas_historial():
+    return (RegistroCombustible.id, RegistroCombustible.fecha_hora,
+            *[getattr(RegistroCombustible, producto) for producto in PRODUCTOS])
+
+def _muestrear_historial(codigo, desde, hasta, muestras):
+    """Primer registro de cada sub-intervalo: una búsqueda por índice en cada uno"""
+    paso = (hasta - desde) / muestras
+    # PostgreSQL tipa como texto un parámetro suelto en un CTE; en SQLite el CAST lo volvería número
+    plantilla = 'SELECT CAST(:i{0} AS TIMESTAMP) AS inicio' if es_postgresql() else 'SELECT :i{0} AS inicio'
+    ids = set()
+    for lote in range(0, muestras, HISTORIAL_LOTE_MUESTREO):
+        indices = range(lote, min(lote + HISTORIAL_LOTE_MUESTREO, muestras))
+        inicios = sa.text(' UNION ALL '.join(plantilla.format(i) for i in indices)).bindparams(
+            *[sa.bindparam(f'i{i}', desde + paso * i, type_=sa.DateTime) for i in indices]
+        ).columns(sa.column('inicio', sa.DateTime)).cte('inicios')
+        primero = sa.select(RegistroCombustible.id).where(
+            RegistroCombustible.codigo == codigo,
+            RegistroCombustible.fecha_hora >= inicios.c.inicio,
+            RegistroCombustible.fecha_hora <= hasta
+        ).order_by(RegistroCombustible.fecha_hora, RegistroCombustible.id).limit(1).scalar_subquery()
+        ids.update(i for (i,) in db.session.execute(sa.select(primero).select_from(inicios)) if i is not None)
+    # Por clave primaria: filtrar también por fecha haría recorrer todo el rango
+    return db.session.query(*_columnas_historial()).filter(
+        RegistroCombustible.id.in_(ids)
+    ).order_by(RegistroCombustible.fecha_hora, RegistroCombustible.id).all()
+
+def historial_estacion(codigo, desde, hasta, puntos=500):
+    """Serie de cada producto (y del total) de una estación, reducida a `puntos` puntos.
+
+    El trabajo está acotado por `puntos`, no por la duración del rango: se leen
+    como máximo puntos * HISTORIAL_FILAS_POR_PUNTO filas del índice
+    (codigo, fecha_hora). Si el rango tiene más, se toma una muestra con
+    HISTORIAL_MUESTRAS_POR_PUNTO búsquedas por punto y luego se aplica LTTB.
+    """
+    en_rango = db.session.query(*_columnas_historial()).filter(
+        RegistroCombustible.codigo == codigo,
+        RegistroCombustible.fecha_hora >= desde,
+        RegistroCombustible.fecha_hora <= hasta
+    ).order_by(RegistroCombustible.fecha_hora, RegistroCombustible.id)
+    # Saltar `tope` entradas del índice dice si el rango es denso sin traer las filas
+    muestreado = en_rango.with_entities(RegistroCombustible.id).offset(
+        puntos * HISTORIAL_FILAS_POR_PUNTO).limit(1).scalar() is not None
+    if muestreado:
+        filas = _muestrear_historial(codigo, desde, hasta, puntos * HISTORIAL_MUESTRAS_POR_PUNTO)
+    else:
+        filas = en_rango.all()
+
+    tiempos = [int((fila[1] - EPOCA).total_seconds() * 1000) for fila in filas]
+    series = {}
+    for j, producto in enumerate(PRODUCTOS):
+        series[producto] = lttb(list(zip(tiempos, [fila[2 + j] or 0 for fila in filas])), puntos)
+    series['total'] = lttb(list(zip(tiempos, [sum(v or 0 for v in fila[2:]) for fila in filas])), puntos)
+    return {
+        'codigo': codigo,
+        'registros_leidos': len(filas),
+        'muestreado': muestreado,
+        'series': {nombre: [list(p) for p in serie] for nombre, serie in series.items()}
+    }
+
+def procesar_registros_nuevos(registros):
+    """Actualiza lo que se deriva de los registros recién escritos, antes del commit"""
+    evaluar_alertas(registros)
+    actualizar_tasas_consumo(registros)
+
+# ================= INSTANTÁNEAS Y DIFERENCIAS =================
+FORMATOS_MOMENTO = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+METRICAS_DIFERENCIA = ('volumen_total', 'volumen_dos', 'volumen_ges', *PRODUCTOS)
+NOMBRES_METRICAS = {'volumen_total': 'VOLUMEN TOTAL', 'volumen_dos': 'DOS', 'volumen_ges': 'GES',
+                    **{producto: COLUMNAS_NUMERICAS[producto] for producto in PRODUCTOS}}
+
+def leer_momento(texto):
+    """'YYYY-MM-DD[ HH:MM[:SS]]' (también con T) -> datetime. ValueError si no coincide"""
+    for fmt in FORMATOS_MOMENTO:
+        try:
+            return datetime.strptime((texto or '').strip(), fmt)
+        except ValueError:
+            continue
+    raise ValueError(texto)
+
+def _codigos_registrados():
+    """Códigos distintos de registro_combustible sin recorrer la tabla.
+
+    CTE recursivo que salta en el índice (codigo, fecha_hora) de cada código
+    al siguiente: una búsqueda por estación.
+    """
+    siguiente = sa.orm.aliased(RegistroCombustible)
+    codigos = sa.select(db.func.min(RegistroCombustible.codigo).label('codigo')).cte('codigos', recursive=True)
+    return codigos.union_all(
+        sa.select(
+            sa.select(db.func.min(siguiente.codigo)).where(siguiente.codigo > codigos.c.codigo).scalar_subquery()
+        ).where(codigos.c.codigo.isnot(None))
+    )
+
+def consulta_instantaneas(momentos):
+    """Una fila por estación: codigo y un bloque de COLUMNAS_PROYECCION por cada momento.
+
+    Cada bloque es el último registro con fecha_hora <= momento, buscado en
+    el índice (codigo, fecha_hora) de atrás hacia adelante. En PostgreSQL es
+    un LEFT JOIN LATERAL por momento; en SQLite, una subconsulta correlacionada
+    que da el id y un join por clave primaria. El bloque es NULL si la estación
+    no tenía registros en ese momento.
+    """
+    codigos = _codigos_registrados()
+    columnas = [codigos.c.codigo]
+    origen = codigos
+    for i, momento in enumerate(momentos):
+        registro = sa.orm.aliased(RegistroCombustible)
+        if es_postgresql():
+            ultimo = sa.select(*columnas_proyeccion(registro)).where(
+                registro.codigo == codigos.c.codigo,
+                registro.fecha_hora <= momento
+            ).order_by(registro.fecha_hora.desc(), registro.id.desc()).limit(1).lateral(f'momento_{i}')
+            origen = origen.outerjoin(ultimo, sa.true())
+            columnas += [ultimo.c[nombre].label(f'{nombre}_{i}') for nombre in COLUMNAS_PROYECCION]
+        else:
+            buscado = sa.orm.aliased(RegistroCombustible)
+            ultimo_id = sa.select(buscado.id).where(
+                buscado.codigo == codigos.c.codigo,
+                buscado.fecha_hora <= momento
+            ).order_by(buscado.fecha_hora.desc(), buscado.id.desc()).limit(1).correlate(codigos).scalar_subquery()
+            origen = origen.outerjoin(registro, registro.id == ultimo_id)
+            columnas += columnas_proyeccion(registro, f'_{i}')
+    return sa.select(*columnas).select_from(origen).where(codigos.c.codigo.isnot(None)).order_by(codigos.c.codigo)
+
+def cierres_antes(momento):
+    """{codigo: FilaEstacion} del último cierre diario hasta momento, si hay días compactados.
+
+    La compactación borra los registros crudos viejos y deja su cierre en
+    ResumenDiarioCombustible; estas filas tienen id None.
+    """
+    resumen = ResumenDiarioCombustible
+    hay_compactados = db.session.query(resumen.id).filter(resumen.fecha <= momento.date()).limit(1).scalar()
+    if not hay_compactados:
+        return {}
+    orden = db.func.row_number().over(partition_by=resumen.codigo,
+                                      order_by=resumen.fecha_hora_ultima.desc()).label('orden')
+    ultimos = db.session.query(resumen.id, orden).filter(resumen.fecha_hora_ultima <= momento).subquery()
+    cierres = {}
+    for r in db.session.query(resumen).join(ultimos, resumen.id == ultimos.c.id).filter(ultimos.c.orden == 1):
+        cierres[r.codigo] = nueva_fila_estacion(
+            None, r.codigo, r.razon_social, r.zona, r.provincia, r.municipio,
+            [getattr(r, producto) or 0 for producto in PRODUCTOS], r.funcionario,
+            r.filas_do_do_plus, r.filas_ge_ge_plus, r.fecha_hora_ultima, None
+        )
+    return cierres
+
+def instantaneas(momentos):
+    """[(codigo, [FilaEstacion o None por momento]), ...] en una sola consulta"""
+    ancho = len(COLUMNAS_PROYECCION)
+    cierres = [cierres_antes(momento) for momento in momentos]
+    resultado = []
+    for fila in db.session.execute(consulta_instantaneas(momentos)):
+        codigo = fila[0]
+        estados = []
+        for i in range(len(momentos)):
+            valores = fila[1 + i * ancho:1 + (i + 1) * ancho]
+            estado = FilaEstacion._make(valores) if valores[0] is not None else None
+            cierre = cierres[i].get(codigo)
+            if cierre is not None and (estado is None or cierre.fecha_hora > estado.fecha_hora):
+                estado = cierre
+            estados.append(estado)
+        if any(estados):
+            resultado.append((codigo, estados))
+    return resultado
+
+def _metricas(fila):
+    return {metrica: getattr(fila, metrica) if fila else 0 for metrica in METRICAS_DIFERENCIA}
+
+def diferencia_instantaneas(antes, despues):
+    """Cambios por estación y por provincia entre dos momentos.
+
+    Las dos instantáneas salen de la misma consulta y los totales por
+    provincia se acumulan en la misma pasada que las estaciones. Una estación
+    sin registros en uno de los momentos cuenta con volumen 0 en él.
+    """
+    estaciones = []
+    provincias = {}
+    for codigo, (fila_antes, fila_despues) in instantaneas([antes, despues]):
+        referencia = fila_despues or fila_antes
+        valores_antes = _metricas(fila_antes)
+        valores_despues = _metricas(fila_despues)
+        cambio = {metrica: valores_despues[metrica] - valores_antes[metrica] for metrica in METRICAS_DIFERENCIA}
+        estaciones.append({
+            'codigo': codigo,
+            'razon_social': referencia.razon_social,
+            'zona': referencia.zona,
+            'provincia': referencia.provincia,
+            'municipio': referencia.municipio,
+            'fecha_antes': fila_antes.fecha_hora.strftime('%Y-%m-%d %H:%M:%S') if fila_antes else None,
+            'fecha_despues': fila_despues.fecha_hora.strftime('%Y-%m-%d %H:%M:%S') if fila_despues else None,
+            'estado_antes': fila_antes.estado_volumen if fila_antes else None,
+            'estado_despues': fila_despues.estado_volumen if fila_despues else None,
+            'antes': valores_antes,
+            'despues': valores_despues,
+            'cambio': cambio,
+        })
+        provincia = provincias.get(referencia.provincia)
+        if provincia is None:
+            provincia = provincias[referencia.provincia] = {
+                'provincia': referencia.provincia, 'estaciones': 0,
+                'antes': dict.fromkeys(METRICAS_DIFERENCIA, 0),
+                'despues': dict.fromkeys(METRICAS_DIFERENCIA, 0),
+                'cambio': dict.fromkeys(METRICAS_DIFERENCIA, 0),
+            }
+        provincia['estaciones'] += 1
+        for metrica in METRICAS_DIFERENCIA:
+            provincia['antes'][metrica] += valores_antes[metrica]
+            provincia['despues'][metrica] += valores_despues[metrica]
+            provincia['cambio'][metrica] += cambio[metrica]
+    return {'estaciones': estaciones, 'provincias': [provincias[p] for p in sorted(provincias)]}
+
+def csv_diferencia(diferencia, nivel):
+    """CSV de diferencia_instantaneas: una fila por estación o por provincia"""
+    output = StringIO()
+    writer = csv.writer(output)
+    columnas_metricas = [f'{NOMBRES_METRICAS[m]} {momento}' for m in METRICAS_DIFERENCIA
+                         for momento in ('ANTES', 'DESPUES', 'CAMBIO')]
+    if nivel == 'provincia':
+        writer.writerow(['PROVINCIA', 'ESTACIONES', *columnas_metricas])
+        filas = diferencia['provincias']
+    else:
+        writer.writerow(['CODIGO', 'RAZON SOCIAL ANH', 'ZONA', 'PROVINCIA', 'MUNICIPIO',
+                         'FECHA ANTES', 'FECHA DESPUES', 'ESTADO ANTES', 'ESTADO DESPUES', *columnas_metricas])
+        filas = diferencia['estaciones']
+    for fila in filas:
+        if nivel == 'provincia':
+            inicio = [fila['provincia'], fila['estaciones']]
+        else:
+            inicio = [fila['codigo'], fila['razon_social'], fila['zona'], fila['provincia'], fila['municipio'],
+                      fila['fecha_antes'] or '', fila['fecha_despues'] or '',
+                      fila['estado_antes'] or '', fila['estado_despues'] or '']
+        writer.writerow(inicio + [fila[momento][m] for m in METRICAS_DIFERENCIA
+                                  for momento in ('antes', 'despues', 'cambio')])
+    return output.getvalue()
+
+# ================= EXPORTACIÓN INCREMENTAL =================
+COLUMNAS_DELTA = ('id', 'codigo', 'razon_social', 'zona', 'provincia', 'municipio', *PRODUCTOS,
+                  'funcionario', 'filas_do_do_plus', 'filas_ge_ge_plus', 'fecha_hora',
+                  'usuario_actualizacion', 'tipo_registro')
+DELTA_LOTE = 1000
+
+def leer_cursor_delta(texto):
+    """'<id>' o '<id>:<id marca>:<xid marca>' -> (id, marca o None). ValueError si está mal formado"""
+    partes = [int(p) for p in (texto or '0').split(':')]
+    if len(partes) == 1:
+        return partes[0], None
+    if len(partes) == 3:
+        return partes[0], (partes[1], partes[2])
+    raise ValueError(texto)
+
+def formatear_cursor_delta(ultimo_id, marca):
+    return f'{ultimo_id}:{marca[0]}:{marca[1]}' if marca else str(ultimo_id)
+
+def horizonte_delta(marca):
+    """Mayor id exportable sin saltarse registros aún sin confirmar, y la marca a devolver.
+
+    En SQLite hay un único escritor y los ids se confirman en orden. En
+    PostgreSQL una transacción lenta puede confirmar un id menor que otro ya
+    visible; la marca (máximo id visible, xmax del snapshot) de una petición
+    queda asentada en cuanto el xmin de una posterior la alcanza, y recién
+    entonces se exporta hasta ese id.
+    """
+    if not es_postgresql():
+        return None, None
+    instantanea = sa.func.txid_current_snapshot()
+    xmin, xmax, max_id = db.session.execute(sa.select(
+        sa.func.txid_snapshot_xmin(instantanea),
+        sa.func.txid_snapshot_xmax(instantanea),
+        sa.func.max(RegistroCombustible.id)
+    )).one()
+    max_id = max_id or 0
+    if xmin == xmax:
+        # Ninguna transacción con escrituras en curso: todo lo visible es definitivo
+        return max_id, None
+    if marca is None:
+        return 0, (max_id, xmax)
+    if xmin >= marca[1]:
+        return marca[0], (max_id, xmax)
+    return 0, marca
+
+def preparar_delta(cursor, marca, limite):
+    """Fija el tramo (cursor, hasta] a exportar: una lectura del índice de la clave primaria"""
+    horizonte, marca = horizonte_delta(marca)
+    filtros = [RegistroCombustible.id > cursor]
+    if horizonte is not None:
+        filtros.append(RegistroCombustible.id <= horizonte)
+    tramo = (db.session.query(RegistroCombustible.id).filter(*filtros)
+             .order_by(RegistroCombustible.id).limit(limite).subquery())
+    hasta, filas = db.session.query(db.func.max(tramo.c.id), db.func.count()).select_from(tramo).one()
+    return (hasta or cursor), filas, marca
+
+def filas_delta(cursor, hasta):
+    """Tuplas de COLUMNAS_DELTA con cursor < id <= hasta, por lotes recorriendo la clave primaria"""
+    columnas = [getattr(RegistroCombustible, nombre) for nombre in COLUMNAS_DELTA]
+    while cursor < hasta:
+        lote = (db.session.query(*columnas)
+                .filter(RegistroCombustible.id > cursor, RegistroCombustible.id <= hasta)
+                .order_by(RegistroCombustible.id).limit(DELTA_LOTE).all())
+        if not lote:
+            break
+        yield from lote
+        cursor = lote[-1][0]
+
+def serializar_delta(filas, formato):
+    """Genera el cuerpo CSV (con cabecera) o NDJSON línea a línea"""
+    indice_fecha = COLUMNAS_DELTA.index('fecha_hora')
+    if formato == 'csv':
+        salida = StringIO()
+        writer = csv.writer(salida)
+        writer.writerow(COLUMNAS_DELTA)
+    for fila in filas:
+        fila = list(fila)
+        fila[indice_fecha] = fila[indice_fecha].strftime('%Y-%m-%d %H:%M:%S')
+        if formato == 'csv':
+            writer.writerow(fila)
+            if salida.tell() >= 64 * 1024:
+                yield salida.getvalue()
+                salida.seek(0)
+                salida.truncate()
+        else:
+            yield json.dumps(dict(zip(COLUMNAS_DELTA, fila)), ensure_ascii=False) + '\n'
+    if formato == 'csv' and salida.tell():
+        yield salida.getvalue()
+
+# ================= CACHÉ DE FRAGMENTOS DEL PANEL =================
+# Grupo de datos que invalida cada modelo. Las inserciones de registros no
+# cuentan: las refleja el máximo id de registro_combustible sin escribir nada.
+CLAVES_VERSION = {
+    Usuario: 'usuarios',
+    AsignacionEstacion: 'usuarios',
+    RegistroCombustible: 'registros',
+}
+
+def incrementar_version(sesion, clave):
+    """Incrementa el contador en la transacción de la sesión (se deshace con ella)"""
+    tabla = VersionDatos.__table__
+    conexion = sesion.connection()
+    actualizados = conexion.execute(
+        tabla.update().where(tabla.c.clave == clave).values(version=tabla.c.version + 1)
+    ).rowcount
+    if not actualizados:
+        conexion.execute(tabla.insert().values(clave=clave, version=1))
+
+@sa.event.listens_for(SesionEnrutada, 'after_flush')
+def _versionar_cambios(sesion, contexto_flush):
+    claves = {CLAVES_VERSION[type(o)] for o in sesion.dirty | sesion.deleted if type(o) in CLAVES_VERSION}
+    claves |= {CLAVES_VERSION[type(o)] for o in sesion.new
+               if type(o) in CLAVES_VERSION and type(o) is not RegistroCombustible}
+    for clave in sorted(claves):
+        incrementar_version(sesion, clave)
+
+@sa.event.listens_for(SesionEnrutada, 'do_orm_execute')
+def _versionar_masivos(estado):
+    # query.delete()/update() no pasan por el flush
+    if (estado.is_update or estado.is_delete) and estado.bind_mapper is not None:
+        clave = CLAVES_VERSION.get(estado.bind_mapper.class_)
+        if clave:
+            incrementar_version(estado.session, clave)
+
+def version_datos():
+    """Versión actual de (registros, usuarios): dos lecturas por clave primaria"""
+    versiones = dict(db.session.query(VersionDatos.clave, VersionDatos.version).all())
+    max_id = db.session.query(db.func.max(RegistroCombustible.id)).scalar() or 0
+    return (max_id, versiones.get('registros', 0)), versiones.get('usuarios', 0)
+
+class CacheFragmentos:
+    """LRU de HTML renderizado, acotado en bytes.
+
+    Cada entrada guarda la versión de datos con la que se generó y sólo se
+    sirve mientras esa versión siga vigente. La vida máxima cubre los ids que
+    PostgreSQL confirma fuera de orden, que no mueven el máximo id.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entradas = OrderedDict()
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, nombre, clave, version):
+        with self.lock:
+            entrada = self.entradas.get((nombre, clave))
+            if entrada and entrada[0] == version and time.monotonic() - entrada[1] < self.ttl:
+                self.entradas.move_to_end((nombre, clave))
+                self.aciertos += 1
+                return entrada[2]
+            self.fallos += 1
+            return None
+
+    def vaciar(self):
+        with self.lock:
+            self.entradas.clear()
+            self.bytes = 0
+
+    def guardar(self, nombre, clave, version, html):
+        tamano = sys.getsizeof(html)
+        with self.lock:
+            anterior = self.entradas.pop((nombre, clave), None)
+            if anterior:
+                self.bytes -= anterior[3]
+            if tamano > self.max_bytes:
+                return
+            self.entradas[(nombre, clave)] = (version, time.monotonic(), html, tamano)
+            self.bytes += tamano
+            while self.bytes > self.max_bytes:
+                _, descartada = self.entradas.popitem(last=False)
+                self.bytes -= descartada[3]
+
+cache_fragmentos = CacheFragmentos(app.config['FRAGMENTOS_CACHE_MB'] * 1024 * 1024,
+                                   app.config['FRAGMENTOS_TTL'])
+
+def componer_fragmentos(grupos):
+    """Renderiza sólo los fragmentos cuya versión cambió.
+
+    grupos: lista de (nombres, clave, version, cargar). cargar() devuelve el
+    contexto de las plantillas del grupo y sólo se llama si falta alguna.
+    """
+    fragmentos = {}
+    for nombres, clave, version, cargar in grupos:
+        contexto = None
+        for nombre in nombres:
+            html = cache_fragmentos.obtener(nombre, clave, version)
+            if html is None:
+                if contexto is None:
+                    contexto = cargar()
+                html = render_template(f'fragmentos/{nombre}.html', **contexto)
+                cache_fragmentos.guardar(nombre, clave, version, html)
+            fragmentos[nombre] = Markup(html)
+    return fragmentos
+
+# ================= ESTADO ACTUAL EN MEMORIA =================
+CAMPOS_VOLUMEN = (*PRODUCTOS, 'filas_do_do_plus', 'filas_ge_ge_plus')
+CAMPOS_TEXTO_ESTADO = ('codigo', 'razon_social', 'zona', 'provincia', 'municipio',
+                       'funcionario', 'usuario_actualizacion')
+# Valores que se repiten entre estaciones: se guarda una sola copia de cada uno
+CAMPOS_INTERNADOS = ('zona', 'provincia', 'municipio', 'funcionario', 'usuario_actualizacion')
+COLUMNAS_ESTADO = ('id', 'fecha_hora', *CAMPOS_TEXTO_ESTADO, *CAMPOS_VOLUMEN)
+UN_MICROSEGUNDO = timedelta(microseconds=1)
+
+class TablaEstado:
+    """Una fila por estación en arreglos paralelos: enteros de 64 bits y cadenas compartidas"""
+    __slots__ = ('posicion', 'ids', 'fechas', 'textos', 'numeros', 'max_fecha')
+
+    def __init__(self):
+        self.posicion = {}  # codigo -> fila
+        self.ids = array('q')
+        self.fechas = array('q')  # microsegundos desde EPOCA
+        self.textos = {campo: [] for campo in CAMPOS_TEXTO_ESTADO}
+        self.numeros = {campo: array('q') for campo in CAMPOS_VOLUMEN}
+        self.max_fecha = None
+
+    def aplicar(self, fila):
+        """Guarda una fila de COLUMNAS_ESTADO si es posterior a la vigente de su estación"""
+        registro_id, fecha_hora, codigo = fila[0], fila[1], fila[2]
+        fecha = (fecha_hora - EPOCA) // UN_MICROSEGUNDO
+        i = self.posicion.get(codigo)
+        if i is not None and (fecha, registro_id) <= (self.fechas[i], self.ids[i]):
+            return
+        valores = dict(zip(COLUMNAS_ESTADO, fila))
+        for campo in CAMPOS_INTERNADOS:
+            if valores[campo] is not None:
+                valores[campo] = sys.intern(valores[campo])
+        if i is None:
+            self.posicion[codigo] = len(self.ids)
+            self.ids.append(registro_id)
+            self.fechas.append(fecha)
+            for campo, lista in self.textos.items():
+                lista.append(valores[campo])
+            for campo, arreglo in self.numeros.items():
+                arreglo.append(valores[campo] or 0)
+        else:
+            self.ids[i] = registro_id
+            self.fechas[i] = fecha
+            for campo, lista in self.textos.items():
+                lista[i] = valores[campo]
+            for campo, arreglo in self.numeros.items():
+                arreglo[i] = valores[campo] or 0
+        if self.max_fecha is None or fecha > self.max_fecha:
+            self.max_fecha = fecha
+
+    def estacion(self, i):
+        """FilaEstacion de la fila i, igual a la que devuelve obtener_ultimas_filas"""
+        textos = self.textos
+        return nueva_fila_estacion(
+            self.ids[i], textos['codigo'][i], textos['razon_social'][i], textos['zona'][i],
+            textos['provincia'][i], textos['municipio'][i],
+            [self.numeros[producto][i] for producto in PRODUCTOS], textos['funcionario'][i],
+            self.numeros['filas_do_do_plus'][i], self.numeros['filas_ge_ge_plus'][i],
+            EPOCA + self.fechas[i] * UN_MICROSEGUNDO, textos['usuario_actualizacion'][i]
+        )
+
+    def bytes_aproximados(self):
+        """Arreglos, listas, índice y cadenas propias (las internadas se cuentan una vez)"""
+        total = sys.getsizeof(self.posicion) + sys.getsizeof(self.ids) + sys.getsizeof(self.fechas)
+        total += sum(sys.getsizeof(arreglo) for arreglo in self.numeros.values())
+        vistas = set()
+        for lista in self.textos.values():
+            total += sys.getsizeof(lista)
+            for texto in lista:
+                if id(texto) not in vistas:
+                    vistas.add(id(texto))
+                    total += sys.getsizeof(texto)
+        return total
+
+class EstadoEstaciones:
+    """Último registro de cada estación, cargado una vez y compartido por los hilos del worker.
+
+    Se mantiene al día de tres formas: los commits de este proceso aplican sus
+    registros nuevos al confirmarse; un hilo sondea la base cada
+    ESTADO_MEMORIA_SONDEO segundos (ids nuevos con el mismo horizonte que la
+    exportación incremental); y una modificación o borrado de registros, que
+    incrementa la versión 'registros', obliga a recargar todo.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lock_sincronizacion = threading.Lock()
+        self.tabla = None
+        self.version = None
+        self.cursor = 0
+        self.marca = None
+        self.max_id = 0
+        self.hilo = None
+        self.pid = None
+
+    def aplicar(self, filas):
+        with self.lock:
+            if self.tabla is None:
+                return
+            for fila in filas:
+                self.tabla.aplicar(fila)
+                self.max_id = max(self.max_id, fila[0])
+
+    def _leer(self, filtros):
+        columnas = [getattr(RegistroCombustible, nombre) for nombre in COLUMNAS_ESTADO]
+        return db.session.query(*columnas).filter(*filtros).order_by(RegistroCombustible.id)
+
+    def _recargar(self, version, max_id):
+        horizonte, marca = horizonte_delta(None)
+        for _ in range(40):
+            if horizonte != 0:
+                break
+            # Hay escrituras en curso en PostgreSQL: se espera a que las anteriores confirmen
+            time.sleep(0.05)
+            horizonte, marca = horizonte_delta(marca)
+        else:
+            raise RuntimeError('escrituras en curso, no se pudo fijar el horizonte de carga')
+        hasta = max_id if horizonte is None else horizonte
+        tabla = TablaEstado()
+        columnas = [getattr(RegistroCombustible, nombre) for nombre in COLUMNAS_ESTADO]
+        for fila in consulta_ultimos([RegistroCombustible.id <= hasta], *columnas).order_by(RegistroCombustible.id):
+            tabla.aplicar(fila)
+        with self.lock:
+            self.tabla = tabla
+            self.version = version
+            self.cursor = hasta
+            self.marca = marca
+            self.max_id = max(self.max_id, hasta)
+
+    def sincronizar(self):
+        """Trae lo que cambió en la base desde la última lectura. Requiere contexto de aplicación"""
+        with self.lock_sincronizacion:
+            (max_id, version), _ = version_datos()
+            if self.tabla is None or version > self.version:
+                self._recargar(version, max_id)
+                return
+            horizonte, marca = horizonte_delta(self.marca)
+            self.marca = marca
+            if horizonte == 0 or (horizonte is not None and horizonte <= self.cursor):
+                return
+            hasta = max_id if horizonte is None else horizonte
+            while self.cursor < hasta:
+                lote = self._leer([RegistroCombustible.id > self.cursor,
+                                   RegistroCombustible.id <= hasta]).limit(DELTA_LOTE).all()
+                if not lote:
+                    break
+                self.aplicar(lote)
+                self.cursor = lote[-1][0]
+            self.cursor = max(self.cursor, hasta)
+
+    def _asegurar_hilo(self):
+        # Con preload_app el módulo se importa antes del fork: el hilo se arranca en cada worker
+        if self.pid == os.getpid() and self.hilo.is_alive():
+            return
+        with self.lock:
+            if self.pid != os.getpid() or not self.hilo.is_alive():
+                self.pid = os.getpid()
+                self.hilo = threading.Thread(target=self._sondear, name='estado-estaciones', daemon=True)
+                self.hilo.start()
+
+    def _sondear(self):
+        while True:
+            time.sleep(app.config['ESTADO_MEMORIA_SONDEO'])
+            try:
+                with app.app_context():
+                    self.sincronizar()
+            except Exception as e:
+                print(f"⚠️  No se pudo sincronizar el estado en memoria: {e}")
+
+    def consultar(self, desde=None, hasta=None, codigos=None, funcionario=None, version=None, secuencia=0):
+        """FilaEstacion de las estaciones cuyo último registro cae en [desde, hasta].
+
+        Con funcionario, sólo las estaciones cuyo último registro es suyo.
+
+        version (de version_datos) y secuencia (id que el usuario ya escribió)
+        fuerzan una sincronización si el estado está atrasado respecto de ellas.
+        Devuelve None si el estado está desactivado o no puede responder: el
+        último registro de alguna estación es posterior a hasta, o la base falló.
+        """
+        if not app.config['ESTADO_MEMORIA']:
+            return None
+        try:
+            self._asegurar_hilo()
+            atrasado = self.tabla is None or secuencia > self.max_id
+            if version is not None and not atrasado:
+                atrasado = version[0] > self.max_id or version[1] > self.version
+            if atrasado:
+                self.sincronizar()
+        except Exception as e:
+            print(f"⚠️  Estado en memoria no disponible, leyendo de la base: {e}")
+            return None
+
+        limite_desde = None if desde is None else (desde - EPOCA) // UN_MICROSEGUNDO
+        limite_hasta = None if hasta is None else (hasta - EPOCA) // UN_MICROSEGUNDO
+        with self.lock:
+            tabla = self.tabla
+            if limite_hasta is not None and tabla.max_fecha is not None and tabla.max_fecha > limite_hasta:
+                return None
+            if codigos is None:
+                filas = range(len(tabla.ids))
+            else:
+                filas = sorted(tabla.posicion[codigo] for codigo in set(codigos) if codigo in tabla.posicion)
+            if funcionario is not None:
+                funcionarios = tabla.textos['funcionario']
+                filas = [i for i in filas if funcionarios[i] == funcionario]
+            return [tabla.estacion(i) for i in filas
+                    if limite_desde is None or tabla.fechas[i] >= limite_desde]
+
+    def vaciar(self):
+        """Descarta el estado; la próxima consulta lo vuelve a cargar"""
+        with self.lock_sincronizacion, self.lock:
+            self.tabla = None
+            self.version = None
+            self.cursor = 0
+            self.marca = None
+            self.max_id = 0
+
+    def resumen(self):
+        with self.lock:
+            if self.tabla is None:
+                return {'cargado': False}
+            return {'cargado': True, 'estaciones': len(self.tabla.ids), 'max_id': self.max_id,
+                    'cursor': self.cursor, 'bytes': self.tabla.bytes_aproximados()}
+
+estado_estaciones = EstadoEstaciones()
+
+@sa.event.listens_for(SesionEnrutada, 'after_flush')
+def _recordar_estado_nuevo(sesion, contexto_flush):
+    # Se copian los valores al hacer flush: después del commit las instancias quedan expiradas
+    if estado_estaciones.tabla is None:
+        return
+    pendientes = sesion.info.setdefault('estado_pendiente', {})
+    for objeto in sesion.new:
+        if type(objeto) is RegistroCombustible:
+            fila = tuple(getattr(objeto, nombre) for nombre in COLUMNAS_ESTADO)
+            anterior = pendientes.get(fila[2])
+            if anterior is None or (fila[1], fila[0]) > (anterior[1], anterior[0]):
+                pendientes[fila[2]] = fila
+
+@sa.event.listens_for(SesionEnrutada, 'after_commit')
+def _aplicar_estado_nuevo(sesion):
+    pendientes = sesion.info.pop('estado_pendiente', None)
+    if pendientes:
+        estado_estaciones.aplicar(sorted(pendientes.values()))
+
+@sa.event.listens_for(SesionEnrutada, 'after_rollback')
+def _descartar_estado_nuevo(sesion):
+    sesion.info.pop('estado_pendiente', None)
+
+# ================= RETENCIÓN Y COMPACTACIÓN DEL HISTORIAL =================
+def _volumen_total_sql(modelo=RegistroCombustible):
+    return (modelo.do_do_plus + modelo.do_uls_plus + modelo.ge_ge_plus +
+            modelo.gp_plus + modelo.gp_ultra_100)
+
+def _compactar_dia(dia):
+    """Resume los registros crudos de un día y elimina exactamente los resumidos.
+
+    Todo ocurre en una sola transacción y con una sola instantánea: en
+    PostgreSQL con REPEATABLE READ, en SQLite con el bloqueo de escritura. Un
+    registro que se confirma mientras tanto, aunque tenga un id menor, no se
+    ve, no se resume ni se elimina, y queda para la siguiente pasada.
+    El último registro de cada estación nunca se elimina: es el estado actual,
+    y se resume recién cuando deja de serlo. Así todo registro crudo que queda
+    en un día está fuera del resumen.
+    """
+    if es_postgresql():
+        db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+    elif db.engine.dialect.name == 'sqlite' and not SQLITE_AJUSTADO:
+        # Sin el perfil ajustado pysqlite no abre transacción para los SELECT
+        # (con el perfil, transaccion_escritura() ya empezó con BEGIN IMMEDIATE)
+        db.session.execute(db.text('BEGIN IMMEDIATE'))
+    fin = dia + timedelta(days=1)
+    en_dia = db.and_(
+        RegistroCombustible.fecha_hora >= dia,
+        RegistroCombustible.fecha_hora < fin
+    )
+
+    # Conservar el último registro de cada estación presente en el día
+    codigos_dia = db.session.query(RegistroCombustible.codigo).filter(en_dia).distinct()
+    vigentes_sub = db.session.query(
+        RegistroCombustible.codigo,
+        db.func.max(RegistroCombustible.fecha_hora).label('max_fecha')
+    ).filter(RegistroCombustible.codigo.in_(codigos_dia)).group_by(RegistroCombustible.codigo).subquery()
+    protegidos = db.session.query(RegistroCombustible.id).join(
+        vigentes_sub,
+        db.and_(
+            RegistroCombustible.codigo == vigentes_sub.c.codigo,
+            RegistroCombustible.fecha_hora == vigentes_sub.c.max_fecha
+        )
+    )
+    compactables = db.and_(en_dia, RegistroCombustible.id.notin_(protegidos))
+
+    total = _volumen_total_sql()
+    agregados = db.session.query(
+        RegistroCombustible.codigo,
+        db.func.count(RegistroCombustible.id),
+        db.func.min(total),
+        db.func.max(total),
+        db.func.sum(total),
+        db.func.max(RegistroCombustible.id)
+    ).filter(compactables).group_by(RegistroCombustible.codigo).all()
+    if not agregados:
+        db.session.commit()
+        return 0, 0
+
+    ultimos_sub = db.session.query(
+        RegistroCombustible.codigo,
+        db.func.max(RegistroCombustible.fecha_hora).label('max_fecha')
+    ).filter(compactables).group_by(RegistroCombustible.codigo).subquery()
+    ultimos = {}
+    for registro in db.session.query(RegistroCombustible).join(
+        ultimos_sub,
+        db.and_(
+            RegistroCombustible.codigo == ultimos_sub.c.codigo,
+            RegistroCombustible.fecha_hora == ultimos_sub.c.max_fecha
+        )
+    ).filter(compactables):
+        actual = ultimos.get(registro.codigo)
+        if actual is None or registro.id > actual.id:
+            ultimos[registro.codigo] = registro
+
+    resumidos = 0
+    existentes = {r.codigo: r for r in ResumenDiarioCombustible.query.filter_by(fecha=dia.date())}
+    for codigo, cantidad, minimo, maximo, suma, max_id in agregados:
+        ultimo = ultimos[codigo]
+        resumen = existentes.get(codigo)
+        if resumen is None:
+            resumen = ResumenDiarioCombustible(
+                codigo=codigo, fecha=dia.date(), registros=0,
+                volumen_total_min=minimo, volumen_total_max=maximo,
+                volumen_total_suma=0, ultimo_id=0
+            )
+            db.session.add(resumen)
+        resumen.registros += cantidad
+        resumen.volumen_total_min = min(resumen.volumen_total_min, minimo)
+        resumen.volumen_total_max = max(resumen.volumen_total_max, maximo)
+        resumen.volumen_total_suma += int(suma)
+        resumen.ultimo_id = max(resumen.ultimo_id, max_id)
+        if resumen.fecha_hora_ultima is None or ultimo.fecha_hora >= resumen.fecha_hora_ultima:
+            for campo in ('razon_social', 'zona', 'provincia', 'municipio', 'funcionario',
+                          'do_do_plus', 'do_uls_plus', 'ge_ge_plus', 'gp_plus', 'gp_ultra_100',
+                          'filas_do_do_plus', 'filas_ge_ge_plus'):
+                setattr(resumen, campo, getattr(ultimo, campo))
+            resumen.fecha_hora_ultima = ultimo.fecha_hora
+        resumidos += cantidad
+    db.session.flush()
+
+    # Misma instantánea y mismo filtro que los agregados: se elimina lo resumido
+    eliminados = RegistroCombustible.query.filter(compactables).delete(synchronize_session=False)
+
+    db.session.commit()
+    return resumidos, eliminados
+
+def compactar_historial(dias_retencion=None, limite_dias=None):
+    """Compacta en resúmenes diarios los registros más viejos que la retención.
+
+    Procesa un día por transacción, del más antiguo al más reciente, por lo que
+    puede interrumpirse y volver a ejecutarse en cualquier momento.
+    """
+    if dias_retencion is None:
+        dias_retencion = app.config['RETENCION_DIAS']
+    resultado = {'dias_compactados': 0, 'registros_resumidos': 0, 'registros_eliminados': 0}
+    if not dias_retencion or dias_retencion <= 0:
+        return resultado
+
+    corte = datetime.combine((datetime.utcnow() - timedelta(days=dias_retencion)).date(), datetime.min.time())
+    dia = None
+    while limite_dias is None or resultado['dias_compactados'] < limite_dias:
+        consulta = db.session.query(db.func.min(RegistroCombustible.fecha_hora)).filter(
+            RegistroCombustible.fecha_hora < corte
+        )
+        if dia is not None:
+            consulta = consulta.filter(RegistroCombustible.fecha_hora >= dia + timedelta(days=1))
+        primera = consulta.scalar()
+        db.session.rollback()  # el día se compacta en una transacción nueva
+        if primera is None:
+            break
+        dia = datetime.combine(primera.date(), datetime.min.time())
+        try:
+            with transaccion_escritura():
+                resumidos, eliminados = _compactar_dia(dia)
+        except Exception:
+            db.session.rollback()
+            raise
+        resultado['dias_compactados'] += 1
+        resultado['registros_resumidos'] += resumidos
+        resultado['registros_eliminados'] += eliminados
+
+    asegurar_particiones_mensuales()
+    return resultado
+
+# ================= PARTICIONADO MENSUAL (POSTGRESQL) =================
+TABLA_REGISTROS = RegistroCombustible.__tablename__
+
+def es_postgresql():
+    return db.engine.dialect.name == 'postgresql'
+
+def _nombre_particion(mes):
+    return f'{TABLA_REGISTROS}_p{mes.year}_{mes.month:02d}'
+
+def _sumar_meses(mes, cantidad):
+    indice = mes.year * 12 + mes.month - 1 + cantidad
+    return mes.replace(year=indice // 12, month=indice % 12 + 1, day=1)
+
+def registros_particionados(conexion=None):
+    if not es_postgresql():
+        return False
+    conexion = conexion or db.session
+    tipo = conexion.execute(db.text(
+        "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = :tabla AND n.nspname = current_schema()"
+    ), {'tabla': TABLA_REGISTROS}).scalar()
+    return tipo == 'p'
+
+def _crear_particion(conexion, mes, tabla=TABLA_REGISTROS):
+    """Crea la partición del mes si no existe.
+
+    Si la partición DEFAULT ya tiene registros de ese mes, PostgreSQL rechaza
+    el CREATE TABLE ... PARTITION OF: se desconecta la DEFAULT, se crea la
+    partición, se mueven esos registros y se vuelve a conectar la DEFAULT,
+    todo en la transacción de la conexión recibida.
+    """
+    nombre = _nombre_particion(mes)
+    if conexion.execute(db.text('SELECT to_regclass(:nombre)'), {'nombre': nombre}).scalar():
+        return
+    desde, hasta = f'{mes:%Y-%m-%d}', f'{_sumar_meses(mes, 1):%Y-%m-%d}'
+    crear = f"CREATE TABLE IF NOT EXISTS {nombre} PARTITION OF {tabla} FOR VALUES FROM ('{desde}') TO ('{hasta}')"
+    default = f'{TABLA_REGISTROS}_default'
+    rango = f"fecha_hora >= '{desde}' AND fecha_hora < '{hasta}'"
+    con_default = conexion.execute(db.text(
+        'SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:default) AND inhparent = to_regclass(:tabla)'
+    ), {'default': default, 'tabla': tabla}).scalar()
+    if not con_default or not conexion.execute(db.text(f'SELECT EXISTS (SELECT 1 FROM {default} WHERE {rango})')).scalar():
+        conexion.execute(db.text(crear))
+        return
+
+    conexion.execute(db.text(f'ALTER TABLE {tabla} DETACH PARTITION {default}'))
+    conexion.execute(db.text(crear))
+    movidos = conexion.execute(db.text(f'INSERT INTO {tabla} SELECT * FROM {default} WHERE {rango}')).rowcount
+    conexion.execute(db.text(f'DELETE FROM {default} WHERE {rango}'))
+    conexion.execute(db.text(f'ALTER TABLE {tabla} ATTACH PARTITION {default} DEFAULT'))
+    print(f"📦 Partición {nombre} creada con {movidos} registros movidos desde {default}")
+
+def asegurar_particiones_mensuales(meses_adelante=3):
+    """Crea por adelantado las particiones de los próximos meses"""
+    if not registros_particionados():
+        return []
+    mes_actual = datetime.utcnow().date().replace(day=1)
+    meses = [_sumar_meses(mes_actual, i) for i in range(meses_adelante + 1)]
+    with db.engine.begin() as conexion:
+        for mes in meses:
+            _crear_particion(conexion, mes)
+    return [_nombre_particion(mes) for mes in meses]
+
+def particionar_registros_postgresql(meses_adelante=3):
+    """Convierte registro_combustible en una tabla particionada por mes sobre fecha_hora.
+
+    Copia los datos dentro de una transacción con la tabla bloqueada y deja la
+    tabla original como respaldo con el sufijo _sin_particionar.
+    """
+    if not es_postgresql():
+        raise RuntimeError('El particionado nativo sólo está disponible en PostgreSQL')
+    if registros_particionados():
+        return {'particionada': False, 'mensaje': 'La tabla ya está particionada'}
+
+    nueva = f'{TABLA_REGISTROS}_particionada'
+    respaldo = f'{TABLA_REGISTROS}_sin_particionar'
+    with db.engine.begin() as conexion:
+        conexion.execute(db.text(f'LOCK TABLE {TABLA_REGISTROS} IN ACCESS EXCLUSIVE MODE'))
+        primera = conexion.execute(db.text(f'SELECT min(fecha_hora) FROM {TABLA_REGISTROS}')).scalar()
+        conexion.execute(db.text(
+            f'CREATE TABLE {nueva} (LIKE {TABLA_REGISTROS} INCLUDING DEFAULTS) PARTITION BY RANGE (fecha_hora)'
+        ))
+        # En tablas particionadas la clave primaria debe incluir la clave de partición
+        conexion.execute(db.text(f'ALTER TABLE {nueva} ADD PRIMARY KEY (id, fecha_hora)'))
+
+        mes = (primera.date() if primera else datetime.utcnow().date()).replace(day=1)
+        ultimo_mes = _sumar_meses(datetime.utcnow().date().replace(day=1), meses_adelante)
+        particiones = 0
+        while mes <= ultimo_mes:
+            _crear_particion(conexion, mes, tabla=nueva)
+            mes = _sumar_meses(mes, 1)
+            particiones += 1
+        conexion.execute(db.text(f'CREATE TABLE IF NOT EXISTS {TABLA_REGISTROS}_default PARTITION OF {nueva} DEFAULT'))
+
+        copiados = conexion.execute(db.text(f'INSERT INTO {nueva} SELECT * FROM {TABLA_REGISTROS}')).rowcount
+        for indice in RegistroCombustible.__table__.indexes:
+            conexion.execute(db.text(f'DROP INDEX IF EXISTS {indice.name}'))
+        conexion.execute(db.text(f'ALTER TABLE {TABLA_REGISTROS} RENAME TO {respaldo}'))
+        conexion.execute(db.text(f'ALTER TABLE {nueva} RENAME TO {TABLA_REGISTROS}'))
+        conexion.execute(db.text(f'ALTER SEQUENCE {TABLA_REGISTROS}_id_seq OWNED BY {TABLA_REGISTROS}.id'))
+        for indice in RegistroCombustible.__table__.indexes:
+            indice.create(bind=conexion)
+
+    return {
+        'particionada': True,
+        'particiones': particiones,
+        'registros_copiados': copiados,
+        'respaldo': respaldo
+    }
+
+# ================= PERFILADO DE PETICIONES =================
+MODOS_PERFILADO = ('muestreo', 'cprofile')
+EXTENSIONES_PERFIL = {'muestreo': '.speedscope.json', 'cprofile': '.pstats'}
+PERFIL_ID = re.compile(r'^[0-9]{8}_[0-9]{6}_[0-9]{6}_[0-9a-f]{4}$')
+SQL_OTRAS = '(otras sentencias)'
+
+_perfil_hilo = threading.local()
+# cProfile no admite dos perfiles activos a la vez en Python 3.12+: uno por proceso
+_lock_cprofile = threading.Lock()
+_lock_escuchas_sql = threading.Lock()
+_escuchas_sql = False
+
+class PerfilMuestreo:
+    """Toma la pila del hilo de la petición cada intervalo, desde otro hilo.
+
+    Guarda las pilas en orden, sumando el tiempo de muestras consecutivas
+    iguales, y las exporta en el formato de speedscope.
+    """
+
+    def __init__(self, intervalo_ms):
+        self.intervalo = intervalo_ms / 1000
+        self.hilo_objetivo = threading.get_ident()
+        self.marcos = {}
+        self.muestras = []
+        self.pesos = []
+        self.detenido = threading.Event()
+        self.hilo = threading.Thread(target=self._muestrear, name='perfil-muestreo', daemon=True)
+
+    def iniciar(self):
+        self.hilo.start()
+
+    def detener(self):
+        self.detenido.set()
+        self.hilo.join()
+
+    def _pila(self, marco):
+        pila = []
+        while marco is not None:
+            codigo = marco.f_code
+            clave = (codigo.co_name, codigo.co_filename, codigo.co_firstlineno)
+            indice = self.marcos.get(clave)
+            if indice is None:
+                indice = self.marcos[clave] = len(self.marcos)
+            pila.append(indice)
+            marco = marco.f_back
+        pila.reverse()
+        return pila
+
+    def _muestrear(self):
+        anterior = time.perf_counter()
+        while not self.detenido.wait(self.intervalo):
+            marco = sys._current_frames().get(self.hilo_objetivo)
+            ahora = time.perf_counter()
+            if marco is not None:
+                pila = self._pila(marco)
+                peso = (ahora - anterior) * 1000
+                if self.muestras and self.muestras[-1] == pila:
+                    self.pesos[-1] += peso
+                else:
+                    self.muestras.append(pila)
+                    self.pesos.append(peso)
+            del marco
+            anterior = ahora
+
+    def funciones(self, limite=20):
+        """Funciones con más tiempo propio (en la cima de la pila), en ms"""
+        propio = {}
+        total = {}
+        for pila, peso in zip(self.muestras, self.pesos):
+            propio[pila[-1]] = propio.get(pila[-1], 0) + peso
+            for indice in set(pila):
+                total[indice] = total.get(indice, 0) + peso
+        nombres = {indice: clave for clave, indice in self.marcos.items()}
+        return [{'funcion': f'{nombres[i][0]} ({nombres[i][1]}:{nombres[i][2]})',
+                 'propio_ms': round(propio[i], 2), 'total_ms': round(total[i], 2)}
+                for i in heapq.nlargest(limite, propio, key=propio.get)]
+
+    def guardar(self, ruta, nombre):
+        duracion = sum(self.pesos)
+        documento = {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': nombre,
+            'exporter': 'Sistema_combustibles',
+            'shared': {'frames': [{'name': n, 'file': archivo, 'line': linea}
+                                  for (n, archivo, linea) in self.marcos]},
+            'profiles': [{
+                'type': 'sampled',
+                'name': nombre,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': duracion,
+                'samples': self.muestras,
+                'weights': self.pesos,
+            }],
+        }
+        with open(ruta, 'w') as f:
+            json.dump(documento, f)
+
+class PerfilDeterminista:
+    """cProfile sobre el hilo de la petición; se guarda en formato pstats"""
+
+    def __init__(self):
+        self.perfil = cProfile.Profile()
+
+    def iniciar(self):
+        self.perfil.enable()
+
+    def detener(self):
+        self.perfil.disable()
+        _lock_cprofile.release()
+
+    def funciones(self, limite=20):
+        estadisticas = pstats.Stats(self.perfil).stats
+        mayores = heapq.nlargest(limite, estadisticas.items(), key=lambda item: item[1][2])
+        return [{'funcion': f'{nombre} ({archivo}:{linea})',
+                 'propio_ms': round(propio * 1000, 2), 'total_ms': round(acumulado * 1000, 2),
+                 'llamadas': llamadas}
+                for (archivo, linea, nombre), (_, llamadas, propio, acumulado, _) in mayores]
+
+    def guardar(self, ruta, nombre):
+        self.perfil.dump_stats(ruta)
+
+class PeticionPerfilada:
+    """Perfil de una petición en curso y los tiempos de sus sentencias SQL"""
+
+    def __init__(self, modo):
+        self.id = f'{datetime.now():%Y%m%d_%H%M%S_%f}_{uuid.uuid4().hex[:4]}'
+        self.modo = modo
+        self.perfil = (PerfilMuestreo(app.config['PERFILADO_MUESTREO_MS']) if modo == 'muestreo'
+                       else PerfilDeterminista())
+        self.sql = {}
+        self.datos = {
+            'id': self.id,
+            'modo': modo,
+            'metodo': request.method,
+            'ruta': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'usuario': session.get('user'),
+            'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        self.inicio = None
+
+    def iniciar(self):
+        _perfil_hilo.actual = self
+        self.inicio = time.perf_counter()
+        self.perfil.iniciar()
+
+    def registrar_sql(self, sentencia, duracion_ms):
+        entrada = self.sql.get(sentencia)
+        if entrada is None:
+            if len(self.sql) >= app.config['PERFILADO_SQL_MAX']:
+                sentencia = SQL_OTRAS
+                entrada = self.sql.get(SQL_OTRAS)
+            if entrada is None:
+                entrada = self.sql[sentencia] = [0, 0.0, 0.0]
+        entrada[0] += 1
+        entrada[1] += duracion_ms
+        entrada[2] = max(entrada[2], duracion_ms)
+
+    def terminar(self):
+        """Detiene el perfil y lo guarda. Corre al cerrar la respuesta, ya enviado el cuerpo"""
+        self.perfil.detener()
+        _perfil_hilo.actual = None
+        duracion = (time.perf_counter() - self.inicio) * 1000
+        sentencias = sorted(self.sql.items(), key=lambda item: item[1][1], reverse=True)
+        self.datos.update({
+            'duracion_ms': round(duracion, 2),
+            'consultas_sql': sum(veces for veces, _, _ in self.sql.values()),
+            'sql_ms': round(sum(total for _, total, _ in self.sql.values()), 2),
+            'sql': [{'sentencia': sentencia, 'veces': veces, 'total_ms': round(total, 2), 'max_ms': round(maximo, 2)}
+                    for sentencia, (veces, total, maximo) in sentencias],
+        })
+        try:
+            self.datos['funciones'] = self.perfil.funciones()
+            almacen_perfiles.guardar(self)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el perfil {self.id}: {e}")
+
+def _antes_sql(conexion, cursor, sentencia, parametros, contexto, executemany):
+    if getattr(_perfil_hilo, 'actual', None) is not None:
+        conexion.info.setdefault('inicio_sql', []).append(time.perf_counter())
+
+def _despues_sql(conexion, cursor, sentencia, parametros, contexto, executemany):
+    actual = getattr(_perfil_hilo, 'actual', None)
+    inicios = conexion.info.get('inicio_sql')
+    if actual is not None and inicios:
+        actual.registrar_sql(sentencia, (time.perf_counter() - inicios.pop()) * 1000)
+
+def escuchar_sql():
+    """Registra los tiempos de SQL en los motores, recién con la primera petición perfilada"""
+    global _escuchas_sql
+    with _lock_escuchas_sql:
+        if _escuchas_sql:
+            return
+        for engine in db.engines.values():
+            sa.event.listen(engine, 'before_cursor_execute', _antes_sql)
+            sa.event.listen(engine, 'after_cursor_execute', _despues_sql)
+        _escuchas_sql = True
+
+class AlmacenPerfiles:
+    """Perfiles guardados en disco, acotados en cantidad y en bytes.
+
+    Cada perfil son dos archivos: el artefacto (speedscope o pstats) y sus
+    datos en JSON, escrito al final. Al superar los límites se borran los más
+    antiguos; los procesos comparten la carpeta.
+    """
+
+    def __init__(self, carpeta, max_bytes, max_archivos):
+        self.carpeta = carpeta
+        self.max_bytes = max_bytes
+        self.max_archivos = max_archivos
+        self.lock = threading.Lock()
+
+    def _ruta(self, perfil_id, extension):
+        return os.path.join(self.carpeta, perfil_id + extension)
+
+    def guardar(self, peticion):
+        os.makedirs(self.carpeta, exist_ok=True)
+        extension = EXTENSIONES_PERFIL[peticion.modo]
+        ruta = self._ruta(peticion.id, extension)
+        peticion.perfil.guardar(ruta + '.tmp', f"{peticion.datos['metodo']} {peticion.datos['ruta']}")
+        os.replace(ruta + '.tmp', ruta)
+        peticion.datos['artefacto'] = peticion.id + extension
+        peticion.datos['bytes'] = os.path.getsize(ruta)
+        with open(self._ruta(peticion.id, '.json.tmp'), 'w') as f:
+            json.dump(peticion.datos, f, ensure_ascii=False)
+        os.replace(self._ruta(peticion.id, '.json.tmp'), self._ruta(peticion.id, '.json'))
+        self.podar()
+
+    def podar(self):
+        with self.lock:
+            perfiles = []
+            for nombre in os.listdir(self.carpeta):
+                perfil_id, _, extension = nombre.partition('.')
+                if extension != 'json' or not PERFIL_ID.match(perfil_id):
+                    continue
+                try:
+                    datos = self.datos(perfil_id)
+                    perfiles.append((perfil_id, datos['artefacto'], datos.get('bytes', 0)))
+                except (OSError, ValueError, KeyError):
+                    continue
+            perfiles.sort()
+            total = sum(tamano for _, _, tamano in perfiles)
+            while perfiles and (len(perfiles) > self.max_archivos or total > self.max_bytes):
+                perfil_id, artefacto, tamano = perfiles.pop(0)
+                for ruta in (self._ruta(perfil_id, '.json'), os.path.join(self.carpeta, artefacto)):
+                    try:
+                        os.remove(ruta)
+                    except FileNotFoundError:
+                        pass
+                total -= tamano
+
+    def datos(self, perfil_id):
+        with open(self._ruta(perfil_id, '.json')) as f:
+            return json.load(f)
+
+    def listar(self):
+        """Datos de los perfiles guardados, del más reciente al más antiguo, sin el detalle"""
+        if not os.path.isdir(self.carpeta):
+            return []
+        resultado = []
+        for nombre in sorted(os.listdir(self.carpeta), reverse=True):
+            perfil_id, _, extension = nombre.partition('.')
+            if extension != 'json' or not PERFIL_ID.match(perfil_id):
+                continue
+            try:
+                datos = self.datos(perfil_id)
+            except (OSError, ValueError):
+                continue
+            resultado.append({clave: valor for clave, valor in datos.items() if clave not in ('sql', 'funciones')})
+        return resultado
+
+    def artefacto(self, perfil_id):
+        return os.path.join(self.carpeta, self.datos(perfil_id)['artefacto'])
+
+almacen_perfiles = AlmacenPerfiles(app.config['PERFILADO_CARPETA'],
+                                   app.config['PERFILADO_MAX_MB'] * 1024 * 1024,
+                                   app.config['PERFILADO_MAX_ARCHIVOS'])
+
+@app.before_request
+def _iniciar_perfil():
+    # Sin la marca, la petición no paga más que esta búsqueda
+    marca = request.headers.get('X-Perfilar') or request.args.get('perfilar')
+    if not marca or not app.config['PERFILADO'] or session.get('role') != 'admin':
+        return
+    modo = app.config['PERFILADO_MODO'] if marca in ('1', 'true', 'si') else marca
+    if modo not in MODOS_PERFILADO:
+        g.perfil_estado = 'modo no válido'
+        return
+    if modo == 'cprofile' and not _lock_cprofile.acquire(blocking=False):
+        g.perfil_estado = 'ocupado'
+        return
+    escuchar_sql()
+    g.perfil = PeticionPerfilada(modo)
+    g.perfil.iniciar()
+
+@app.after_request
+def _cerrar_perfil(response):
+    perfil = g.get('perfil')
+    if perfil is not None:
+        perfil.datos['estado'] = response.status_code
+        response.headers['X-Perfil'] = perfil.id
+        if response.direct_passthrough:
+            # send_file entrega el archivo tal cual al servidor, sin pasar por call_on_close
+            response.response = ClosingIterator(response.response, perfil.terminar)
+        else:
+            response.call_on_close(perfil.terminar)
+    elif g.get('perfil_estado'):
+        response.headers['X-Perfil-Estado'] = g.perfil_estado
+    return response
+
+# ================= ARCHIVOS ESTÁTICOS Y COMPRESIÓN =================
+TIPOS_COMPRIMIBLES = {
+    'text/html', 'text/css', 'text/csv', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml'
+}
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+mimetypes.add_type('font/woff2', '.woff2')
+
+_huellas_estaticos = {}
+_estaticos_comprimidos = {}
+
+def _ruta_estatico(filename):
+    ruta = safe_join(app.static_folder, filename)
+    return ruta if ruta and os.path.isfile(ruta) else None
+
+def huella_estatico(filename):
+    """Hash corto del contenido, recalculado si cambia la fecha de modificación"""
+    ruta = _ruta_estatico(filename)
+    if ruta is None:
+        return None
+    mtime = os.path.getmtime(ruta)
+    en_cache = _huellas_estaticos.get(filename)
+    if en_cache and en_cache[0] == mtime:
+        return en_cache[1]
+    with open(ruta, 'rb') as f:
+        huella = hashlib.sha256(f.read()).hexdigest()[:12]
+    _huellas_estaticos[filename] = (mtime, huella)
+    return huella
+
+def static_url(filename):
+    """URL con la huella del contenido en el nombre, cacheable para siempre"""
+    huella = huella_estatico(filename)
+    if huella is None:
+        return url_for('static', filename=filename)
+    base, ext = os.path.splitext(filename)
+    return url_for('assets', filename=f'{base}.{huella}{ext}')
+
+app.jinja_env.globals.update(static_url=static_url)
+
+def elegir_codificacion():
+    aceptadas = request.accept_encodings
+    if brotli is not None and aceptadas.quality('br') > 0:
+        return 'br'
+    if aceptadas.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+def comprimir(datos, codificacion, nivel_maximo=False):
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=11 if nivel_maximo else app.config['COMPRESION_NIVEL_BROTLI'])
+    return gzip.compress(datos, compresslevel=9 if nivel_maximo else app.config['COMPRESION_NIVEL_GZIP'])
+
+def _contenido_estatico(filename, huella, codificacion):
+    # Un estático se comprime una sola vez por versión y codificación, con el nivel máximo
+    clave = (filename, huella, codificacion)
+    contenido = _estaticos_comprimidos.get(clave)
+    if contenido is None:
+        with open(_ruta_estatico(filename), 'rb') as f:
+            contenido = f.read()
+        if codificacion:
+            contenido = comprimir(contenido, codificacion, nivel_maximo=True)
+        _estaticos_comprimidos[clave] = contenido
+    return contenido
+
+@app.route('/assets/<path:filename>')
+def assets(filename):
+    inmutable = False
+    if _ruta_estatico(filename) is None:
+        base, ext = os.path.splitext(filename)
+        nombre, _, huella = base.rpartition('.')
+        if not nombre or _ruta_estatico(nombre + ext) is None:
+            abort(404)
+        filename = nombre + ext
+        # Una huella vieja sirve la versión actual, pero sin caché permanente
+        inmutable = huella_estatico(filename) == huella
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    codificacion = None
+    if app.config['COMPRESION_HABILITADA'] and mimetype in TIPOS_COMPRIMIBLES:
+        codificacion = elegir_codificacion()
+    huella = huella_estatico(filename)
+
+    response = app.response_class(_contenido_estatico(filename, huella, codificacion), mimetype=mimetype)
+    if codificacion:
+        response.headers['Content-Encoding'] = codificacion
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = (
+        CACHE_INMUTABLE if inmutable else f"public, max-age={app.config['CACHE_ESTATICOS_SEGUNDOS']}"
+    )
+    response.set_etag(f'{huella}-{codificacion or "identity"}')
+    return response.make_conditional(request)
+
+@app.after_request
+def comprimir_respuesta(response):
+    if (not app.config['COMPRESION_HABILITADA'] or response.direct_passthrough
+            or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in TIPOS_COMPRIMIBLES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.content_length or 0) < app.config['COMPRESION_MIN_BYTES']:
+        return response
+    codificacion = elegir_codificacion()
+    if codificacion is None:
+        return response
+    response.set_data(comprimir(response.get_data(), codificacion))
+    response.headers['Content-Encoding'] = codificacion
+    return response
+
+# ================= RUTAS PRINCIPALES =================
+@app.route('/')
+def index():
+    return redirect(url_for('login'))
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    try:
+        if 'user' in session:
+            if session.get('role') == 'admin':
+                return redirect(url_for('admin_dashboard'))
+            return redirect(url_for('user_dashboard'))
+        
+        if request.method == 'POST':
+            username = request.form.get('username')
+            password = request.form.get('password')
+            
+            usuario = Usuario.query.filter_by(username=username).first()
+            
+            try:
+                autenticado = usuario is not None and autenticar_usuario(usuario, password)
+            except VerificacionOcupada:
+                flash('Hay muchos inicios de sesión en curso. Intente nuevamente en unos segundos.', 'error')
+                return render_template('login.html'), 503
+            
+            if autenticado:
+                session['user'] = usuario.username
+                session['user_id'] = usuario.id
+                session['role'] = usuario.rol
+                session['funcionario'] = usuario.funcionario
+                session['login_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                
+                if usuario.rol == 'admin':
+                    flash('¡Bienvenido Administrador!', 'success')
+                    return redirect(url_for('admin_dashboard'))
+                else:
+                    flash(f'Bienvenido {usuario.funcionario}', 'success')
+                    return redirect(url_for('user_dashboard'))
+            else:
+                flash('Credenciales incorrectas. Intente nuevamente.', 'error')
+        
+        return render_template('login.html')
+        
+    except Exception as e:
+        print(f"❌ ERROR en login: {str(e)}")
+        import traceback
+        print(f"🔍 TRACEBACK: {traceback.format_exc()}")
+        flash('Error interno del servidor', 'error')
+        return render_template('login.html')
+
+@app.route('/admin/dashboard')
+@lectura_replica
+def admin_dashboard():
+    if 'user' not in session or session.get('role') != 'admin':
+        flash('Acceso denegado', 'error')
+        return redirect(url_for('login'))
+    
+    try:
+        fecha_inicio_str = request.args.get('fecha_inicio')
+        fecha_fin_str = request.args.get('fecha_fin')
+        hora_inicio_str = request.args.get('hora_inicio')
+        hora_fin_str = request.args.get('hora_fin')
+        
+        fecha_inicio = None
+        fecha_fin = None
+        
+        if fecha_inicio_str:
+            fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d')
+        if fecha_fin_str:
+            fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d')
+        
+        if not fecha_inicio and not fecha_fin:
+            fecha_fin = datetime.now()
+            fecha_inicio = fecha_fin - timedelta(days=7)
+        
+        rango_fechas = {
+            'inicio': fecha_inicio.strftime('%Y-%m-%d') if fecha_inicio else '',
+            'fin': fecha_fin.strftime('%Y-%m-%d') if fecha_fin else ''
+        }
+
+        def cargar_registros():
+            desde, hasta = limites_rango_fechas(fecha_inicio, fecha_fin, hora_inicio_str, hora_fin_str)
+            registros = estado_estaciones.consultar(desde, hasta, version=version_registros)
+            if registros is None:
+                registros = obtener_ultimas_filas(fecha_inicio, fecha_fin, hora_inicio_str, hora_fin_str)
+            return {
+                'fuel_data': [fila_a_dict(registro) for registro in registros],
+                'stats': calcular_estadisticas_globales(registros, fecha_inicio, fecha_fin)
+            }
+
+        # Los fragmentos sólo se regeneran si cambiaron los datos o el filtro
+        version_registros, version_usuarios = version_datos()
+        clave_filtro = (rango_fechas['inicio'], rango_fechas['fin'], hora_inicio_str or '', hora_fin_str or '')
+        fragmentos = componer_fragmentos([
+            (('tarjetas_estadisticas', 'tabla_estaciones', 'datos_graficos'),
+             clave_filtro, version_registros, cargar_registros),
+            (('opciones_usuarios', 'tabla_usuarios'),
+             None, version_usuarios, lambda: {'usuarios': Usuario.query.all()}),
+            # Las tasas sólo cambian con registros nuevos; la vida máxima del
+            # fragmento acota el desfase de las horas restantes
+            (('pronostico',),
+             None, version_registros, lambda: {'pronostico': obtener_pronostico(horas=24, limite=15)}),
+        ])
+
+        # OBTENER ÚLTIMA CARGA DE ARCHIVO
+        ultima_carga = CargaArchivo.query.order_by(CargaArchivo.fecha_hora.desc()).first()
+
+        return render_template('admin_dashboard.html',
+                             fragmentos=fragmentos,
+                             rango_fechas=rango_fechas,
+                             username=session['user'],
+                             fecha_inicio=fecha_inicio_str or fecha_inicio.strftime('%Y-%m-%d') if fecha_inicio else '',
+                             fecha_fin=fecha_fin_str or fecha_fin.strftime('%Y-%m-%d') if fecha_fin else '',
+                             hora_inicio=hora_inicio_str or '',
+                             hora_fin=hora_fin_str or '',
+                             ultima_carga=ultima_carga)  # NUEVO PARÁMETRO
+    except Exception as e:
+        flash(f'Error al cargar datos: {str(e)}', 'error')
+        return redirect(url_for('login'))
+
+@app.route('/user/dashboard')
+def user_dashboard():
+    if 'user' not in session:
+        flash('Debe iniciar sesión para acceder a esta página', 'error')
+        return redirect(url_for('login'))
+    
+    try:
+        funcionario = session.get('funcionario')
+        
+        # Obtener estaciones asignadas al usuario
+        asignaciones = AsignacionEstacion.query.filter_by(usuario_id=session.get('user_id')).all()
+        codigos_estaciones = [asignacion.codigo_estacion for asignacion in asignaciones]
+        
+        if not codigos_estaciones:
+            # Si no tiene asignaciones, las estaciones cuyo último registro es del funcionario
+            registros = estado_estaciones.consultar(funcionario=funcionario,
+                                                    secuencia=session.get('ultima_secuencia', 0))
+            if registros is None:
+                registros = filas_proyectadas(consulta_ultimos([RegistroCombustible.funcionario == funcionario],
+                                                               *columnas_proyeccion()))
+        else:
+            # Usar estaciones asignadas; el estado en memoria evita ir a la base
+            registros = estado_estaciones.consultar(codigos=codigos_estaciones,
+                                                    secuencia=session.get('ultima_secuencia', 0))
+            if registros is None:
+                registros = filas_proyectadas(consulta_ultimos(
+                    [RegistroCombustible.codigo.in_(codigos_estaciones)], *columnas_proyeccion()))
+        
+        fuel_data = [fila_a_dict(registro) for registro in registros]
+        
+        return render_template('user_dashboard.html', 
+                             fuel_data=fuel_data,
+                             username=session['user'],
+                             funcionario=funcionario)
+    except Exception as e:
+        flash(f'Error al cargar datos: {str(e)}', 'error')
+        return redirect(url_for('login'))
+
+@app.route('/logout')
+def logout():
+    username = session.get('user', 'Usuario')
+    session.clear()
+    flash(f'Sesión cerrada correctamente. ¡Hasta pronto {username}!', 'info')
+    return redirect(url_for('login'))
+
+# ================= RUTAS DE GESTIÓN DE USUARIOS =================
+@app.route('/admin/crear_usuario', methods=['POST'])
+@transaccion_escritura()
+def crear_usuario():
+    if 'user' not in session or session.get('role') != 'admin':
         return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
     
     nombre_funcionario = request.form.get('funcionario')
@@ -519,6 +2848,7 @@ def crear_usuario():
 
 # ================= RUTAS MEJORADAS PARA GESTIÓN DE USUARIOS =================
 @app.route('/admin/editar_usuario', methods=['POST'])
+@transaccion_escritura()
 def editar_usuario():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
@@ -562,6 +2892,7 @@ def editar_usuario():
         return jsonify({'success': False, 'message': f'Error al editar usuario: {str(e)}'}), 500
 
 @app.route('/admin/eliminar_usuario', methods=['POST'])
+@transaccion_escritura()
 def eliminar_usuario():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
@@ -595,6 +2926,7 @@ def eliminar_usuario():
 
 # ================= RUTAS PARA GESTIÓN DE CONTRASEÑAS =================
 @app.route('/admin/editar_password', methods=['POST'])
+@transaccion_escritura()
 def editar_password():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
@@ -625,6 +2957,7 @@ def editar_password():
 
 # ================= RUTAS PARA ASIGNACIÓN DE ESTACIONES =================
 @app.route('/admin/asignar_estaciones', methods=['POST'])
+@transaccion_escritura()
 def asignar_estaciones():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
@@ -660,6 +2993,7 @@ def asignar_estaciones():
         return jsonify({'success': False, 'message': f'Error al asignar estaciones: {str(e)}'}), 500
 
 @app.route('/admin/obtener_estaciones_usuario/<int:usuario_id>')
+@lectura_replica
 def obtener_estaciones_usuario(usuario_id):
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
@@ -677,6 +3011,7 @@ def obtener_estaciones_usuario(usuario_id):
         return jsonify({'success': False, 'message': f'Error al obtener estaciones: {str(e)}'}), 500
 
 @app.route('/admin/obtener_todas_estaciones')
+@lectura_replica
 def obtener_todas_estaciones():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
@@ -694,8 +3029,375 @@ def obtener_todas_estaciones():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error al obtener estaciones: {str(e)}'}), 500
 
+# ================= API DE AGREGADOS GEOGRÁFICOS =================
+@app.route('/admin/agregados')
+@lectura_replica
+def agregados_geograficos():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    nivel = request.args.get('nivel', 'provincia')
+    if nivel not in NIVELES_GEOGRAFICOS:
+        return jsonify({'success': False, 'message': f'Nivel no válido. Use: {", ".join(NIVELES_GEOGRAFICOS)}'}), 400
+
+    try:
+        fecha_inicio_str = request.args.get('fecha_inicio')
+        fecha_fin_str = request.args.get('fecha_fin')
+        fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d') if fecha_inicio_str else None
+        fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d') if fecha_fin_str else None
+        filtros_fecha = filtros_rango_fechas(fecha_inicio, fecha_fin,
+                                             request.args.get('hora_inicio'), request.args.get('hora_fin'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Formato de fecha u hora no válido'}), 400
+
+    try:
+        # Para bajar de nivel se fija el grupo elegido: ?nivel=municipio&provincia=X
+        filtros_geo = {campo: request.args[campo] for campo in NIVELES_GEOGRAFICOS if request.args.get(campo)}
+        resultado = agregar_por_nivel(nivel, filtros_fecha, filtros_geo)
+        return jsonify({'success': True, 'filtros': filtros_geo, **resultado})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error al calcular agregados: {str(e)}'}), 500
+
+# ================= FEED DE ALERTAS =================
+@app.route('/admin/alertas')
+@lectura_replica
+def feed_alertas():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    try:
+        # Sondeo por cursor: ?desde=<último id recibido>; sin alertas nuevas es una lectura vacía del índice
+        desde = request.args.get('desde', 0, type=int)
+        limite = max(1, min(request.args.get('limite', 100, type=int), 1000))
+        consulta = AlertaCombustible.query.filter(AlertaCombustible.id > desde)
+        if request.args.get('codigo'):
+            consulta = consulta.filter(AlertaCombustible.codigo == request.args['codigo'])
+        alertas = consulta.order_by(AlertaCombustible.id).limit(limite).all()
+
+        return jsonify({
+            'success': True,
+            'alertas': [alerta.to_dict() for alerta in alertas],
+            'cursor': alertas[-1].id if alertas else desde
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error al obtener alertas: {str(e)}'}), 500
+
+# ================= PRONÓSTICO DE QUIEBRE DE STOCK =================
+@app.route('/admin/pronostico')
+@lectura_replica
+def pronostico_consumo():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    try:
+        horas = request.args.get('horas', 24, type=float)
+        limite = max(1, min(request.args.get('limite', 100, type=int), 1000))
+        pronostico = obtener_pronostico(horas, limite, request.args.get('codigo'))
+        return jsonify({'success': True, 'horas': horas, 'pronostico': pronostico})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error al calcular pronóstico: {str(e)}'}), 500
+
+# ================= HISTORIAL DE UNA ESTACIÓN =================
+@app.route('/admin/estaciones/<codigo>/historial')
+@lectura_replica
+def historial_estacion_ruta(codigo):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    try:
+        hasta_str = request.args.get('hasta')
+        desde_str = request.args.get('desde')
+        hasta = datetime.combine(datetime.strptime(hasta_str, '%Y-%m-%d'), datetime.max.time()) if hasta_str else datetime.utcnow()
+        desde = datetime.strptime(desde_str, '%Y-%m-%d') if desde_str else hasta - timedelta(days=30)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Formato de fecha no válido (YYYY-MM-DD)'}), 400
+    if desde >= hasta:
+        return jsonify({'success': False, 'message': 'La fecha inicial debe ser anterior a la final'}), 400
+    puntos = max(3, min(request.args.get('puntos', 500, type=int), 5000))
+
+    try:
+        resultado = historial_estacion(codigo, desde, hasta, puntos)
+        return jsonify({
+            'success': True,
+            'desde': desde.strftime('%Y-%m-%d %H:%M:%S'),
+            'hasta': hasta.strftime('%Y-%m-%d %H:%M:%S'),
+            'puntos': puntos,
+            **resultado
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error al obtener historial: {str(e)}'}), 500
+
+# ================= INSTANTÁNEAS DE LA RED =================
+def respuesta_csv(contenido, prefijo):
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return send_file(
+        BytesIO(contenido.encode('utf-8')),
+        as_attachment=True,
+        download_name=f'{prefijo}_{timestamp}.csv',
+        mimetype='text/csv'
+    )
+
+@app.route('/admin/instantanea')
+@lectura_replica
+def instantanea_ruta():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    formato = request.args.get('formato', 'json')
+    if formato not in ('json', 'csv'):
+        return jsonify({'success': False, 'message': 'Formato no válido. Use: json, csv'}), 400
+    try:
+        momento = leer_momento(request.args.get('momento'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Momento no válido (YYYY-MM-DD HH:MM[:SS])'}), 400
+
+    try:
+        filas = [estados[0] for _, estados in instantaneas([momento])]
+        if formato == 'csv':
+            output = StringIO()
+            writer = csv.writer(output)
+            writer.writerow(CABECERA_EXPORTACION)
+            writer.writerows(fila_exportacion(fila) for fila in filas)
+            return respuesta_csv(output.getvalue(), f'instantanea_{momento:%Y%m%d_%H%M%S}')
+        return jsonify({
+            'success': True,
+            'momento': momento.strftime('%Y-%m-%d %H:%M:%S'),
+            'estaciones': len(filas),
+            'datos': [fila_a_dict(fila) for fila in filas]
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error al reconstruir la instantánea: {str(e)}'}), 500
+
+@app.route('/admin/instantanea/diferencia')
+@lectura_replica
+def diferencia_instantaneas_ruta():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    formato = request.args.get('formato', 'json')
+    if formato not in ('json', 'csv'):
+        return jsonify({'success': False, 'message': 'Formato no válido. Use: json, csv'}), 400
+    nivel = request.args.get('nivel', 'estacion')
+    if nivel not in ('estacion', 'provincia'):
+        return jsonify({'success': False, 'message': 'Nivel no válido. Use: estacion, provincia'}), 400
+    try:
+        antes = leer_momento(request.args.get('antes'))
+        despues = leer_momento(request.args.get('despues'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Momento no válido (YYYY-MM-DD HH:MM[:SS])'}), 400
+
+    try:
+        diferencia = diferencia_instantaneas(antes, despues)
+        if formato == 'csv':
+            return respuesta_csv(csv_diferencia(diferencia, nivel),
+                                 f'diferencia_{antes:%Y%m%d_%H%M}_{despues:%Y%m%d_%H%M}_{nivel}')
+        return jsonify({
+            'success': True,
+            'antes': antes.strftime('%Y-%m-%d %H:%M:%S'),
+            'despues': despues.strftime('%Y-%m-%d %H:%M:%S'),
+            **diferencia
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error al comparar instantáneas: {str(e)}'}), 500
+
+# ================= PERFILES DE PETICIONES =================
+@app.route('/admin/perfiles')
+def listar_perfiles():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+    return jsonify({'success': True, 'perfiles': almacen_perfiles.listar()})
+
+@app.route('/admin/perfiles/<perfil_id>')
+def ver_perfil(perfil_id):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+    if not PERFIL_ID.match(perfil_id):
+        return jsonify({'success': False, 'message': 'Perfil no encontrado'}), 404
+    try:
+        return jsonify({'success': True, 'perfil': almacen_perfiles.datos(perfil_id)})
+    except FileNotFoundError:
+        return jsonify({'success': False, 'message': 'Perfil no encontrado'}), 404
+
+@app.route('/admin/perfiles/<perfil_id>/descargar')
+def descargar_perfil(perfil_id):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+    if not PERFIL_ID.match(perfil_id):
+        return jsonify({'success': False, 'message': 'Perfil no encontrado'}), 404
+    try:
+        ruta = almacen_perfiles.artefacto(perfil_id)
+        return send_file(os.path.abspath(ruta), as_attachment=True, download_name=os.path.basename(ruta),
+                         mimetype='application/json' if ruta.endswith('.json') else 'application/octet-stream')
+    except FileNotFoundError:
+        return jsonify({'success': False, 'message': 'Perfil no encontrado'}), 404
+
+# ================= ESCRITURA AGRUPADA =================
+CAMPOS_ESTACION = ('razon_social', 'zona', 'provincia', 'municipio')
+
+def datos_actualizacion(data):
+    """Valida el cuerpo de /user/actualizar_estacion en el hilo de la petición.
+
+    Los campos de la estación que no vienen se completan al escribir con los
+    del último registro. ValueError si un volumen no es entero.
+    """
+    datos = {campo: data[campo] for campo in CAMPOS_ESTACION if campo in data}
+    for campo in CAMPOS_VOLUMEN:
+        datos[campo] = int(data.get(campo, 0))
+    datos.update(
+        codigo=data.get('codigo'),
+        funcionario=session.get('funcionario'),
+        usuario_actualizacion=session.get('user'),
+        fecha_hora=datetime.utcnow()
+    )
+    return datos
+
+def registrar_actualizaciones(lista_datos):
+    """Agrega a la sesión un registro por cada actualización, sin confirmar.
+
+    Una sola consulta trae el último registro de las estaciones a las que les
+    falta algún campo; dentro del lote, cada registro sirve de base al siguiente
+    de la misma estación.
+    """
+    incompletas = {d['codigo'] for d in lista_datos if any(c not in d for c in CAMPOS_ESTACION)}
+    anteriores = {}
+    if incompletas:
+        columnas = [getattr(RegistroCombustible, campo) for campo in CAMPOS_ESTACION]
+        filas = consulta_ultimos([RegistroCombustible.codigo.in_(sorted(incompletas))],
+                                 RegistroCombustible.codigo, *columnas).order_by(RegistroCombustible.id)
+        for codigo, *valores in filas:
+            anteriores[codigo] = dict(zip(CAMPOS_ESTACION, valores))
+
+    registros = []
+    for datos in lista_datos:
+        anterior = anteriores.get(datos['codigo'], {})
+        campos = {campo: datos.get(campo, anterior.get(campo, '')) for campo in CAMPOS_ESTACION}
+        anteriores[datos['codigo']] = campos
+        registro = RegistroCombustible(
+            **{**datos, **campos},
+            tipo_registro='actualizacion'
+        )
+        db.session.add(registro)
+        registros.append(registro)
+    procesar_registros_nuevos(registros)
+    return registros
+
+class EscrituraPendiente:
+    __slots__ = ('datos', 'listo', 'lock', 'estado', 'id', 'error')
+
+    def __init__(self, datos):
+        self.datos = datos
+        self.listo = threading.Event()
+        self.lock = threading.Lock()
+        self.estado = 'en_cola'
+        self.id = None
+        self.error = None
+
+    def tomar(self):
+        """El hilo de escritura la reserva; False si la petición ya se rindió"""
+        with self.lock:
+            if self.estado == 'cancelada':
+                return False
+            self.estado = 'tomada'
+            return True
+
+    def cancelar(self):
+        """La petición se rinde; False si la escritura ya está en curso"""
+        with self.lock:
+            if self.estado == 'tomada':
+                return False
+            self.estado = 'cancelada'
+            return True
+
+class BufferEscritura:
+    """Junta las actualizaciones de estaciones de varias peticiones y las confirma en un commit.
+
+    Un hilo toma de la cola lo que llega en ESCRITURA_AGRUPADA_MS milisegundos
+    (o hasta ESCRITURA_AGRUPADA_MAX registros) y lo escribe en una sola
+    transacción. La petición espera hasta que su lote está confirmado: el id que
+    devuelve ya es durable y la siguiente lectura del mismo usuario lo ve.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cola = None
+        self.hilo = None
+        self.pid = None
+        self.commits = 0
+
+    def _asegurar_hilo(self):
+        # Con preload_app el módulo se importa antes del fork: el hilo se arranca en cada worker
+        if self.pid == os.getpid() and self.hilo.is_alive():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.cola = queue.Queue()
+                self.pid = os.getpid()
+                self.hilo = None
+            if self.hilo is None or not self.hilo.is_alive():
+                self.hilo = threading.Thread(target=self._ciclo, name='escritura-agrupada', daemon=True)
+                self.hilo.start()
+
+    def enviar(self, datos, espera):
+        """Encola una actualización y devuelve el id del registro una vez confirmado.
+
+        TimeoutError si no se confirmó a tiempo: con la escritura sin empezar
+        se descarta; con la escritura en curso el resultado es incierto.
+        """
+        pendiente = EscrituraPendiente(datos)
+        self._asegurar_hilo()
+        self.cola.put(pendiente)
+        if not pendiente.listo.wait(espera):
+            if pendiente.cancelar() or not pendiente.listo.wait(espera):
+                raise TimeoutError(pendiente.estado)
+        if pendiente.error is not None:
+            raise pendiente.error
+        return pendiente.id
+
+    def _ciclo(self):
+        while True:
+            lote = [self.cola.get()]
+            maximo = app.config['ESCRITURA_AGRUPADA_MAX']
+            limite = time.monotonic() + app.config['ESCRITURA_AGRUPADA_MS'] / 1000
+            while len(lote) < maximo:
+                try:
+                    lote.append(self.cola.get(timeout=max(0, limite - time.monotonic())))
+                except queue.Empty:
+                    break
+            lote = [pendiente for pendiente in lote if pendiente.tomar()]
+            if lote:
+                self._confirmar(lote)
+
+    def _confirmar(self, lote):
+        try:
+            with app.app_context(), transaccion_escritura():
+                try:
+                    registros = registrar_actualizaciones([pendiente.datos for pendiente in lote])
+                    db.session.flush()
+                    ids = [registro.id for registro in registros]
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+            self.commits += 1
+        except Exception as e:
+            if len(lote) > 1:
+                # Una actualización con error no arrastra a las demás: se reintentan de a una
+                print(f"⚠️  Lote de {len(lote)} escrituras falló, reintentando por separado: {e}")
+                for pendiente in lote:
+                    self._confirmar([pendiente])
+                return
+            lote[0].error = e
+            lote[0].listo.set()
+            return
+        for pendiente, registro_id in zip(lote, ids):
+            pendiente.id = registro_id
+            pendiente.listo.set()
+
+buffer_escritura = BufferEscritura()
+
 # ================= RUTA CORREGIDA PARA ACTUALIZAR ESTACIONES =================
 @app.route('/user/actualizar_estacion', methods=['POST'])
+@transaccion_escritura()
 def actualizar_estacion():
     if 'user' not in session:
         return jsonify({'success': False, 'message': 'Debe iniciar sesión'}), 403
@@ -707,37 +3409,29 @@ def actualizar_estacion():
         if not codigo:
             return jsonify({'success': False, 'message': 'Código de estación requerido'}), 400
         
-        # Buscar si existe un registro anterior para esta estación
-        registro_anterior = RegistroCombustible.query.filter_by(
-            codigo=codigo
-        ).order_by(RegistroCombustible.fecha_hora.desc()).first()
-        
-        # Crear NUEVO registro (siempre crear nuevo, no actualizar existente)
-        nuevo_registro = RegistroCombustible(
-            codigo=codigo,
-            razon_social=data.get('razon_social', registro_anterior.razon_social if registro_anterior else ''),
-            zona=data.get('zona', registro_anterior.zona if registro_anterior else ''),
-            provincia=data.get('provincia', registro_anterior.provincia if registro_anterior else ''),
-            municipio=data.get('municipio', registro_anterior.municipio if registro_anterior else ''),
-            do_do_plus=int(data.get('do_do_plus', 0)),
-            do_uls_plus=int(data.get('do_uls_plus', 0)),
-            ge_ge_plus=int(data.get('ge_ge_plus', 0)),
-            gp_plus=int(data.get('gp_plus', 0)),
-            gp_ultra_100=int(data.get('gp_ultra_100', 0)),
-            funcionario=session.get('funcionario'),
-            filas_do_do_plus=int(data.get('filas_do_do_plus', 0)),
-            filas_ge_ge_plus=int(data.get('filas_ge_ge_plus', 0)),
-            fecha_hora=datetime.utcnow(),
-            usuario_actualizacion=session.get('user'),
-            tipo_registro='actualizacion'
-        )
-        
-        db.session.add(nuevo_registro)
-        db.session.commit()
+        # Siempre se crea un NUEVO registro (no se actualiza el existente)
+        datos = datos_actualizacion(data)
+        if app.config['ESCRITURA_AGRUPADA']:
+            try:
+                registro_id = buffer_escritura.enviar(datos, app.config['ESCRITURA_AGRUPADA_ESPERA'])
+            except TimeoutError as e:
+                mensaje = ('Tiempo de espera agotado; verifique si los datos se guardaron'
+                           if str(e) == 'tomada' else 'Tiempo de espera agotado; los datos no se guardaron')
+                return jsonify({'success': False, 'message': mensaje}), 503
+            # El commit fue en otro hilo: las lecturas siguientes de esta sesión van al primario
+            g.hubo_escritura = True
+        else:
+            nuevo_registro, = registrar_actualizaciones([datos])
+            db.session.flush()
+            registro_id = nuevo_registro.id
+            db.session.commit()
         
+        # Las lecturas siguientes de esta sesión esperan a que el estado en memoria lo incluya
+        session['ultima_secuencia'] = registro_id
         return jsonify({
             'success': True, 
-            'message': 'Datos guardados correctamente'
+            'message': 'Datos guardados correctamente',
+            'secuencia': registro_id
         })
         
     except Exception as e:
@@ -746,7 +3440,241 @@ def actualizar_estacion():
         return jsonify({'success': False, 'message': f'Error interno del servidor: {str(e)}'}), 500
 
 # ================= CARGA Y EXPORTACIÓN DE ARCHIVOS =================
+CARGA_LOTE = 5000
+
+COLUMNAS_COMPARADAS = ('razon_social', 'zona', 'provincia', 'municipio', *PRODUCTOS,
+                       'funcionario', 'filas_do_do_plus', 'filas_ge_ge_plus')
+
+def estado_actual_estaciones(codigos, lote=500):
+    """{codigo: valores de COLUMNAS_COMPARADAS} del último registro de cada estación"""
+    columnas = [getattr(RegistroCombustible, nombre) for nombre in COLUMNAS_COMPARADAS]
+    codigos = sorted(codigos)
+    estado = {}
+    for i in range(0, len(codigos), lote):
+        filtros = [RegistroCombustible.codigo.in_(codigos[i:i + lote])]
+        filas = consulta_ultimos(filtros, RegistroCombustible.codigo, *columnas).order_by(RegistroCombustible.id)
+        for codigo, *valores in filas:
+            estado[codigo] = tuple(valores)
+    return estado
+
+# Simulación de carga: lotes de filas validados en procesos aparte
+SIMULACION_LOTE = 10000
+SIMULACION_MAX_DETALLE = 1000
+_pool_validacion = None
+_lock_pool_validacion = threading.Lock()
+
+def pool_validacion():
+    """Pool de procesos de la simulación, creado al primer uso y reutilizado"""
+    global _pool_validacion
+    with _lock_pool_validacion:
+        if _pool_validacion is None:
+            # spawn: los procesos importan validacion_carga sin heredar conexiones ni hilos
+            _pool_validacion = ProcessPoolExecutor(
+                max_workers=app.config['CARGA_VALIDACION_PROCESOS'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool_validacion
+
+def _enviar_lote(mapa, lote):
+    try:
+        return pool_validacion().submit(validar_lote, mapa, lote, SIMULACION_MAX_DETALLE)
+    except BrokenProcessPool:
+        return None
+
+def _resultado_lote(mapa, lote, futuro):
+    if futuro is not None:
+        try:
+            return futuro.result()
+        except BrokenProcessPool:
+            # Un proceso murió: se descarta el pool y el lote se valida aquí
+            global _pool_validacion
+            with _lock_pool_validacion:
+                _pool_validacion = None
+    return validar_lote(mapa, lote, SIMULACION_MAX_DETALLE)
+
+@contextmanager
+def lector_csv(archivo):
+    """csv.reader sobre un archivo binario, sin cerrar el archivo al terminar.
+
+    Un TextIOWrapper cierra el archivo que envuelve cuando se recolecta; en la
+    carga por fragmentos ese archivo es el que sostiene el bloqueo de la carga.
+    """
+    texto = io.TextIOWrapper(archivo, encoding='utf-8', newline='')
+    try:
+        yield csv.reader(texto)
+    finally:
+        texto.detach()
+
+def simular_carga(archivo):
+    """Valida el archivo (binario) como lo haría la carga, sin tocar la base de datos"""
+    with lector_csv(archivo) as csv_input:
+        mapa, faltantes = mapear_columnas(next(csv_input, []))
+        if faltantes:
+            return jsonify({
+                'success': False,
+                'message': f'Columnas faltantes o con nombres diferentes: {", ".join(faltantes)}'
+            }), 400
+
+        paralelo = app.config['CARGA_VALIDACION_PROCESOS'] > 1
+        pendientes = []
+        lote = []
+        for row in csv_input:
+            lote.append((csv_input.line_num, row))
+            if len(lote) == SIMULACION_LOTE:
+                # Los lotes se envían mientras se sigue leyendo el archivo
+                pendientes.append((lote, _enviar_lote(mapa, lote) if paralelo else None))
+                lote = []
+        if lote:
+            pendientes.append((lote, None))
+    resultados = [_resultado_lote(mapa, lote, futuro) for lote, futuro in pendientes]
+    total = combinar_lotes(resultados, SIMULACION_MAX_DETALLE)
+
+    volumen_total = sum(total['volumen'].values())
+    return jsonify({
+        'success': True,
+        'simulacion': True,
+        'message': (f'Simulación: {total["validas"]} filas válidas, {total["n_errores"]} rechazadas, '
+                    f'{total["n_avisos"]} con fecha no reconocida. No se guardó nada.'),
+        'resumen': {
+            'filas': total['filas'],
+            'validas': total['validas'],
+            'rechazadas': total['n_errores'],
+            'fecha_no_reconocida': total['n_avisos'],
+            'estaciones': len(total['codigos']),
+            'funcionarios': len(total['funcionarios']),
+            'fecha_min': total['fecha_min'].strftime('%Y-%m-%d %H:%M:%S') if total['fecha_min'] else None,
+            'fecha_max': total['fecha_max'].strftime('%Y-%m-%d %H:%M:%S') if total['fecha_max'] else None,
+            'volumen_por_producto': total['volumen'],
+            'volumen_total': volumen_total,
+        },
+        'errores': total['errores'],
+        'avisos': total['avisos'],
+        'detalle_truncado': (len(total['errores']) < total['n_errores']
+                             or len(total['avisos']) < total['n_avisos'])
+    })
+
+def hash_archivo_binario(archivo):
+    """sha256 leído por bloques; deja el archivo al principio"""
+    h = hashlib.sha256()
+    for bloque in iter(lambda: archivo.read(1024 * 1024), b''):
+        h.update(bloque)
+    archivo.seek(0)
+    return h.hexdigest()
+
+def ingerir_archivo_carga(archivo, nombre_archivo, usuario, hash_archivo=None):
+    """Carga un CSV (archivo binario) en lotes de CARGA_LOTE filas, en una sola transacción.
+
+    La usan la carga directa y la carga por fragmentos. El archivo se lee en
+    streaming: la memoria depende del lote y no del tamaño del archivo.
+    Devuelve (resultado, código HTTP).
+    """
+    hash_archivo = hash_archivo or hash_archivo_binario(archivo)
+    carga_previa = CargaArchivo.query.filter_by(hash_archivo=hash_archivo).first()
+    if carga_previa:
+        return resultado_carga_duplicada(carga_previa)
+
+    with lector_csv(archivo) as csv_input:
+        mapa, missing_columns = mapear_columnas(next(csv_input, []))
+    
+        if missing_columns:
+            return {
+                'success': False, 
+                'message': f'Columnas faltantes o con nombres diferentes: {", ".join(missing_columns)}'
+            }, 400
+    
+        contadores = {'insertados': 0, 'sin_cambios': 0, 'rechazados': 0}
+        usuarios_creados = set()
+        estado_actual = {}
+    
+        def insertar_lote(filas_validas):
+            # Las filas iguales al estado vigente de la estación no agregan historial
+            nuevos_codigos = {datos['codigo'] for datos in filas_validas} - estado_actual.keys()
+            estado_actual.update(dict.fromkeys(nuevos_codigos))
+            estado_actual.update(estado_actual_estaciones(nuevos_codigos))
+            registros_nuevos = []
+            for datos in filas_validas:
+                valores = tuple(datos[columna] for columna in COLUMNAS_COMPARADAS)
+                if estado_actual[datos['codigo']] == valores:
+                    contadores['sin_cambios'] += 1
+                    continue
+                estado_actual[datos['codigo']] = valores
+            
+                nuevo_registro = RegistroCombustible(
+                    **datos,
+                    usuario_actualizacion=usuario,
+                    tipo_registro='inicial'
+                )
+                db.session.add(nuevo_registro)
+                registros_nuevos.append(nuevo_registro)
+            contadores['insertados'] += len(registros_nuevos)
+            procesar_registros_nuevos(registros_nuevos)
+    
+        filas_validas = []
+        for row in csv_input:
+            try:
+                datos, error, _ = parsear_fila(row, mapa)
+                if error:
+                    contadores['rechazados'] += 1
+                    continue
+            
+                funcionario = datos['funcionario']
+                if funcionario not in usuarios_creados:
+                    # Sin commit: un usuario nuevo no debe confirmar a medias los lotes anteriores
+                    crear_usuario_desde_funcionario(funcionario, confirmar=False)
+                    usuarios_creados.add(funcionario)
+            
+                if datos['fecha_hora'] is None:
+                    datos['fecha_hora'] = datetime.utcnow()
+                filas_validas.append(datos)
+            
+            except Exception as e:
+                print(f"Error procesando fila: {e}")
+                contadores['rechazados'] += 1
+                continue
+        
+            if len(filas_validas) >= CARGA_LOTE:
+                insertar_lote(filas_validas)
+                filas_validas = []
+        insertar_lote(filas_validas)
+    
+    # La carga se registra en la misma transacción que sus filas: el índice
+    # único del hash rechaza una copia que se procese en paralelo
+    nueva_carga = CargaArchivo(
+        usuario=usuario,
+        nombre_archivo=nombre_archivo,
+        hash_archivo=hash_archivo,
+        registros_procesados=contadores['insertados'],
+        registros_sin_cambios=contadores['sin_cambios'],
+        registros_rechazados=contadores['rechazados']
+    )
+    db.session.add(nueva_carga)
+    try:
+        db.session.commit()
+    except sa.exc.IntegrityError:
+        db.session.rollback()
+        return resultado_carga_duplicada(CargaArchivo.query.filter_by(hash_archivo=hash_archivo).first())
+    
+    mensaje = (f'Archivo procesado correctamente. {contadores["insertados"]} registros creados, '
+               f'{contadores["sin_cambios"]} sin cambios, {contadores["rechazados"]} rechazados.')
+    if usuarios_creados:
+        mensaje += f' {len(usuarios_creados)} usuarios creados.'
+    
+    return {
+        'success': True, 
+        'message': mensaje,
+        **contadores
+    }, 200
+
+def resultado_carga_duplicada(carga):
+    return {
+        'success': False,
+        'duplicado': True,
+        'message': (f'Este archivo ya fue cargado el {carga.fecha_hora.strftime("%Y-%m-%d %H:%M")} '
+                    f'por {carga.usuario} ({carga.nombre_archivo}).')
+    }, 409
+
 @app.route('/admin/upload', methods=['POST'])
+@transaccion_escritura()
 def upload_file():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
@@ -761,146 +3689,10 @@ def upload_file():
     
     if file and allowed_file(file.filename):
         try:
-            stream = StringIO(file.stream.read().decode("UTF8"), newline=None)
-            csv_input = csv.reader(stream)
-            
-            headers = [h.strip().upper() for h in next(csv_input)]
-            
-            fecha_hora_columna = None
-            for i, header in enumerate(headers):
-                if 'FECHA' in header and 'HORA' in header and 'ACTUALIZACION' in header:
-                    fecha_hora_columna = i
-                    break
-            
-            if fecha_hora_columna is None:
-                headers.append('FECHA Y HORA DE ACTUALIZACION')
-                fecha_hora_columna = len(headers) - 1
-            
-            required_columns = [
-                'CODIGO', 'RAZON SOCIAL ANH', 'ZONA', 'PROVINCIA', 'MUNICIPIO',
-                'DO/DO+ (LTS)', 'DO ULS+ (LTS)', 'GE/GE+ (LTS)', 'GP+ (LTS)', 
-                'GPULTRA100 (LTS)', 'FUNCIONARIO', 'FILAS DO/DO+', 'FILAS GE/GE+'
-            ]
-            
-            required_columns_normalized = [col.upper().strip() for col in required_columns]
-            headers_normalized = [h.upper().strip() for h in headers]
-            
-            missing_columns = []
-            for req_col in required_columns_normalized:
-                found = False
-                for header in headers_normalized:
-                    if req_col in header or header in req_col:
-                        found = True
-                        break
-                if not found:
-                    missing_columns.append(req_col)
-            
-            if missing_columns:
-                return jsonify({
-                    'success': False, 
-                    'message': f'Columnas faltantes o con nombres diferentes: {", ".join(missing_columns)}'
-                }), 400
-            
-            processed_count = 0
-            usuarios_creados = set()
-            
-            for row in csv_input:
-                if len(row) < len(headers) - 1:
-                    continue
-                
-                try:
-                    def get_column_index(column_name):
-                        for i, header in enumerate(headers_normalized):
-                            if column_name in header or header in column_name:
-                                return i
-                        return -1
-                    
-                    codigo_idx = get_column_index('CODIGO')
-                    razon_social_idx = get_column_index('RAZON SOCIAL ANH')
-                    zona_idx = get_column_index('ZONA')
-                    provincia_idx = get_column_index('PROVINCIA')
-                    municipio_idx = get_column_index('MUNICIPIO')
-                    do_do_plus_idx = get_column_index('DO/DO+ (LTS)')
-                    do_uls_plus_idx = get_column_index('DO ULS+ (LTS)')
-                    ge_ge_plus_idx = get_column_index('GE/GE+ (LTS)')
-                    gp_plus_idx = get_column_index('GP+ (LTS)')
-                    gp_ultra_idx = get_column_index('GPULTRA100 (LTS)')
-                    funcionario_idx = get_column_index('FUNCIONARIO')
-                    filas_do_idx = get_column_index('FILAS DO/DO+')
-                    filas_ge_idx = get_column_index('FILAS GE/GE+')
-                    
-                    if -1 in [codigo_idx, razon_social_idx, funcionario_idx]:
-                        continue
-                    
-                    codigo = str(row[codigo_idx]) if codigo_idx < len(row) else ''
-                    funcionario = str(row[funcionario_idx]) if funcionario_idx < len(row) else ''
-                    
-                    if not codigo or not funcionario:
-                        continue
-                    
-                    if funcionario and funcionario not in usuarios_creados:
-                        crear_usuario_desde_funcionario(funcionario)
-                        usuarios_creados.add(funcionario)
-                    
-                    fecha_hora_actualizacion = datetime.utcnow()
-                    if fecha_hora_columna < len(row) and row[fecha_hora_columna]:
-                        try:
-                            fecha_hora_str = row[fecha_hora_columna].strip()
-                            if fecha_hora_str:
-                                for fmt in ['%Y-%m-%d %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y']:
-                                    try:
-                                        fecha_hora_actualizacion = datetime.strptime(fecha_hora_str, fmt)
-                                        break
-                                    except ValueError:
-                                        continue
-                        except:
-                            fecha_hora_actualizacion = datetime.utcnow()
-                    
-                    nuevo_registro = RegistroCombustible(
-                        codigo=codigo,
-                        razon_social=str(row[razon_social_idx]) if razon_social_idx < len(row) else '',
-                        zona=str(row[zona_idx]) if zona_idx < len(row) else '',
-                        provincia=str(row[provincia_idx]) if provincia_idx < len(row) else '',
-                        municipio=str(row[municipio_idx]) if municipio_idx < len(row) else '',
-                        do_do_plus=int(float(row[do_do_plus_idx] or 0)) if do_do_plus_idx < len(row) else 0,
-                        do_uls_plus=int(float(row[do_uls_plus_idx] or 0)) if do_uls_plus_idx < len(row) else 0,
-                        ge_ge_plus=int(float(row[ge_ge_plus_idx] or 0)) if ge_ge_plus_idx < len(row) else 0,
-                        gp_plus=int(float(row[gp_plus_idx] or 0)) if gp_plus_idx < len(row) else 0,
-                        gp_ultra_100=int(float(row[gp_ultra_idx] or 0)) if gp_ultra_idx < len(row) else 0,
-                        funcionario=funcionario,
-                        filas_do_do_plus=int(float(row[filas_do_idx] or 0)) if filas_do_idx < len(row) else 0,
-                        filas_ge_ge_plus=int(float(row[filas_ge_idx] or 0)) if filas_ge_idx < len(row) else 0,
-                        fecha_hora=fecha_hora_actualizacion,
-                        usuario_actualizacion=session.get('user'),
-                        tipo_registro='inicial'
-                    )
-                    
-                    db.session.add(nuevo_registro)
-                    processed_count += 1
-                    
-                except Exception as e:
-                    print(f"Error procesando fila: {e}")
-                    continue
-            
-            db.session.commit()
-            
-            # Registrar la carga del archivo
-            nueva_carga = CargaArchivo(
-                usuario=session.get('user'),
-                nombre_archivo=file.filename,
-                registros_procesados=processed_count
-            )
-            db.session.add(nueva_carga)
-            db.session.commit()
-            
-            mensaje = f'Archivo procesado correctamente. {processed_count} registros creados.'
-            if usuarios_creados:
-                mensaje += f' {len(usuarios_creados)} usuarios creados.'
-            
-            return jsonify({
-                'success': True, 
-                'message': mensaje
-            })
+            if request.values.get('simular') in ('1', 'true', 'si'):
+                return simular_carga(file.stream)
+            resultado, estado = ingerir_archivo_carga(file.stream, file.filename, session.get('user'))
+            return jsonify(resultado), estado
             
         except Exception as e:
             db.session.rollback()
@@ -911,155 +3703,592 @@ def upload_file():
     
     return jsonify({'success': False, 'message': 'Tipo de archivo no permitido'}), 400
 
+# ================= CARGA POR FRAGMENTOS =================
+# Protocolo reanudable: iniciar -> fragmentos con offset y sha256 -> finalizar.
+# Cada fragmento se agrega al archivo parcial en disco; el offset confirmado es
+# siempre el tamaño del archivo. El estado de cada carga vive en un .json al
+# lado, para que cualquier proceso de gunicorn pueda responder por ella.
+PATRON_ID_CARGA = re.compile(r'^[0-9a-f]{32}$')
+
+# Las cargas finalizadas se procesan de a una por proceso, fuera de la petición
+ejecutor_ingestas = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingesta')
+
+def _rutas_carga_parcial(carga_id):
+    if not PATRON_ID_CARGA.match(carga_id):
+        return None, None
+    base = os.path.join(app.config['UPLOAD_FOLDER'], 'parciales', carga_id)
+    return base + '.part', base + '.json'
+
+def leer_carga_parcial(carga_id):
+    """(ruta del archivo parcial, metadatos) o (None, None) si no existe"""
+    ruta, ruta_meta = _rutas_carga_parcial(carga_id)
+    if ruta is None or not os.path.exists(ruta_meta):
+        return None, None
+    with open(ruta_meta) as f:
+        return ruta, json.load(f)
+
+def guardar_carga_parcial(carga_id, meta):
+    _, ruta_meta = _rutas_carga_parcial(carga_id)
+    with open(ruta_meta + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(ruta_meta + '.tmp', ruta_meta)
+
+def eliminar_archivo(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+def limpiar_cargas_parciales():
+    """Borra las cargas sin actividad desde hace CARGA_PARCIAL_HORAS"""
+    carpeta = os.path.join(app.config['UPLOAD_FOLDER'], 'parciales')
+    limite = time.time() - app.config['CARGA_PARCIAL_HORAS'] * 3600
+    for nombre in os.listdir(carpeta):
+        ruta = os.path.join(carpeta, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+def bloquear_carga_parcial(archivo):
+    """Un solo fragmento o finalización a la vez por carga, también entre procesos.
+
+    El bloqueo dura hasta que se cierra el archivo.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # Windows: se bloquea el primer byte, también se suelta al cerrar
+        import msvcrt
+        posicion = archivo.tell()
+        archivo.seek(0)
+        try:
+            msvcrt.locking(archivo.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+        finally:
+            archivo.seek(posicion)
+    try:
+        fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+def _ingerir_carga_parcial(carga_id, archivo, meta, hash_archivo):
+    """Tarea de ejecutor_ingestas: recibe el archivo ya bloqueado y lo cierra al terminar"""
+    ruta, _ = _rutas_carga_parcial(carga_id)
+    with archivo, app.app_context(), transaccion_escritura():
+        try:
+            resultado, codigo = ingerir_archivo_carga(archivo, meta['nombre_archivo'], meta['usuario'], hash_archivo)
+        except Exception as e:
+            db.session.rollback()
+            resultado, codigo = {'success': False, 'message': f'Error al procesar archivo: {str(e)}'}, 500
+        # Se registra el resultado antes de soltar el bloqueo. Procesada o ya
+        # cargada antes, el archivo parcial ya no sirve; con error se puede reintentar.
+        meta.update(estado='error' if codigo == 500 else 'completada', resultado=resultado, codigo=codigo)
+        guardar_carga_parcial(carga_id, meta)
+        if codigo != 500:
+            eliminar_archivo(ruta)
+
+@app.route('/admin/upload/parcial', methods=['POST'])
+def iniciar_carga_parcial():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    datos = request.get_json(silent=True) or request.form
+    nombre_archivo = secure_filename(datos.get('nombre_archivo') or '')
+    if not nombre_archivo or not allowed_file(nombre_archivo):
+        return jsonify({'success': False, 'message': 'Tipo de archivo no permitido'}), 400
+    try:
+        tamano = int(datos['tamano']) if datos.get('tamano') not in (None, '') else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Tamaño no válido'}), 400
+
+    try:
+        os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'parciales'), exist_ok=True)
+        limpiar_cargas_parciales()
+        carga_id = uuid.uuid4().hex
+        ruta, _ = _rutas_carga_parcial(carga_id)
+        open(ruta, 'wb').close()
+        guardar_carga_parcial(carga_id, {
+            'nombre_archivo': nombre_archivo,
+            'tamano': tamano,
+            'sha256': (datos.get('sha256') or '').lower() or None,
+            'usuario': session.get('user'),
+            'creada': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'estado': 'recibiendo'
+        })
+        return jsonify({'success': True, 'id': carga_id, 'offset': 0,
+                        'fragmento_max': app.config['CARGA_FRAGMENTO_MB'] * 1024 * 1024})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error al iniciar la carga: {str(e)}'}), 500
+
+@app.route('/admin/upload/parcial/<carga_id>', methods=['GET'])
+def estado_carga_parcial(carga_id):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    ruta, meta = leer_carga_parcial(carga_id)
+    if ruta is None:
+        return jsonify({'success': False, 'message': 'Carga no encontrada o vencida'}), 404
+    offset = os.path.getsize(ruta) if os.path.exists(ruta) else meta['tamano']
+    return jsonify({'success': True, 'id': carga_id, 'offset': offset, **meta})
+
+@app.route('/admin/upload/parcial/<carga_id>', methods=['PUT'])
+def agregar_fragmento(carga_id):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    ruta, meta = leer_carga_parcial(carga_id)
+    if ruta is None or meta['estado'] != 'recibiendo':
+        return jsonify({'success': False, 'message': 'Carga no encontrada, vencida o ya finalizada'}), 404
+    offset = request.args.get('offset', type=int)
+    checksum = request.headers.get('X-Checksum-Sha256', '').lower()
+    if offset is None or not checksum:
+        return jsonify({'success': False, 'message': 'Se requieren offset y la cabecera X-Checksum-Sha256'}), 400
+    fragmento_max = app.config['CARGA_FRAGMENTO_MB'] * 1024 * 1024
+
+    with open(ruta, 'r+b') as archivo:
+        if not bloquear_carga_parcial(archivo):
+            return jsonify({'success': False, 'message': 'Hay otro fragmento en curso para esta carga'}), 409
+        confirmado = os.fstat(archivo.fileno()).st_size
+        if offset != confirmado:
+            # El cliente reanuda desde el offset que devuelve el servidor
+            return jsonify({'success': False, 'message': 'Offset distinto del confirmado', 'offset': confirmado}), 409
+
+        archivo.seek(confirmado)
+        h = hashlib.sha256()
+        escritos = 0
+        try:
+            for bloque in iter(lambda: request.stream.read(64 * 1024), b''):
+                escritos += len(bloque)
+                if escritos > fragmento_max or (meta['tamano'] is not None and confirmado + escritos > meta['tamano']):
+                    raise ValueError('El fragmento supera el tamaño permitido')
+                h.update(bloque)
+                archivo.write(bloque)
+            if h.hexdigest() != checksum:
+                raise ValueError('El checksum del fragmento no coincide')
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        except Exception as e:
+            # Un fragmento cortado o corrupto no deja rastro: se vuelve al último offset confirmado
+            archivo.truncate(confirmado)
+            return jsonify({'success': False, 'message': str(e), 'offset': confirmado}), 400
+    return jsonify({'success': True, 'offset': confirmado + escritos})
+
+@app.route('/admin/upload/parcial/<carga_id>', methods=['DELETE'])
+def cancelar_carga_parcial(carga_id):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    ruta, ruta_meta = _rutas_carga_parcial(carga_id)
+    if ruta is None:
+        return jsonify({'success': True})
+    try:
+        archivo = open(ruta, 'rb')
+    except FileNotFoundError:
+        # Ya procesada: sólo quedan los metadatos
+        eliminar_archivo(ruta_meta)
+        return jsonify({'success': True})
+    with archivo:
+        # Mismo bloqueo que fragmentos y finalización: no se borra una carga en uso
+        if not bloquear_carga_parcial(archivo):
+            return jsonify({'success': False, 'message': 'La carga se está usando, intente de nuevo'}), 409
+        eliminar_archivo(ruta_meta)
+        eliminar_archivo(ruta)
+    return jsonify({'success': True})
+
+@app.route('/admin/upload/parcial/<carga_id>/finalizar', methods=['POST'])
+def finalizar_carga_parcial(carga_id):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    ruta, meta = leer_carga_parcial(carga_id)
+    if ruta is None:
+        return jsonify({'success': False, 'message': 'Carga no encontrada o vencida'}), 404
+    if meta['estado'] == 'completada':
+        return jsonify({'estado': meta['estado'], **meta['resultado']}), meta['codigo']
+    simular = request.values.get('simular') in ('1', 'true', 'si')
+
+    archivo = open(ruta, 'rb')
+    entregado = False
+    try:
+        if not bloquear_carga_parcial(archivo):
+            return jsonify({'success': False, 'message': 'La carga ya se está procesando', 'estado': 'procesando'}), 409
+        tamano = os.fstat(archivo.fileno()).st_size
+        if meta['tamano'] is not None and tamano != meta['tamano']:
+            return jsonify({'success': False, 'message': f'Carga incompleta: {tamano} de {meta["tamano"]} bytes',
+                            'offset': tamano}), 409
+        hash_archivo = hash_archivo_binario(archivo)
+        if meta['sha256'] and hash_archivo != meta['sha256']:
+            return jsonify({'success': False, 'message': 'El checksum del archivo completo no coincide'}), 400
+        if simular:
+            return simular_carga(archivo)
+
+        # La ingesta puede superar el timeout de la petición: se entrega el
+        # archivo bloqueado a ejecutor_ingestas y se consulta con GET
+        meta['estado'] = 'procesando'
+        guardar_carga_parcial(carga_id, meta)
+        ejecutor_ingestas.submit(_ingerir_carga_parcial, carga_id, archivo, meta, hash_archivo)
+        entregado = True
+        return jsonify({'success': True, 'estado': 'procesando', 'id': carga_id,
+                        'message': 'Archivo recibido completo. Procesando...'}), 202
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error al finalizar la carga: {str(e)}'}), 500
+    finally:
+        if not entregado:
+            archivo.close()
+
+# ================= EXPORTACIONES EN SEGUNDO PLANO =================
+# Cada exportación es un trabajo identificado por (formato, rango efectivo,
+# versión de registros). El resultado queda en disco con un .json de estado al
+# lado; un flock por trabajo evita que dos procesos generen el mismo archivo.
+FORMATOS_EXPORTACION = {
+    'csv': ('.csv', 'text/csv'),
+    'excel': ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+PATRON_ID_EXPORTACION = re.compile(r'^[0-9a-f]{32}$')
+
+ejecutor_exportaciones = ThreadPoolExecutor(max_workers=app.config['EXPORTACION_HILOS'],
+                                            thread_name_prefix='exportacion')
+_trabajos_exportacion = {}
+_lock_trabajos_exportacion = threading.Lock()
+_lock_cache_exportaciones = threading.Lock()
+
+class ColaExportacionLlena(Exception):
+    pass
+
+def escribir_exportacion_csv(registros, archivo):
+    writer = csv.writer(archivo)
+    writer.writerow(CABECERA_EXPORTACION)
+    writer.writerows(fila_exportacion(registro) for registro in registros)
+
+def escribir_exportacion_excel(registros, archivo):
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = "Datos Combustibles"
+
+    # Encabezados y datos, una fila por estación
+    worksheet.append(CABECERA_EXPORTACION)
+    for registro in registros:
+        worksheet.append(fila_exportacion(registro))
+    workbook.save(archivo)
+
+def leer_filtros_exportacion(args):
+    """Filtros de la exportación a partir de los parámetros; ValueError si no son válidos"""
+    filtros = {campo: args.get(campo) or None for campo in ('fecha_inicio', 'fecha_fin', 'hora_inicio', 'hora_fin')}
+    fechas = {campo: datetime.strptime(filtros[campo], '%Y-%m-%d') if filtros[campo] else None
+              for campo in ('fecha_inicio', 'fecha_fin')}
+    desde, hasta = limites_rango_fechas(fechas['fecha_inicio'], fechas['fecha_fin'],
+                                        filtros['hora_inicio'], filtros['hora_fin'])
+    return filtros, desde, hasta
+
+def _rutas_exportacion(trabajo_id, formato=None):
+    base = os.path.join(app.config['EXPORTACION_CARPETA'], trabajo_id)
+    return (base + FORMATOS_EXPORTACION[formato][0] if formato else None), base + '.json'
+
+def leer_trabajo_exportacion(trabajo_id):
+    """Estado del trabajo o None si no existe"""
+    if not PATRON_ID_EXPORTACION.match(trabajo_id):
+        return None
+    try:
+        with open(_rutas_exportacion(trabajo_id)[1]) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def guardar_trabajo_exportacion(trabajo_id, meta):
+    _, ruta_meta = _rutas_exportacion(trabajo_id)
+    with open(ruta_meta + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(ruta_meta + '.tmp', ruta_meta)
+
+def resultado_vigente(trabajo_id, meta):
+    """Ruta del archivo si el trabajo terminó hace menos de EXPORTACION_VIDA segundos"""
+    if not meta or meta['estado'] != 'listo':
+        return None
+    ruta, _ = _rutas_exportacion(trabajo_id, meta['formato'])
+    if not os.path.exists(ruta) or time.time() - meta['terminado_ts'] > app.config['EXPORTACION_VIDA']:
+        return None
+    return ruta
+
+def tocar_exportacion(ruta):
+    # El orden del LRU es la fecha de modificación del archivo
+    try:
+        os.utime(ruta)
+    except FileNotFoundError:
+        pass
+
+def podar_exportaciones(conservar=None):
+    """Borra los resultados usados hace más tiempo hasta volver a EXPORTACION_CACHE_MB.
+
+    conservar es el trabajo recién terminado, que todavía no se descargó.
+    """
+    carpeta = app.config['EXPORTACION_CARPETA']
+    max_bytes = app.config['EXPORTACION_CACHE_MB'] * 1024 * 1024
+    extensiones = tuple(extension for extension, _ in FORMATOS_EXPORTACION.values())
+    with _lock_cache_exportaciones:
+        archivos = []
+        for nombre in os.listdir(carpeta):
+            if not nombre.endswith(extensiones) or nombre.startswith(f'{conservar}.'):
+                continue
+            try:
+                estado = os.stat(os.path.join(carpeta, nombre))
+            except FileNotFoundError:
+                continue
+            archivos.append((estado.st_mtime, estado.st_size, nombre))
+        archivos.sort()
+        total = sum(tamano for _, tamano, _ in archivos)
+        while archivos and total > max_bytes:
+            _, tamano, nombre = archivos.pop(0)
+            trabajo_id = nombre.split('.', 1)[0]
+            eliminar_archivo(os.path.join(carpeta, nombre))
+            eliminar_archivo(_rutas_exportacion(trabajo_id)[1])
+            eliminar_archivo(os.path.join(carpeta, trabajo_id + '.lock'))
+            total -= tamano
+
+def esperar_bloqueo(archivo):
+    """Bloqueo exclusivo del archivo entre procesos; espera a que se libere"""
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        archivo.seek(0)
+        while True:
+            try:
+                # LK_LOCK se rinde a los 10 segundos
+                msvcrt.locking(archivo.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass
+    fcntl.flock(archivo, fcntl.LOCK_EX)
+
+def _generar_exportacion(trabajo_id, meta):
+    """Tarea de ejecutor_exportaciones"""
+    ruta, _ = _rutas_exportacion(trabajo_id, meta['formato'])
+    with open(os.path.join(app.config['EXPORTACION_CARPETA'], trabajo_id + '.lock'), 'w') as candado:
+        # Si otro proceso genera el mismo trabajo, se espera su resultado
+        esperar_bloqueo(candado)
+        actual = leer_trabajo_exportacion(trabajo_id)
+        if resultado_vigente(trabajo_id, actual):
+            return actual
+        meta.update(estado='generando', inicio_ts=time.time())
+        guardar_trabajo_exportacion(trabajo_id, meta)
+        try:
+            with app.app_context():
+                # Lee del mismo lado que la versión con la que se armó la clave
+                g.usar_replica = meta.get('replica', False)
+                filtros = meta['filtros']
+                registros = obtener_ultimas_filas(
+                    datetime.strptime(filtros['fecha_inicio'], '%Y-%m-%d') if filtros['fecha_inicio'] else None,
+                    datetime.strptime(filtros['fecha_fin'], '%Y-%m-%d') if filtros['fecha_fin'] else None,
+                    filtros['hora_inicio'], filtros['hora_fin'])
+                db.session.remove()
+            if meta['formato'] == 'csv':
+                with open(ruta + '.tmp', 'w', newline='', encoding='utf-8') as archivo:
+                    escribir_exportacion_csv(registros, archivo)
+            else:
+                with open(ruta + '.tmp', 'wb') as archivo:
+                    escribir_exportacion_excel(registros, archivo)
+            os.replace(ruta + '.tmp', ruta)
+            meta.update(estado='listo', filas=len(registros), bytes=os.path.getsize(ruta),
+                        terminado_ts=time.time(), segundos=round(time.time() - meta['inicio_ts'], 3))
+        except Exception as e:
+            eliminar_archivo(ruta + '.tmp')
+            meta.update(estado='error', mensaje=str(e), terminado_ts=time.time())
+            print(f"❌ Error en la exportación {trabajo_id}: {e}")
+        guardar_trabajo_exportacion(trabajo_id, meta)
+    if meta['estado'] == 'listo':
+        podar_exportaciones(conservar=trabajo_id)
+    return meta
+
+def solicitar_exportacion(formato, args):
+    """(id, estado, futuro) del trabajo que exporta con estos filtros.
+
+    Reutiliza el resultado en disco o el trabajo en curso con los mismos
+    filtros y la misma versión de registros; si no, encola uno nuevo. futuro
+    es None cuando el resultado ya estaba listo o lo genera otro proceso.
+    """
+    filtros, desde, hasta = leer_filtros_exportacion(args)
+    (max_id, version_registros), _ = version_datos()
+    clave = json.dumps([formato, desde and desde.isoformat(), hasta and hasta.isoformat(), max_id, version_registros])
+    trabajo_id = hashlib.sha256(clave.encode()).hexdigest()[:32]
+
+    meta = leer_trabajo_exportacion(trabajo_id)
+    ruta = resultado_vigente(trabajo_id, meta)
+    if ruta:
+        tocar_exportacion(ruta)
+        return trabajo_id, meta, None
+    with _lock_trabajos_exportacion:
+        futuro = _trabajos_exportacion.get(trabajo_id)
+        if futuro is not None and not futuro.done():
+            return trabajo_id, leer_trabajo_exportacion(trabajo_id) or meta, futuro
+        en_cola = sum(1 for f in _trabajos_exportacion.values() if not f.done())
+        if en_cola >= app.config['EXPORTACION_PENDIENTES']:
+            raise ColaExportacionLlena()
+        for anterior in [i for i, f in _trabajos_exportacion.items() if f.done()]:
+            del _trabajos_exportacion[anterior]
+        os.makedirs(app.config['EXPORTACION_CARPETA'], exist_ok=True)
+        meta = {
+            'id': trabajo_id,
+            'formato': formato,
+            'filtros': filtros,
+            'version': [max_id, version_registros],
+            'replica': bool(g.get('usar_replica')),
+            'usuario': session.get('user'),
+            'creado': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'estado': 'pendiente',
+        }
+        actual = leer_trabajo_exportacion(trabajo_id)
+        if actual and actual['estado'] == 'generando':
+            # Lo está generando otro proceso: el trabajo local espera su flock
+            meta = actual
+        else:
+            guardar_trabajo_exportacion(trabajo_id, meta)
+        futuro = ejecutor_exportaciones.submit(_generar_exportacion, trabajo_id, meta)
+        _trabajos_exportacion[trabajo_id] = futuro
+    return trabajo_id, meta, futuro
+
+def esperar_exportacion(trabajo_id, futuro, segundos):
+    """Estado del trabajo tras esperar a lo sumo segundos a que termine"""
+    limite = time.monotonic() + segundos
+    if futuro is not None:
+        try:
+            futuro.result(timeout=segundos)
+        except Exception:
+            pass
+    meta = leer_trabajo_exportacion(trabajo_id)
+    # Lo genera otro proceso: se sigue su archivo de estado
+    while meta and meta['estado'] in ('pendiente', 'generando') and time.monotonic() < limite:
+        time.sleep(0.2)
+        meta = leer_trabajo_exportacion(trabajo_id)
+    return meta
+
+def descargar_exportacion(trabajo_id, meta):
+    extension, mimetype = FORMATOS_EXPORTACION[meta['formato']]
+    ruta, _ = _rutas_exportacion(trabajo_id, meta['formato'])
+    tocar_exportacion(ruta)
+    return send_file(
+        os.path.abspath(ruta),
+        as_attachment=True,
+        download_name=f"datos_combustibles_{datetime.fromtimestamp(meta['terminado_ts']):%Y%m%d_%H%M%S}{extension}",
+        mimetype=mimetype
+    )
+
+def estado_exportacion_json(trabajo_id, meta):
+    datos = {clave: valor for clave, valor in meta.items() if not clave.endswith('_ts')}
+    datos['estado_url'] = url_for('estado_exportacion', trabajo_id=trabajo_id)
+    if meta['estado'] == 'listo':
+        datos['descarga_url'] = url_for('descargar_exportacion_ruta', trabajo_id=trabajo_id)
+    return datos
+
+@app.route('/admin/export/trabajos', methods=['POST'])
+@lectura_replica
+def crear_exportacion():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    datos = request.get_json(silent=True) or request.form
+    formato = datos.get('formato', 'csv')
+    if formato not in FORMATOS_EXPORTACION:
+        return jsonify({'success': False, 'message': 'Formato no válido. Use: csv, excel'}), 400
+    try:
+        trabajo_id, meta, _ = solicitar_exportacion(formato, datos)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Filtro de fecha u hora no válido'}), 400
+    except ColaExportacionLlena:
+        return jsonify({'success': False, 'message': 'Hay demasiadas exportaciones en curso. Intente en unos minutos'}), 503
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error al solicitar la exportación: {str(e)}'}), 500
+    return jsonify({'success': True, **estado_exportacion_json(trabajo_id, meta)}), 200 if meta['estado'] == 'listo' else 202
+
+@app.route('/admin/export/trabajos/<trabajo_id>')
+def estado_exportacion(trabajo_id):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    meta = leer_trabajo_exportacion(trabajo_id)
+    if meta is None:
+        return jsonify({'success': False, 'message': 'Exportación no encontrada o ya descartada'}), 404
+    return jsonify({'success': True, **estado_exportacion_json(trabajo_id, meta)})
+
+@app.route('/admin/export/trabajos/<trabajo_id>/descargar')
+def descargar_exportacion_ruta(trabajo_id):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    meta = leer_trabajo_exportacion(trabajo_id)
+    if meta is None or (meta['estado'] == 'listo' and
+                        not os.path.exists(_rutas_exportacion(trabajo_id, meta['formato'])[0])):
+        return jsonify({'success': False, 'message': 'Exportación no encontrada o ya descartada'}), 404
+    if meta['estado'] != 'listo':
+        return jsonify({'success': False, 'message': 'La exportación todavía no está lista',
+                        **estado_exportacion_json(trabajo_id, meta)}), 409
+    return descargar_exportacion(trabajo_id, meta)
+
+def exportar_en_segundo_plano(formato):
+    """export_csv y export_excel: esperan el trabajo un rato y, si no terminó, avisan"""
+    try:
+        trabajo_id, meta, futuro = solicitar_exportacion(formato, request.args)
+        if meta['estado'] != 'listo':
+            meta = esperar_exportacion(trabajo_id, futuro, app.config['EXPORTACION_ESPERA'])
+        if meta and meta['estado'] == 'listo':
+            return descargar_exportacion(trabajo_id, meta)
+        if meta and meta['estado'] == 'error':
+            raise RuntimeError(meta.get('mensaje'))
+        # Al volver a pulsar Exportar con los mismos filtros se retoma este mismo trabajo
+        flash('La exportación sigue generándose. Vuelva a pulsar Exportar en unos minutos para descargarla', 'info')
+    except ColaExportacionLlena:
+        flash('Hay demasiadas exportaciones en curso. Intente en unos minutos', 'error')
+    except Exception as e:
+        flash(f'Error al exportar datos: {str(e)}', 'error')
+    return redirect(url_for('admin_dashboard'))
+
 @app.route('/admin/export/csv')
+@lectura_replica
 def export_csv():
     if 'user' not in session or session.get('role') != 'admin':
         flash('Acceso denegado', 'error')
         return redirect(url_for('login'))
-    
-    try:
-        fecha_inicio_str = request.args.get('fecha_inicio')
-        fecha_fin_str = request.args.get('fecha_fin')
-        hora_inicio_str = request.args.get('hora_inicio')
-        hora_fin_str = request.args.get('hora_fin')
-        
-        fecha_inicio = None
-        fecha_fin = None
-        
-        if fecha_inicio_str:
-            fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d')
-        if fecha_fin_str:
-            fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d')
-        
-        registros = obtener_ultimos_registros(fecha_inicio, fecha_fin, hora_inicio_str, hora_fin_str)
-        
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        headers = [
-            'CODIGO', 'RAZON SOCIAL ANH', 'ZONA', 'PROVINCIA', 'MUNICIPIO',
-            'DO/DO+ (LTS)', 'DO ULS+ (LTS)', 'GE/GE+ (LTS)', 'GP+ (LTS)', 
-            'GPULTRA100 (LTS)', 'VOLUMEN TOTAL', 'ESTADO', 'FUNCIONARIO',
-            'FILAS DO/DO+', 'FILAS GE/GE+', 'FECHA Y HORA DE ACTUALIZACION', 'USUARIO_ACTUALIZACION'
-        ]
-        writer.writerow(headers)
-        
-        for registro in registros:
-            estado = registro.get_estado_volumen()
-            
-            row = [
-                registro.codigo,
-                registro.razon_social,
-                registro.zona,
-                registro.provincia,
-                registro.municipio,
-                registro.do_do_plus,
-                registro.do_uls_plus,
-                registro.ge_ge_plus,
-                registro.gp_plus,
-                registro.gp_ultra_100,
-                registro.calcular_volumen_total(),
-                estado['text'],
-                registro.funcionario,
-                registro.filas_do_do_plus,
-                registro.filas_ge_ge_plus,
-                registro.fecha_hora.strftime('%Y-%m-%d %H:%M:%S'),
-                registro.usuario_actualizacion or ''
-            ]
-            writer.writerow(row)
-        
-        output.seek(0)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'datos_combustibles_{timestamp}.csv'
-        
-        return send_file(
-            BytesIO(output.getvalue().encode('utf-8')),
-            as_attachment=True,
-            download_name=filename,
-            mimetype='text/csv'
-        )
-        
-    except Exception as e:
-        flash(f'Error al exportar datos: {str(e)}', 'error')
-        return redirect(url_for('admin_dashboard'))
+    return exportar_en_segundo_plano('csv')
 
 @app.route('/admin/export/excel')
+@lectura_replica
 def export_excel():
     if 'user' not in session or session.get('role') != 'admin':
         flash('Acceso denegado', 'error')
         return redirect(url_for('login'))
-    
+    return exportar_en_segundo_plano('excel')
+
+@app.route('/admin/export/delta')
+@lectura_replica
+def export_delta():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    formato = request.args.get('formato', 'csv')
+    if formato not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'message': 'Formato no válido. Use: csv, ndjson'}), 400
     try:
-        fecha_inicio_str = request.args.get('fecha_inicio')
-        fecha_fin_str = request.args.get('fecha_fin')
-        hora_inicio_str = request.args.get('hora_inicio')
-        hora_fin_str = request.args.get('hora_fin')
-        
-        fecha_inicio = None
-        fecha_fin = None
-        
-        if fecha_inicio_str:
-            fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d')
-        if fecha_fin_str:
-            fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d')
-        
-        registros = obtener_ultimos_registros(fecha_inicio, fecha_fin, hora_inicio_str, hora_fin_str)
-        
-        # Crear archivo Excel en memoria
-        output = BytesIO()
-        workbook = Workbook()
-        worksheet = workbook.active
-        worksheet.title = "Datos Combustibles"
-        
-        # Encabezados
-        headers = [
-            'CODIGO', 'RAZON SOCIAL ANH', 'ZONA', 'PROVINCIA', 'MUNICIPIO',
-            'DO/DO+ (LTS)', 'DO ULS+ (LTS)', 'GE/GE+ (LTS)', 'GP+ (LTS)', 
-            'GPULTRA100 (LTS)', 'VOLUMEN TOTAL', 'ESTADO', 'FUNCIONARIO',
-            'FILAS DO/DO+', 'FILAS GE/GE+', 'FECHA Y HORA DE ACTUALIZACION', 'USUARIO_ACTUALIZACION'
-        ]
-        
-        for col, header in enumerate(headers, 1):
-            worksheet.cell(row=1, column=col, value=header)
-        
-        # Datos
-        for row, registro in enumerate(registros, 2):
-            estado = registro.get_estado_volumen()
-            
-            worksheet.cell(row=row, column=1, value=registro.codigo)
-            worksheet.cell(row=row, column=2, value=registro.razon_social)
-            worksheet.cell(row=row, column=3, value=registro.zona)
-            worksheet.cell(row=row, column=4, value=registro.provincia)
-            worksheet.cell(row=row, column=5, value=registro.municipio)
-            worksheet.cell(row=row, column=6, value=registro.do_do_plus)
-            worksheet.cell(row=row, column=7, value=registro.do_uls_plus)
-            worksheet.cell(row=row, column=8, value=registro.ge_ge_plus)
-            worksheet.cell(row=row, column=9, value=registro.gp_plus)
-            worksheet.cell(row=row, column=10, value=registro.gp_ultra_100)
-            worksheet.cell(row=row, column=11, value=registro.calcular_volumen_total())
-            worksheet.cell(row=row, column=12, value=estado['text'])
-            worksheet.cell(row=row, column=13, value=registro.funcionario)
-            worksheet.cell(row=row, column=14, value=registro.filas_do_do_plus)
-            worksheet.cell(row=row, column=15, value=registro.filas_ge_ge_plus)
-            worksheet.cell(row=row, column=16, value=registro.fecha_hora.strftime('%Y-%m-%d %H:%M:%S'))
-            worksheet.cell(row=row, column=17, value=registro.usuario_actualizacion or '')
-        
-        workbook.save(output)
-        output.seek(0)
-        
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'datos_combustibles_{timestamp}.xlsx'
-        
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        cursor, marca = leer_cursor_delta(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Cursor no válido'}), 400
+    limite = max(1, min(request.args.get('limite', 50000, type=int), 500000))
+
+    try:
+        hasta, filas, marca = preparar_delta(cursor, marca, limite)
+        respuesta = app.response_class(
+            stream_with_context(serializar_delta(filas_delta(cursor, hasta), formato)),
+            mimetype='text/csv' if formato == 'csv' else 'application/x-ndjson'
         )
-        
+        respuesta.headers['X-Cursor-Siguiente'] = formatear_cursor_delta(hasta, marca)
+        respuesta.headers['X-Filas'] = str(filas)
+        respuesta.headers['X-Hay-Mas'] = '1' if filas == limite else '0'
+        return respuesta
     except Exception as e:
-        flash(f'Error al exportar datos Excel: {str(e)}', 'error')
-        return redirect(url_for('admin_dashboard'))
+        return jsonify({'success': False, 'message': f'Error al exportar cambios: {str(e)}'}), 500
 
 @app.route('/force-init')
 def force_init():
@@ -1084,12 +4313,101 @@ def force_init():
     except Exception as e:
         return f"❌ Error: {str(e)}"
 
+@app.route('/admin/compactar_historial', methods=['POST'])
+def compactar_historial_ruta():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        dias = data.get('dias')
+        limite_dias = data.get('limite_dias')
+        resultado = compactar_historial(
+            int(dias) if dias is not None else None,
+            int(limite_dias) if limite_dias is not None else None
+        )
+        return jsonify({
+            'success': True,
+            'message': f"{resultado['dias_compactados']} días compactados, "
+                       f"{resultado['registros_eliminados']} registros eliminados",
+            'resultado': resultado
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Error al compactar historial: {str(e)}'}), 500
+
+# ================= COMANDOS DE MANTENIMIENTO =================
+@app.cli.command('compactar-historial')
+@click.option('--dias', type=int, default=None, help='Días de retención (por defecto RETENCION_DIAS)')
+@click.option('--limite-dias', type=int, default=None, help='Máximo de días a procesar en esta ejecución')
+def compactar_historial_comando(dias, limite_dias):
+    """Compacta el historial viejo en resúmenes diarios por estación"""
+    resultado = compactar_historial(dias, limite_dias)
+    click.echo(f"✅ {resultado['dias_compactados']} días compactados, "
+               f"{resultado['registros_resumidos']} registros resumidos, "
+               f"{resultado['registros_eliminados']} eliminados")
+
+@app.cli.command('particionar-registros')
+@click.option('--meses-adelante', type=int, default=3, help='Particiones futuras a crear')
+def particionar_registros_comando(meses_adelante):
+    """Convierte registro_combustible en tabla particionada por mes (PostgreSQL)"""
+    resultado = particionar_registros_postgresql(meses_adelante)
+    if resultado['particionada']:
+        click.echo(f"✅ {resultado['particiones']} particiones creadas, "
+                   f"{resultado['registros_copiados']} registros copiados. "
+                   f"Respaldo: {resultado['respaldo']}")
+    else:
+        click.echo(f"⚠️  {resultado['mensaje']}")
+
+@app.cli.command('inicializar-alertas')
+def inicializar_alertas_comando():
+    """Evalúa las alertas de stock bajo sobre el estado actual de todas las estaciones"""
+    resultado = inicializar_alertas()
+    click.echo(f"✅ {resultado['estaciones']} estaciones evaluadas, {resultado['alertas']} alertas generadas")
+
+@app.cli.command('recalcular-consumo')
+def recalcular_consumo_comando():
+    """Recalcula las tasas de consumo por estación y producto desde todo el historial"""
+    resultado = recalcular_tasas_consumo()
+    click.echo(f"✅ {resultado['estaciones']} estaciones recalculadas a partir de {resultado['registros']} registros")
+
 # ================= INICIALIZACIÓN =================
+def asegurar_columnas():
+    """create_all tampoco agrega columnas nuevas: se añaden como nulables"""
+    inspector = sa.inspect(db.engine)
+    preparador = db.engine.dialect.identifier_preparer
+    for tabla in db.metadata.sorted_tables:
+        if not inspector.has_table(tabla.name):
+            continue
+        existentes = {columna['name'] for columna in inspector.get_columns(tabla.name)}
+        for columna in tabla.columns:
+            if columna.name in existentes:
+                continue
+            tipo = columna.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conexion:
+                conexion.execute(sa.text(
+                    f'ALTER TABLE {preparador.quote(tabla.name)} ADD COLUMN {preparador.quote(columna.name)} {tipo}'
+                ))
+            print(f"✅ Columna agregada: {tabla.name}.{columna.name}")
+
+def asegurar_indices():
+    """create_all no agrega índices nuevos a tablas que ya existen"""
+    for tabla in db.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            indice.create(bind=db.engine, checkfirst=True)
+
 def create_tables():
     """Función separada para crear tablas que se puede llamar desde wsgi"""
     with app.app_context():
         try:
             db.create_all()
+            asegurar_columnas()
+            asegurar_indices()
+            asegurar_particiones_mensuales()
+            for clave in sorted(set(CLAVES_VERSION.values())):
+                if db.session.get(VersionDatos, clave) is None:
+                    db.session.add(VersionDatos(clave=clave, version=0))
+            db.session.commit()
             print("✅ Tablas creadas/verificadas")
             
             # Crear usuario admin si no existe
@@ -0,0 +1,136 @@
+"""Cliente de exportación incremental de registros de combustible.
+
+Inicia sesión como administrador, pide a /admin/export/delta los registros
+posteriores al cursor guardado localmente y los agrega al archivo de salida.
+El cursor se guarda después de escribir cada tramo: si el proceso se corta, el
+siguiente pedido repite a lo sumo el último tramo, nunca lo pierde.
+
+Uso:
+    python exportar_delta.py --url https://combustibles.example --usuario admin --salida registros.csv
+    python exportar_delta.py --formato ndjson --salida registros.ndjson --cursor-archivo .cursor
+    python exportar_delta.py --intervalo 300        # sigue sondeando cada 5 minutos
+
+La contraseña se toma de --password o de la variable EXPORT_PASSWORD.
+"""
+import argparse
+import http.cookiejar
+import os
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+class SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class ClienteDelta:
+    def __init__(self, base_url, usuario, password, timeout=300):
+        self.base_url = base_url.rstrip('/')
+        self.usuario = usuario
+        self.password = password
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            SinRedirecciones()
+        )
+
+    def login(self):
+        datos = urllib.parse.urlencode({'username': self.usuario, 'password': self.password}).encode()
+        peticion = urllib.request.Request(self.base_url + '/login', data=datos, method='POST')
+        try:
+            self.opener.open(peticion, timeout=self.timeout).read()
+        except urllib.error.HTTPError as e:
+            # El login correcto responde con una redirección al panel
+            if e.code != 302:
+                raise
+            ubicacion = e.headers.get('Location', '')
+            if 'admin' not in ubicacion:
+                raise SystemExit('❌ Credenciales incorrectas o el usuario no es administrador')
+
+    def pedir_tramo(self, cursor, formato, limite):
+        consulta = urllib.parse.urlencode({'cursor': cursor, 'formato': formato, 'limite': limite})
+        return self.opener.open(self.base_url + f'/admin/export/delta?{consulta}', timeout=self.timeout)
+
+
+def leer_cursor(ruta):
+    try:
+        with open(ruta) as f:
+            return f.read().strip() or '0'
+    except FileNotFoundError:
+        return '0'
+
+
+def guardar_cursor(ruta, cursor):
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w') as f:
+        f.write(cursor)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+def sincronizar(cliente, args):
+    """Descarga tramos hasta ponerse al día. Devuelve las filas recibidas"""
+    total = 0
+    while True:
+        cursor = leer_cursor(args.cursor_archivo)
+        with cliente.pedir_tramo(cursor, args.formato, args.limite) as respuesta:
+            siguiente = respuesta.headers['X-Cursor-Siguiente']
+            filas = int(respuesta.headers['X-Filas'])
+            hay_mas = respuesta.headers['X-Hay-Mas'] == '1'
+            nuevo = not os.path.exists(args.salida) or os.path.getsize(args.salida) == 0
+            with open(args.salida, 'ab') as salida:
+                primera = True
+                for linea in respuesta:
+                    # En CSV cada tramo trae la cabecera: sólo se escribe en un archivo nuevo
+                    if primera and args.formato == 'csv' and not nuevo:
+                        primera = False
+                        continue
+                    primera = False
+                    salida.write(linea)
+                salida.flush()
+                os.fsync(salida.fileno())
+        guardar_cursor(args.cursor_archivo, siguiente)
+        total += filas
+        if not hay_mas:
+            return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exportación incremental de registros de combustible')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--usuario', default='admin')
+    parser.add_argument('--password', default=os.environ.get('EXPORT_PASSWORD'))
+    parser.add_argument('--formato', choices=('csv', 'ndjson'), default='csv')
+    parser.add_argument('--salida', default='registros_delta.csv')
+    parser.add_argument('--cursor-archivo', default='.cursor_delta')
+    parser.add_argument('--limite', type=int, default=50000, help='Filas por tramo')
+    parser.add_argument('--intervalo', type=float, default=0,
+                        help='Segundos entre sondeos; 0 sincroniza una vez y termina')
+    args = parser.parse_args()
+    if not args.password:
+        parser.error('Indique --password o la variable EXPORT_PASSWORD')
+
+    cliente = ClienteDelta(args.url, args.usuario, args.password)
+    cliente.login()
+    while True:
+        try:
+            filas = sincronizar(cliente, args)
+        except urllib.error.HTTPError as e:
+            if e.code != 403:
+                raise
+            # Sesión vencida: se vuelve a iniciar y se reintenta desde el cursor guardado
+            cliente.login()
+            filas = sincronizar(cliente, args)
+        print(f"✅ {filas} registros nuevos - cursor {leer_cursor(args.cursor_archivo)}", file=sys.stderr)
+        if not args.intervalo:
+            break
+        time.sleep(args.intervalo)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""Prueba de carga que reproduce tráfico realista de funcionarios y administradores.
+
+Levanta un gunicorn local sobre una base de datos sembrada con el generador de
+benchmark.py, inicia sesión de usuarios sintéticos a través de /login y
+reproduce una mezcla configurable de dashboards, actualizaciones, cargas y
+exportaciones. Informa rendimiento, latencias p50/p95/p99 y tasa de errores por
+ruta.
+
+Uso:
+    python loadtest.py --oficiales 50 --admins 2 --duracion 60
+    python loadtest.py --mezcla-oficial dashboard=1,actualizar=4 --salida carga.json
+    python loadtest.py --url http://localhost:5000 --sin-sembrar   # servidor ya levantado
+
+ATENCIÓN: salvo con --sin-sembrar, las tablas de la base indicada con
+--database-url se BORRAN. Por defecto se usa un SQLite temporal.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime
+
+import benchmark
+
+PASSWORD_OFICIALES = 'carga1234'
+PASSWORD_ADMIN = 'admin123'
+
+
+# ================= PREPARACIÓN =================
+def sembrar(database_url, n_estaciones, n_actualizaciones, n_funcionarios):
+    """Siembra la base con el generador de benchmarks y contraseñas reales"""
+    os.environ['DATABASE_URL'] = database_url
+    import app as app_module
+    from werkzeug.security import generate_password_hash
+
+    with app_module.app.app_context():
+        db = app_module.db
+        db.drop_all()
+        db.create_all()
+        estaciones, funcionarios = benchmark.poblar_base_datos(
+            app_module, n_estaciones, n_actualizaciones, n_funcionarios)
+        # Un único hash compartido: sembrar miles de usuarios no debe costar minutos.
+        # Con la política configurada, para que el login no los recalcule durante la prueba
+        hash_oficial = generate_password_hash(PASSWORD_OFICIALES, method=app_module.app.config['CONTRASENA_METODO'])
+        app_module.Usuario.query.update({'password_hash': hash_oficial})
+        admin = app_module.Usuario(username='admin', funcionario='Administrador', rol='admin')
+        admin.set_password(PASSWORD_ADMIN)
+        db.session.add(admin)
+        db.session.commit()
+        db.session.remove()
+    return estaciones, funcionarios
+
+
+def iniciar_gunicorn(database_url, puerto, workers, threads):
+    env = dict(os.environ, DATABASE_URL=database_url, PORT=str(puerto))
+    comando = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py',
+               '--access-logfile', '/dev/null', '--log-level', 'warning']
+    if workers:
+        comando += ['--workers', str(workers)]
+    if threads:
+        comando += ['--threads', str(threads)]
+    comando.append('wsgi:app')
+    proceso = subprocess.Popen(comando, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{puerto}'
+    limite = time.time() + 30
+    while time.time() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError('gunicorn terminó antes de estar listo')
+        try:
+            urllib.request.urlopen(url + '/login', timeout=1).read()
+            return proceso, url
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError('gunicorn no respondió en 30 segundos')
+
+
+# ================= CLIENTE HTTP =================
+class SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Sesion:
+    """Cliente con cookies propio de cada usuario virtual"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            SinRedirecciones()
+        )
+
+    def pedir(self, metodo, ruta, datos=None, cabeceras=None):
+        peticion = urllib.request.Request(self.base_url + ruta, data=datos, method=metodo,
+                                          headers=cabeceras or {})
+        try:
+            with self.opener.open(peticion, timeout=self.timeout) as respuesta:
+                respuesta.read()
+                return respuesta.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+    def login(self, username, password):
+        datos = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+        return self.pedir('POST', '/login', datos,
+                          {'Content-Type': 'application/x-www-form-urlencoded'})
+
+
+def multipart(nombre_campo, nombre_archivo, contenido):
+    limite = uuid.uuid4().hex
+    cuerpo = (
+        f'--{limite}\r\n'
+        f'Content-Disposition: form-data; name="{nombre_campo}"; filename="{nombre_archivo}"\r\n'
+        f'Content-Type: text/csv\r\n\r\n'
+    ).encode() + contenido + f'\r\n--{limite}--\r\n'.encode()
+    return cuerpo, {'Content-Type': f'multipart/form-data; boundary={limite}'}
+
+
+# ================= ACCIONES =================
+def accion_dashboard_usuario(sesion, ctx, rng):
+    return sesion.pedir('GET', '/user/dashboard') == 200
+
+
+def accion_actualizar(sesion, ctx, rng):
+    estacion = rng.choice(ctx['estaciones'])
+    datos = {'codigo': estacion['codigo']}
+    datos.update(benchmark.generar_volumenes(rng))
+    estado = sesion.pedir('POST', '/user/actualizar_estacion', json.dumps(datos).encode(),
+                          {'Content-Type': 'application/json'})
+    return estado == 200
+
+
+def accion_dashboard_admin(sesion, ctx, rng):
+    return sesion.pedir('GET', '/admin/dashboard') == 200
+
+
+def accion_upload(sesion, ctx, rng):
+    # Un archivo nuevo en cada carga: repetir el mismo se rechaza por su hash
+    cuerpo, cabeceras = multipart('file', 'carga.csv', benchmark.generar_csv_carga(ctx['estaciones'], rng))
+    return sesion.pedir('POST', '/admin/upload', cuerpo, cabeceras) == 200
+
+
+def accion_export_csv(sesion, ctx, rng):
+    return sesion.pedir('GET', '/admin/export/csv') == 200
+
+
+def accion_export_excel(sesion, ctx, rng):
+    return sesion.pedir('GET', '/admin/export/excel') == 200
+
+
+ACCIONES_OFICIAL = {
+    'dashboard': ('/user/dashboard', accion_dashboard_usuario),
+    'actualizar': ('/user/actualizar_estacion', accion_actualizar),
+}
+
+ACCIONES_ADMIN = {
+    'dashboard': ('/admin/dashboard', accion_dashboard_admin),
+    'upload': ('/admin/upload', accion_upload),
+    'export_csv': ('/admin/export/csv', accion_export_csv),
+    'export_excel': ('/admin/export/excel', accion_export_excel),
+}
+
+
+def parsear_mezcla(texto, acciones):
+    mezcla = []
+    for parte in texto.split(','):
+        nombre, peso = parte.split('=')
+        nombre = nombre.strip()
+        if nombre not in acciones:
+            raise SystemExit(f'Acción desconocida "{nombre}". Opciones: {", ".join(acciones)}')
+        mezcla.append((acciones[nombre], float(peso)))
+    return mezcla
+
+
+# ================= EJECUCIÓN =================
+class Registro:
+    """Acumula latencias y errores por ruta de forma segura entre hilos"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias = {}
+        self.errores = {}
+
+    def anotar(self, ruta, segundos, ok):
+        with self.lock:
+            self.latencias.setdefault(ruta, []).append(segundos)
+            self.errores.setdefault(ruta, 0)
+            if not ok:
+                self.errores[ruta] += 1
+
+
+def percentil(valores_ordenados, p):
+    if not valores_ordenados:
+        return 0
+    indice = min(len(valores_ordenados) - 1, int(round(p / 100 * (len(valores_ordenados) - 1))))
+    return valores_ordenados[indice]
+
+
+def usuario_virtual(base_url, credenciales, mezcla, ctx, registro, fin, pausa, timeout, semilla):
+    rng = random.Random(semilla)
+    sesion = Sesion(base_url, timeout)
+    inicio = time.perf_counter()
+    estado = sesion.login(*credenciales)
+    registro.anotar('/login', time.perf_counter() - inicio, estado == 302)
+    if estado != 302:
+        return
+    acciones = [accion for accion, _ in mezcla]
+    pesos = [peso for _, peso in mezcla]
+    while time.time() < fin:
+        ruta, funcion = rng.choices(acciones, weights=pesos)[0]
+        inicio = time.perf_counter()
+        try:
+            ok = funcion(sesion, ctx, rng)
+        except Exception:
+            ok = False
+        registro.anotar(ruta, time.perf_counter() - inicio, ok)
+        if pausa:
+            time.sleep(rng.uniform(0, 2 * pausa))
+
+
+def resumir(registro, duracion):
+    resumen = {}
+    for ruta, latencias in sorted(registro.latencias.items()):
+        ordenadas = sorted(latencias)
+        resumen[ruta] = {
+            'peticiones': len(ordenadas),
+            'errores': registro.errores[ruta],
+            'tasa_error': round(registro.errores[ruta] / len(ordenadas), 4),
+            'rps': round(len(ordenadas) / duracion, 2),
+            'p50_ms': round(percentil(ordenadas, 50) * 1000, 2),
+            'p95_ms': round(percentil(ordenadas, 95) * 1000, 2),
+            'p99_ms': round(percentil(ordenadas, 99) * 1000, 2),
+        }
+    return resumen
+
+
+def imprimir_tabla(resumen):
+    print(f'{"RUTA":<28}{"PETIC.":>8}{"RPS":>9}{"P50 ms":>10}{"P95 ms":>10}{"P99 ms":>10}{"ERROR %":>9}',
+          file=sys.stderr)
+    for ruta, r in resumen.items():
+        print(f'{ruta:<28}{r["peticiones"]:>8}{r["rps"]:>9}{r["p50_ms"]:>10}{r["p95_ms"]:>10}'
+              f'{r["p99_ms"]:>10}{r["tasa_error"] * 100:>8.1f}%', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga del sistema de combustibles')
+    parser.add_argument('--oficiales', type=int, default=20, help='Funcionarios concurrentes')
+    parser.add_argument('--admins', type=int, default=2, help='Administradores concurrentes')
+    parser.add_argument('--duracion', type=float, default=30, help='Segundos de carga')
+    parser.add_argument('--pausa', type=float, default=0.0, help='Pausa media entre acciones (s)')
+    parser.add_argument('--mezcla-oficial', default='dashboard=1,actualizar=3')
+    parser.add_argument('--mezcla-admin', default='dashboard=6,export_csv=1,export_excel=1,upload=1')
+    parser.add_argument('--estaciones', type=int, default=500)
+    parser.add_argument('--actualizaciones', type=int, default=10)
+    parser.add_argument('--database-url', help='Base a sembrar (por defecto SQLite temporal)')
+    parser.add_argument('--url', help='Usar un servidor ya levantado en lugar de iniciar gunicorn')
+    parser.add_argument('--sin-sembrar', action='store_true', help='No tocar la base de datos')
+    parser.add_argument('--puerto', type=int, default=5055)
+    parser.add_argument('--workers', type=int, help='Sobrescribe workers de gunicorn_config.py')
+    parser.add_argument('--threads', type=int, help='Sobrescribe threads de gunicorn_config.py')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--salida', help='Archivo JSON de resultados')
+    args = parser.parse_args()
+
+    mezcla_oficial = parsear_mezcla(args.mezcla_oficial, ACCIONES_OFICIAL)
+    mezcla_admin = parsear_mezcla(args.mezcla_admin, ACCIONES_ADMIN)
+    n_funcionarios = max(1, args.oficiales)
+
+    directorio_tmp = tempfile.mkdtemp(prefix='carga_combustibles_')
+    database_url = args.database_url or f'sqlite:///{os.path.join(directorio_tmp, "carga.db")}'
+    proceso = None
+    try:
+        if args.sin_sembrar:
+            rng = random.Random(42)
+            estaciones, funcionarios = benchmark.generar_estaciones(args.estaciones, n_funcionarios, rng)
+        else:
+            print(f'🌱 Sembrando {args.estaciones} estaciones x {args.actualizaciones} actualizaciones',
+                  file=sys.stderr)
+            estaciones, funcionarios = sembrar(database_url, args.estaciones, args.actualizaciones,
+                                               n_funcionarios)
+
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            proceso, base_url = iniciar_gunicorn(database_url, args.puerto, args.workers, args.threads)
+            print(f'🚀 gunicorn listo en {base_url}', file=sys.stderr)
+
+        estaciones_por_funcionario = {}
+        for estacion in estaciones:
+            estaciones_por_funcionario.setdefault(estacion['funcionario'], []).append(estacion)
+
+        registro = Registro()
+        fin = time.time() + args.duracion
+        hilos = []
+        for i in range(args.oficiales):
+            funcionario = funcionarios[i % len(funcionarios)]
+            ctx = {'estaciones': estaciones_por_funcionario.get(funcionario) or estaciones}
+            credenciales = (funcionario.split()[0].lower(), PASSWORD_OFICIALES)
+            hilos.append(threading.Thread(target=usuario_virtual, args=(
+                base_url, credenciales, mezcla_oficial, ctx, registro, fin, args.pausa, args.timeout, i)))
+        for i in range(args.admins):
+            ctx = {'estaciones': estaciones}
+            hilos.append(threading.Thread(target=usuario_virtual, args=(
+                base_url, ('admin', PASSWORD_ADMIN), mezcla_admin, ctx, registro, fin, args.pausa,
+                args.timeout, 10000 + i)))
+
+        print(f'🔥 {args.oficiales} funcionarios + {args.admins} admins durante {args.duracion}s',
+              file=sys.stderr)
+        inicio = time.time()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion_real = time.time() - inicio
+
+        resumen = resumir(registro, duracion_real)
+        total = sum(r['peticiones'] for r in resumen.values())
+        errores = sum(r['errores'] for r in resumen.values())
+        informe = {
+            'commit': benchmark.commit_actual(),
+            'fecha': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'configuracion': {
+                'oficiales': args.oficiales,
+                'admins': args.admins,
+                'duracion_s': args.duracion,
+                'pausa_s': args.pausa,
+                'mezcla_oficial': args.mezcla_oficial,
+                'mezcla_admin': args.mezcla_admin,
+                'estaciones': args.estaciones,
+                'actualizaciones': args.actualizaciones,
+                'workers': args.workers,
+                'threads': args.threads,
+            },
+            'total': {
+                'peticiones': total,
+                'errores': errores,
+                'rps': round(total / duracion_real, 2),
+            },
+            'rutas': resumen,
+        }
+        imprimir_tabla(resumen)
+        texto = json.dumps(informe, indent=2, ensure_ascii=False)
+        if args.salida:
+            with open(args.salida, 'w') as f:
+                f.write(texto)
+            print(f'✅ Resultados guardados en {args.salida}', file=sys.stderr)
+        else:
+            print(texto)
+    finally:
+        if proceso:
+            proceso.send_signal(signal.SIGTERM)
+            proceso.wait(timeout=30)
+        shutil.rmtree(directorio_tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
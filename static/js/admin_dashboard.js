@@ -0,0 +1,1005 @@
+console.log('Datos de evolución temporal:', evolucionTemporal);
+
+// Inicializar gráficos y funcionalidades
+document.addEventListener('DOMContentLoaded', function() {
+    initializeCharts();
+    initializeFileUpload();
+    initializeFilters();
+    initializeUserManagement();
+    initializeDateFilter();
+    initializeTabDatosDateFilter();
+    initializeMobileMenu();
+});
+
+// Mobile Menu Functionality
+function initializeMobileMenu() {
+    const mobileMenuBtn = document.querySelector('.mobile-menu-btn');
+    const sidebar = document.querySelector('.sidebar');
+    const overlay = document.querySelector('.mobile-overlay');
+
+    if (mobileMenuBtn && sidebar) {
+        mobileMenuBtn.addEventListener('click', function() {
+            sidebar.classList.toggle('mobile-open');
+            overlay.classList.toggle('active');
+        });
+
+        overlay.addEventListener('click', function() {
+            sidebar.classList.remove('mobile-open');
+            overlay.classList.remove('active');
+        });
+
+        // Close menu when clicking on a link
+        document.querySelectorAll('.sidebar .nav-link').forEach(link => {
+            link.addEventListener('click', function() {
+                sidebar.classList.remove('mobile-open');
+                overlay.classList.remove('active');
+            });
+        });
+    }
+}
+
+function initializeCharts() {
+    // Gráfico de Top 15 Estaciones (Barras Horizontales)
+    const topStationsCtx = document.getElementById('topStationsChart').getContext('2d');
+    let topStationsChart = new Chart(topStationsCtx, {
+        type: 'bar',
+        data: {
+            labels: topEstaciones.total.slice(0, 15).map(item => item.nombre),
+            datasets: [{
+                label: 'Volumen Total (Litros)',
+                data: topEstaciones.total.slice(0, 15).map(item => item.volumen),
+                backgroundColor: '#1a2a6c',
+                borderColor: '#0d1a4d',
+                borderWidth: 1
+            }]
+        },
+        options: {
+            indexAxis: 'y',
+            responsive: true,
+            maintainAspectRatio: false,
+            scales: {
+                x: {
+                    beginAtZero: true,
+                    title: {
+                        display: true,
+                        text: 'Litros'
+                    }
+                },
+                y: {
+                    ticks: {
+                        autoSkip: false,
+                        maxRotation: 0,
+                        minRotation: 0
+                    }
+                }
+            },
+            plugins: {
+                legend: {
+                    display: false
+                },
+                tooltip: {
+                    callbacks: {
+                        label: function(context) {
+                            return `Volumen: ${context.parsed.x.toLocaleString()} litros`;
+                        }
+                    }
+                }
+            }
+        }
+    });
+
+    // Verificar que hay datos para el gráfico temporal
+    if (!evolucionTemporal || evolucionTemporal.length === 0) {
+        console.error('No hay datos de evolución temporal');
+        return;
+    }
+
+    // Gráfico de Evolución por Producto (Líneas) - CON FECHA/HORA
+    const evolucionProductoCtx = document.getElementById('evolucionProductoChart').getContext('2d');
+    let evolucionProductoChart = new Chart(evolucionProductoCtx, {
+        type: 'line',
+        data: {
+            labels: evolucionTemporal.map(item => item.fecha_hora),
+            datasets: [
+                {
+                    label: 'DOS (Diesel)',
+                    data: evolucionTemporal.map(item => item.dos || 0),
+                    borderColor: '#1a2a6c',
+                    backgroundColor: 'rgba(26, 42, 108, 0.1)',
+                    borderWidth: 3,
+                    tension: 0.4,
+                    fill: true,
+                    pointBackgroundColor: '#1a2a6c',
+                    pointBorderColor: '#ffffff',
+                    pointBorderWidth: 2,
+                    pointRadius: 5
+                },
+                {
+                    label: 'GES (Gasolinas)',
+                    data: evolucionTemporal.map(item => item.ges || 0),
+                    borderColor: '#b21f1f',
+                    backgroundColor: 'rgba(178, 31, 31, 0.1)',
+                    borderWidth: 3,
+                    tension: 0.4,
+                    fill: true,
+                    pointBackgroundColor: '#b21f1f',
+                    pointBorderColor: '#ffffff',
+                    pointBorderWidth: 2,
+                    pointRadius: 5
+                }
+            ]
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            scales: {
+                y: {
+                    beginAtZero: true,
+                    title: {
+                        display: true,
+                        text: 'VOLUMEN (Litros)'
+                    },
+                    ticks: {
+                        callback: function(value) {
+                            return value.toLocaleString() + ' L';
+                        }
+                    }
+                },
+                x: {
+                    title: {
+                        display: true,
+                        text: 'FECHA/HORA'
+                    },
+                    ticks: {
+                        maxRotation: 45,
+                        minRotation: 45
+                    }
+                }
+            },
+            plugins: {
+                tooltip: {
+                    callbacks: {
+                        label: function(context) {
+                            return `${context.dataset.label}: ${context.parsed.y.toLocaleString()} litros`;
+                        },
+                        afterLabel: function(context) {
+                            const fecha = context.label;
+                            return `Fecha: ${fecha}`;
+                        }
+                    }
+                },
+                legend: {
+                    position: 'top',
+                    labels: {
+                        padding: 20,
+                        usePointStyle: true
+                    }
+                }
+            },
+            interaction: {
+                intersect: false,
+                mode: 'index'
+            }
+        }
+    });
+
+    // Event listeners para cambiar productos dinámicamente
+    document.querySelectorAll('[data-producto]').forEach(button => {
+        button.addEventListener('click', function() {
+            const producto = this.getAttribute('data-producto');
+
+            // Remover clase active de todos los botones del mismo grupo
+            this.parentElement.querySelectorAll('.btn').forEach(btn => {
+                btn.classList.remove('active');
+            });
+            this.classList.add('active');
+
+            // Actualizar gráfico según el producto seleccionado
+            if (this.closest('.card-header').querySelector('span').textContent.includes('Top 15')) {
+                // Gráfico de Top 15
+                let data, label;
+
+                switch(producto) {
+                    case 'total':
+                        data = topEstaciones.total.slice(0, 15);
+                        label = 'Volumen Total';
+                        break;
+                    case 'dos':
+                        data = topEstacionesGrupo.dos.slice(0, 15);
+                        label = 'DOS (Diesel)';
+                        break;
+                    case 'ges':
+                        data = topEstacionesGrupo.ges.slice(0, 15);
+                        label = 'GES (Gasolinas)';
+                        break;
+                }
+
+                topStationsChart.data.labels = data.map(item => item.nombre);
+                topStationsChart.data.datasets[0].data = data.map(item => item.volumen);
+                topStationsChart.data.datasets[0].label = label + ' (Litros)';
+                topStationsChart.update();
+
+            } else {
+                // Gráfico de Evolución por Producto - TOGGLE LÍNEAS
+                const datasetIndex = producto === 'dos' ? 0 : 1;
+                const isHidden = evolucionProductoChart.isDatasetVisible(datasetIndex);
+
+                if (isHidden) {
+                    evolucionProductoChart.show(datasetIndex);
+                    this.classList.add('active');
+                } else {
+                    evolucionProductoChart.hide(datasetIndex);
+                    this.classList.remove('active');
+                }
+            }
+        });
+    });
+}
+
+function initializeFileUpload() {
+    document.getElementById('selectFileBtn').addEventListener('click', function() {
+        document.getElementById('fileInput').click();
+    });
+
+    document.getElementById('fileInput').addEventListener('change', function(e) {
+        const file = e.target.files[0];
+        if (file) {
+            document.getElementById('fileDetails').innerHTML = `
+                <p><strong>Nombre:</strong> ${file.name}</p>
+                <p><strong>Tamaño:</strong> ${(file.size / 1024).toFixed(2)} KB</p>
+            `;
+            document.getElementById('fileInfo').style.display = 'block';
+        }
+    });
+
+    document.getElementById('processFileBtn').addEventListener('click', function() {
+        const fileInput = document.getElementById('fileInput');
+        const file = fileInput.files[0];
+
+        if (!file) {
+            alert('Por favor selecciona un archivo primero');
+            return;
+        }
+
+        let envio;
+        if (file.size > UMBRAL_CARGA_FRAGMENTOS && window.crypto && crypto.subtle) {
+            // Archivos grandes: por fragmentos reanudables
+            const boton = this;
+            const textoOriginal = boton.innerHTML;
+            boton.disabled = true;
+            envio = subirPorFragmentos(file, function(texto) {
+                boton.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>' + texto;
+            }).finally(function() {
+                boton.disabled = false;
+                boton.innerHTML = textoOriginal;
+            });
+        } else {
+            const formData = new FormData();
+            formData.append('file', file);
+            envio = fetch('/admin/upload', {
+                method: 'POST',
+                body: formData
+            }).then(response => response.json());
+        }
+
+        envio
+        .then(data => {
+            if (data.success) {
+                alert(data.message);
+                location.reload();
+            } else {
+                alert('Error: ' + data.message);
+            }
+        })
+        .catch(error => {
+            alert('Error al procesar el archivo: ' + error);
+        });
+    });
+}
+
+// Carga por fragmentos: cada fragmento lleva su offset y su sha256, y ante un
+// corte se reanuda desde el último offset que confirmó el servidor
+const UMBRAL_CARGA_FRAGMENTOS = 4 * 1024 * 1024;
+const REINTENTOS_FRAGMENTO = 5;
+
+function esperar(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+async function sha256Hex(datos) {
+    const hash = await crypto.subtle.digest('SHA-256', datos);
+    return Array.from(new Uint8Array(hash)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function subirPorFragmentos(file, mostrarProgreso) {
+    const inicio = await fetch('/admin/upload/parcial', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({nombre_archivo: file.name, tamano: file.size})
+    }).then(response => response.json());
+    if (!inicio.success) {
+        return inicio;
+    }
+
+    const url = '/admin/upload/parcial/' + inicio.id;
+    let offset = 0;
+    let fallos = 0;
+    while (offset < file.size) {
+        mostrarProgreso('Subiendo ' + Math.floor(offset * 100 / file.size) + '%');
+        const fragmento = await file.slice(offset, offset + inicio.fragmento_max).arrayBuffer();
+        try {
+            const respuesta = await fetch(url + '?offset=' + offset, {
+                method: 'PUT',
+                headers: {'X-Checksum-Sha256': await sha256Hex(fragmento)},
+                body: fragmento
+            });
+            const datos = await respuesta.json();
+            if (typeof datos.offset !== 'number') {
+                return datos;
+            }
+            fallos = datos.success ? 0 : fallos + 1;
+            offset = datos.offset;
+        } catch (error) {
+            fallos += 1;
+            await esperar(1000 * fallos);
+            const estado = await fetch(url).then(response => response.json()).catch(() => null);
+            if (estado && estado.success) {
+                offset = estado.offset;
+            }
+        }
+        if (fallos > REINTENTOS_FRAGMENTO) {
+            throw new Error('no se pudo enviar el fragmento en ' + offset + ' bytes');
+        }
+    }
+
+    mostrarProgreso('Procesando...');
+    const final = await fetch(url + '/finalizar', {method: 'POST'}).then(response => response.json());
+    if (!final.success || final.estado !== 'procesando') {
+        return final;
+    }
+    while (true) {
+        await esperar(2000);
+        const estado = await fetch(url).then(response => response.json());
+        if (estado.estado !== 'procesando') {
+            return estado.resultado || estado;
+        }
+    }
+}
+
+function initializeFilters() {
+    // Filtro de búsqueda
+    document.getElementById('searchInput').addEventListener('input', function() {
+        const searchTerm = this.value.toLowerCase();
+        const rows = document.querySelectorAll('#tab-datos tbody tr');
+
+        rows.forEach(row => {
+            const text = row.textContent.toLowerCase();
+            row.style.display = text.includes(searchTerm) ? '' : 'none';
+        });
+    });
+
+    // Filtro por zona
+    document.getElementById('zonaFilter').addEventListener('change', function() {
+        applyAllFilters();
+    });
+
+    // Filtro por estado
+    document.getElementById('estadoFilter').addEventListener('change', function() {
+        applyAllFilters();
+    });
+
+    // Filtro por producto
+    document.getElementById('productoFilter').addEventListener('change', function() {
+        applyAllFilters();
+    });
+}
+
+function applyAllFilters() {
+    const zona = document.getElementById('zonaFilter').value;
+    const estado = document.getElementById('estadoFilter').value;
+    const producto = document.getElementById('productoFilter').value;
+    const rows = document.querySelectorAll('#tab-datos tbody tr');
+
+    rows.forEach(row => {
+        const zonaCell = row.cells[2].textContent;
+        const estadoCell = row.cells[11].textContent.trim();
+        let showRow = true;
+
+        // Filtro por zona
+        if (zona && zonaCell !== zona) {
+            showRow = false;
+        }
+
+        // Filtro por estado
+        if (estado && estadoCell !== estado) {
+            showRow = false;
+        }
+
+        // Filtro por producto
+        if (producto && showRow) {
+            let productoValue = 0;
+            switch(producto) {
+                case 'DO/DO+': productoValue = parseInt(row.cells[5].textContent.replace(/,/g, '')) || 0; break;
+                case 'DO ULS+': productoValue = parseInt(row.cells[6].textContent.replace(/,/g, '')) || 0; break;
+                case 'GE/GE+': productoValue = parseInt(row.cells[7].textContent.replace(/,/g, '')) || 0; break;
+                case 'GP+': productoValue = parseInt(row.cells[8].textContent.replace(/,/g, '')) || 0; break;
+                case 'GP ULTRA 100': productoValue = parseInt(row.cells[9].textContent.replace(/,/g, '')) || 0; break;
+            }
+            if (productoValue <= 0) {
+                showRow = false;
+            }
+        }
+
+        row.style.display = showRow ? '' : 'none';
+    });
+}
+
+// Gestión MEJORADA de usuarios - Contraseñas, Estaciones y Eliminación
+function initializeUserManagement() {
+    // Gestión de usuarios - Editar
+    document.querySelectorAll('.btn-editar-usuario').forEach(btn => {
+        btn.addEventListener('click', function() {
+            const id = this.getAttribute('data-id');
+            const username = this.getAttribute('data-username');
+            const funcionario = this.getAttribute('data-funcionario');
+            const rol = this.getAttribute('data-rol');
+
+            document.getElementById('editarUsuarioId').value = id;
+            document.getElementById('editarUsuarioUsername').value = username;
+            document.getElementById('editarUsuarioFuncionario').value = funcionario;
+            document.getElementById('editarUsuarioRol').value = rol;
+
+            const modal = new bootstrap.Modal(document.getElementById('modalEditarUsuario'));
+            modal.show();
+        });
+    });
+
+    // Editar contraseña
+    document.querySelectorAll('.btn-editar-password').forEach(btn => {
+        btn.addEventListener('click', function() {
+            const id = this.getAttribute('data-id');
+            const username = this.getAttribute('data-username');
+
+            document.getElementById('editarPasswordId').value = id;
+            document.getElementById('passwordUsuarioNombre').textContent = username;
+            document.getElementById('nuevaPassword').value = '';
+            document.getElementById('confirmarPassword').value = '';
+
+            const modal = new bootstrap.Modal(document.getElementById('modalEditarPassword'));
+            modal.show();
+        });
+    });
+
+    // Gestionar estaciones de usuario
+    document.querySelectorAll('.btn-gestionar-estaciones').forEach(btn => {
+        btn.addEventListener('click', function() {
+            const id = this.getAttribute('data-id');
+            const username = this.getAttribute('data-username');
+            const funcionario = this.getAttribute('data-funcionario');
+
+            document.getElementById('gestionUsuarioId').value = id;
+            document.getElementById('gestionUsuarioNombre').textContent = `${funcionario} (${username})`;
+
+            // Cargar estaciones asignadas
+            cargarEstacionesAsignadas(id);
+            // Cargar todas las estaciones para gestión
+            cargarTodasEstacionesParaGestion(id);
+
+            const modal = new bootstrap.Modal(document.getElementById('modalGestionarEstaciones'));
+            modal.show();
+        });
+    });
+
+    // Guardar cambios de usuario
+    document.getElementById('btnGuardarUsuario').addEventListener('click', function() {
+        const id = document.getElementById('editarUsuarioId').value;
+        const username = document.getElementById('editarUsuarioUsername').value;
+        const funcionario = document.getElementById('editarUsuarioFuncionario').value;
+        const rol = document.getElementById('editarUsuarioRol').value;
+
+        if (!username || !funcionario) {
+            alert('Por favor complete todos los campos');
+            return;
+        }
+
+        fetch('/admin/editar_usuario', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                id: id,
+                username: username,
+                funcionario: funcionario,
+                rol: rol
+            })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                alert('✅ ' + data.message);
+                location.reload();
+            } else {
+                alert('❌ ' + data.message);
+            }
+        })
+        .catch(error => {
+            alert('❌ Error al editar usuario: ' + error);
+        });
+    });
+
+    // Guardar nueva contraseña
+    document.getElementById('btnGuardarPassword').addEventListener('click', function() {
+        const id = document.getElementById('editarPasswordId').value;
+        const nuevaPassword = document.getElementById('nuevaPassword').value;
+        const confirmarPassword = document.getElementById('confirmarPassword').value;
+
+        if (!nuevaPassword || !confirmarPassword) {
+            alert('Por favor complete todos los campos');
+            return;
+        }
+
+        if (nuevaPassword.length < 6) {
+            alert('La contraseña debe tener al menos 6 caracteres');
+            return;
+        }
+
+        if (nuevaPassword !== confirmarPassword) {
+            alert('Las contraseñas no coinciden');
+            return;
+        }
+
+        fetch('/admin/editar_password', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                id: id,
+                nueva_password: nuevaPassword
+            })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                alert('✅ ' + data.message);
+                const modal = bootstrap.Modal.getInstance(document.getElementById('modalEditarPassword'));
+                modal.hide();
+            } else {
+                alert('❌ ' + data.message);
+            }
+        })
+        .catch(error => {
+            alert('❌ Error al editar contraseña: ' + error);
+        });
+    });
+
+    // Guardar gestión de estaciones
+    document.getElementById('btnGuardarGestionEstaciones').addEventListener('click', function() {
+        const usuarioId = document.getElementById('gestionUsuarioId').value;
+        const checkboxes = document.querySelectorAll('#gestionEstacionesContainer .estacion-checkbox:checked');
+        const estaciones = Array.from(checkboxes).map(cb => cb.value);
+
+        if (!usuarioId) {
+            alert('Error: No se ha seleccionado usuario');
+            return;
+        }
+
+        fetch('/admin/asignar_estaciones', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                usuario_id: usuarioId,
+                estaciones: estaciones
+            })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                alert('✅ ' + data.message);
+                const modal = bootstrap.Modal.getInstance(document.getElementById('modalGestionarEstaciones'));
+                modal.hide();
+                location.reload();
+            } else {
+                alert('❌ ' + data.message);
+            }
+        })
+        .catch(error => {
+            alert('❌ Error al guardar asignaciones: ' + error);
+        });
+    });
+
+    // Eliminar Usuario
+    document.querySelectorAll('.btn-eliminar-usuario').forEach(btn => {
+        btn.addEventListener('click', function() {
+            const id = this.getAttribute('data-id');
+            const username = this.getAttribute('data-username');
+
+            if (confirm(`¿Está seguro de eliminar al usuario "${username}"? Esta acción no se puede deshacer.`)) {
+                fetch('/admin/eliminar_usuario', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ id: id })
+                })
+                .then(response => response.json())
+                .then(data => {
+                    if (data.success) {
+                        alert('✅ ' + data.message);
+                        location.reload();
+                    } else {
+                        alert('❌ ' + data.message);
+                    }
+                })
+                .catch(error => {
+                    alert('❌ Error al eliminar usuario: ' + error);
+                });
+            }
+        });
+    });
+
+    // Gestión de asignación de estaciones
+    initializeEstacionesManagement();
+}
+
+// Gestión de asignación de estaciones
+function initializeEstacionesManagement() {
+    const usuarioSelect = document.getElementById('usuarioAsignacion');
+    const estacionesContainer = document.querySelector('.estaciones-container');
+    const btnGuardarAsignaciones = document.getElementById('btnGuardarAsignaciones');
+
+    let todasLasEstaciones = [];
+    let estacionesSeleccionadas = new Set();
+
+    // Cargar todas las estaciones disponibles
+    function cargarEstaciones() {
+        fetch('/admin/obtener_todas_estaciones')
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    todasLasEstaciones = data.estaciones;
+                    renderizarEstaciones();
+                } else {
+                    estacionesContainer.innerHTML = '<div class="text-danger">Error al cargar estaciones</div>';
+                }
+            })
+            .catch(error => {
+                estacionesContainer.innerHTML = '<div class="text-danger">Error al cargar estaciones: ' + error + '</div>';
+            });
+    }
+
+    // Renderizar estaciones en el contenedor
+    function renderizarEstaciones() {
+        if (todasLasEstaciones.length === 0) {
+            estacionesContainer.innerHTML = '<div class="text-muted">No hay estaciones disponibles</div>';
+            return;
+        }
+
+        estacionesContainer.innerHTML = '';
+
+        todasLasEstaciones.forEach(estacion => {
+            const div = document.createElement('div');
+            div.className = 'form-check';
+            div.innerHTML = `
+                <input class="form-check-input estacion-checkbox" type="checkbox" 
+                       value="${estacion.codigo}" id="estacion-${estacion.codigo}"
+                       ${estacionesSeleccionadas.has(estacion.codigo) ? 'checked' : ''}>
+                <label class="form-check-label" for="estacion-${estacion.codigo}">
+                    <strong>${estacion.codigo}</strong> - ${estacion.nombre}
+                </label>
+            `;
+            estacionesContainer.appendChild(div);
+        });
+
+        // Agregar event listeners a los checkboxes
+        document.querySelectorAll('.estacion-checkbox').forEach(checkbox => {
+            checkbox.addEventListener('change', function() {
+                if (this.checked) {
+                    estacionesSeleccionadas.add(this.value);
+                } else {
+                    estacionesSeleccionadas.delete(this.value);
+                }
+            });
+        });
+    }
+
+    // Cuando se selecciona un usuario, cargar sus estaciones asignadas
+    usuarioSelect.addEventListener('change', function() {
+        const usuarioId = this.value;
+
+        if (!usuarioId) {
+            estacionesSeleccionadas.clear();
+            renderizarEstaciones();
+            btnGuardarAsignaciones.disabled = true;
+            return;
+        }
+
+        btnGuardarAsignaciones.disabled = false;
+
+        // Cargar estaciones asignadas al usuario
+        fetch(`/admin/obtener_estaciones_usuario/${usuarioId}`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    estacionesSeleccionadas = new Set(data.estaciones);
+                    renderizarEstaciones();
+                }
+            })
+            .catch(error => {
+                console.error('Error al cargar estaciones del usuario:', error);
+            });
+    });
+
+    // Guardar asignaciones
+    btnGuardarAsignaciones.addEventListener('click', function() {
+        const usuarioId = usuarioSelect.value;
+
+        if (!usuarioId) {
+            alert('Por favor seleccione un usuario');
+            return;
+        }
+
+        const estacionesArray = Array.from(estacionesSeleccionadas);
+
+        fetch('/admin/asignar_estaciones', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                usuario_id: usuarioId,
+                estaciones: estacionesArray
+            })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                alert('✅ ' + data.message);
+            } else {
+                alert('❌ ' + data.message);
+            }
+        })
+        .catch(error => {
+            alert('❌ Error al guardar asignaciones: ' + error);
+        });
+    });
+
+    // Cargar estaciones al inicializar
+    cargarEstaciones();
+    btnGuardarAsignaciones.disabled = true;
+}
+
+// Funciones para gestión de estaciones en modal
+function cargarEstacionesAsignadas(usuarioId) {
+    const container = document.getElementById('estacionesAsignadasList');
+
+    fetch(`/admin/obtener_estaciones_usuario/${usuarioId}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                if (data.estaciones.length === 0) {
+                    container.innerHTML = '<div class="text-muted">No hay estaciones asignadas</div>';
+                    return;
+                }
+
+                let html = '';
+                data.estaciones.forEach(codigo => {
+                    // Buscar nombre de la estación
+                    const estacion = todasLasEstaciones.find(e => e.codigo === codigo);
+                    const nombre = estacion ? estacion.nombre : 'Nombre no disponible';
+
+                    html += `
+                        <div class="estacion-item">
+                            <span class="estacion-codigo">${codigo}</span>
+                            <span class="estacion-nombre">${nombre}</span>
+                        </div>
+                    `;
+                });
+                container.innerHTML = html;
+            } else {
+                container.innerHTML = '<div class="text-danger">Error al cargar estaciones asignadas</div>';
+            }
+        })
+        .catch(error => {
+            container.innerHTML = '<div class="text-danger">Error al cargar estaciones asignadas</div>';
+        });
+}
+
+function cargarTodasEstacionesParaGestion(usuarioId) {
+    const container = document.getElementById('gestionEstacionesContainer');
+
+    fetch('/admin/obtener_todas_estaciones')
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                // Primero obtener las estaciones asignadas al usuario
+                fetch(`/admin/obtener_estaciones_usuario/${usuarioId}`)
+                    .then(response => response.json())
+                    .then(estacionesData => {
+                        const estacionesAsignadas = estacionesData.success ? new Set(estacionesData.estaciones) : new Set();
+
+                        if (data.estaciones.length === 0) {
+                            container.innerHTML = '<div class="text-muted">No hay estaciones disponibles</div>';
+                            return;
+                        }
+
+                        let html = '';
+                        data.estaciones.forEach(estacion => {
+                            const estaAsignada = estacionesAsignadas.has(estacion.codigo);
+
+                            html += `
+                                <div class="form-check">
+                                    <input class="form-check-input estacion-checkbox" type="checkbox" 
+                                           value="${estacion.codigo}" id="gestion-estacion-${estacion.codigo}"
+                                           ${estaAsignada ? 'checked' : ''}>
+                                    <label class="form-check-label" for="gestion-estacion-${estacion.codigo}">
+                                        <strong>${estacion.codigo}</strong> - ${estacion.nombre}
+                                    </label>
+                                </div>
+                            `;
+                        });
+                        container.innerHTML = html;
+                    })
+                    .catch(error => {
+                        container.innerHTML = '<div class="text-danger">Error al cargar asignaciones</div>';
+                    });
+            } else {
+                container.innerHTML = '<div class="text-danger">Error al cargar estaciones</div>';
+            }
+        })
+        .catch(error => {
+            container.innerHTML = '<div class="text-danger">Error al cargar estaciones: ' + error + '</div>';
+        });
+}
+
+function initializeDateFilter() {
+    // Filtro de fechas y horas para Dashboard
+    const dateFilterForm = document.getElementById('dateFilterForm');
+    if (dateFilterForm) {
+        dateFilterForm.addEventListener('submit', function(e) {
+            e.preventDefault();
+
+            const fechaInicio = document.getElementById('fecha_inicio').value;
+            const fechaFin = document.getElementById('fecha_fin').value;
+            const horaInicio = document.getElementById('hora_inicio').value;
+            const horaFin = document.getElementById('hora_fin').value;
+
+            // Validar que las fechas no estén vacías
+            if (!fechaInicio || !fechaFin) {
+                alert('Por favor seleccione ambas fechas');
+                return;
+            }
+
+            // Validar que fecha inicio no sea mayor a fecha fin
+            if (fechaInicio > fechaFin) {
+                alert('La fecha de inicio no puede ser mayor a la fecha fin');
+                return;
+            }
+
+            // Construir URL con parámetros de fecha y hora
+            const url = new URL(window.location.href);
+            url.searchParams.set('fecha_inicio', fechaInicio);
+            url.searchParams.set('fecha_fin', fechaFin);
+            if (horaInicio) url.searchParams.set('hora_inicio', horaInicio);
+            if (horaFin) url.searchParams.set('hora_fin', horaFin);
+
+            // Redirigir a la misma página con los nuevos parámetros
+            window.location.href = url.toString();
+        });
+    }
+
+    // Establecer valores por defecto
+    const fechaFinInput = document.getElementById('fecha_fin');
+    if (fechaFinInput && !fechaFinInput.value) {
+        const today = new Date().toISOString().split('T')[0];
+        fechaFinInput.value = today;
+    }
+
+    const fechaInicioInput = document.getElementById('fecha_inicio');
+    if (fechaInicioInput && !fechaInicioInput.value) {
+        const oneWeekAgo = new Date();
+        oneWeekAgo.setDate(oneWeekAgo.getDate() - 7);
+        fechaInicioInput.value = oneWeekAgo.toISOString().split('T')[0];
+    }
+
+    // Establecer horas por defecto si están vacías
+    const horaInicioInput = document.getElementById('hora_inicio');
+    if (horaInicioInput && !horaInicioInput.value) {
+        horaInicioInput.value = '00:00';
+    }
+
+    const horaFinInput = document.getElementById('hora_fin');
+    if (horaFinInput && !horaFinInput.value) {
+        horaFinInput.value = '23:59';
+    }
+}
+
+function initializeTabDatosDateFilter() {
+    // Filtro de fechas y horas para Tab Datos
+    const tabDatosDateFilterForm = document.getElementById('tabDatosDateFilterForm');
+    if (tabDatosDateFilterForm) {
+        tabDatosDateFilterForm.addEventListener('submit', function(e) {
+            e.preventDefault();
+
+            const fechaInicio = document.getElementById('tab_datos_fecha_inicio').value;
+            const fechaFin = document.getElementById('tab_datos_fecha_fin').value;
+            const horaInicio = document.getElementById('tab_datos_hora_inicio').value;
+            const horaFin = document.getElementById('tab_datos_hora_fin').value;
+
+            // Validar que las fechas no estén vacías
+            if (!fechaInicio || !fechaFin) {
+                alert('Por favor seleccione ambas fechas');
+                return;
+            }
+
+            // Validar que fecha inicio no sea mayor a fecha fin
+            if (fechaInicio > fechaFin) {
+                alert('La fecha de inicio no puede ser mayor a la fecha fin');
+                return;
+            }
+
+            // Construir URL con parámetros de fecha y hora
+            const url = new URL(window.location.href);
+            url.searchParams.set('fecha_inicio', fechaInicio);
+            url.searchParams.set('fecha_fin', fechaFin);
+            if (horaInicio) url.searchParams.set('hora_inicio', horaInicio);
+            if (horaFin) url.searchParams.set('hora_fin', horaFin);
+
+            // Agregar hash para mantener la pestaña activa
+            url.hash = 'tab-datos';
+
+            // Redirigir a la misma página con los nuevos parámetros
+            window.location.href = url.toString();
+        });
+    }
+
+    // Establecer valores por defecto para el filtro de datos
+    const tabDatosFechaFinInput = document.getElementById('tab_datos_fecha_fin');
+    if (tabDatosFechaFinInput && !tabDatosFechaFinInput.value) {
+        const today = new Date().toISOString().split('T')[0];
+        tabDatosFechaFinInput.value = today;
+    }
+
+    const tabDatosFechaInicioInput = document.getElementById('tab_datos_fecha_inicio');
+    if (tabDatosFechaInicioInput && !tabDatosFechaInicioInput.value) {
+        const oneWeekAgo = new Date();
+        oneWeekAgo.setDate(oneWeekAgo.getDate() - 7);
+        tabDatosFechaInicioInput.value = oneWeekAgo.toISOString().split('T')[0];
+    }
+
+    // Establecer horas por defecto para el filtro de datos
+    const tabDatosHoraInicioInput = document.getElementById('tab_datos_hora_inicio');
+    if (tabDatosHoraInicioInput && !tabDatosHoraInicioInput.value) {
+        tabDatosHoraInicioInput.value = '00:00';
+    }
+
+    const tabDatosHoraFinInput = document.getElementById('tab_datos_hora_fin');
+    if (tabDatosHoraFinInput && !tabDatosHoraFinInput.value) {
+        tabDatosHoraFinInput.value = '23:59';
+    }
+}
+
+// Exportar a Excel
+document.getElementById('btnExportExcel').addEventListener('click', function() {
+    const fechaInicio = document.getElementById('tab_datos_fecha_inicio').value;
+    const fechaFin = document.getElementById('tab_datos_fecha_fin').value;
+    const horaInicio = document.getElementById('tab_datos_hora_inicio').value;
+    const horaFin = document.getElementById('tab_datos_hora_fin').value;
+
+    let url = '/admin/export/excel';
+    const params = new URLSearchParams();
+
+    if (fechaInicio) params.append('fecha_inicio', fechaInicio);
+    if (fechaFin) params.append('fecha_fin', fechaFin);
+    if (horaInicio) params.append('hora_inicio', horaInicio);
+    if (horaFin) params.append('hora_fin', horaFin);
+
+    if (params.toString()) {
+        url += '?' + params.toString();
+    }
+
+    window.location.href = url;
+});
@@ -0,0 +1,155 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Función para actualizar estación
+    document.querySelectorAll('.station-form').forEach(form => {
+        form.addEventListener('submit', function(e) {
+            e.preventDefault();
+            const button = this.querySelector('.actualizar-btn');
+            const codigo = button.getAttribute('data-codigo');
+            const razonSocial = button.getAttribute('data-razon-social');
+            const zona = button.getAttribute('data-zona');
+            const provincia = button.getAttribute('data-provincia');
+            const municipio = button.getAttribute('data-municipio');
+
+            // Recopilar datos del formulario
+            const datos = {
+                codigo: codigo,
+                razon_social: razonSocial,
+                zona: zona,
+                provincia: provincia,
+                municipio: municipio,
+                do_do_plus: parseInt(this.querySelector('[data-field="do_do_plus"]').value) || 0,
+                do_uls_plus: parseInt(this.querySelector('[data-field="do_uls_plus"]').value) || 0,
+                ge_ge_plus: parseInt(this.querySelector('[data-field="ge_ge_plus"]').value) || 0,
+                gp_plus: parseInt(this.querySelector('[data-field="gp_plus"]').value) || 0,
+                gp_ultra_100: parseInt(this.querySelector('[data-field="gp_ultra_100"]').value) || 0,
+                filas_do_do_plus: parseInt(this.querySelector('[data-field="filas_do_do_plus"]').value) || 0,
+                filas_ge_ge_plus: parseInt(this.querySelector('[data-field="filas_ge_ge_plus"]').value) || 0
+            };
+
+            // Validar que al menos un volumen tenga valor
+            const totalDiesel = datos.do_do_plus + datos.do_uls_plus;
+            const totalGasolina = datos.ge_ge_plus + datos.gp_plus + datos.gp_ultra_100;
+
+            if (totalDiesel === 0 && totalGasolina === 0) {
+                alert('❌ Error: Debe ingresar al menos un volumen en diesel o gasolina');
+                return;
+            }
+
+            // Mostrar loading con mejor diseño
+            const originalText = button.innerHTML;
+            button.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>Guardando...';
+            button.disabled = true;
+            button.classList.add('btn-warning');
+
+            // Agregar efecto de highlight al formulario
+            this.classList.add('highlight');
+
+            // Enviar datos al servidor
+            fetch('/user/actualizar_estacion', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify(datos)
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    // Efecto visual de éxito
+                    button.innerHTML = '<i class="fas fa-check me-2"></i>¡Guardado!';
+                    button.classList.remove('btn-warning');
+                    button.classList.add('btn-success');
+
+                    setTimeout(() => {
+                        alert('✅ ' + data.message);
+                        location.reload();
+                    }, 1000);
+                } else {
+                    alert('❌ ' + data.message);
+                    // Restaurar botón
+                    button.innerHTML = originalText;
+                    button.disabled = false;
+                    button.classList.remove('btn-warning');
+                }
+            })
+            .catch(error => {
+                alert('❌ Error al guardar: ' + error);
+                // Restaurar botón
+                button.innerHTML = originalText;
+                button.disabled = false;
+                button.classList.remove('btn-warning');
+            });
+        });
+    });
+
+    // Calcular totales automáticamente al cambiar valores
+    document.querySelectorAll('.volumen-input').forEach(input => {
+        input.addEventListener('input', function() {
+            const form = this.closest('.station-form');
+            const codigo = this.getAttribute('data-codigo');
+
+            // Obtener valores actuales
+            const do_do_plus = parseInt(form.querySelector('[data-field="do_do_plus"]').value) || 0;
+            const do_uls_plus = parseInt(form.querySelector('[data-field="do_uls_plus"]').value) || 0;
+            const ge_ge_plus = parseInt(form.querySelector('[data-field="ge_ge_plus"]').value) || 0;
+            const gp_plus = parseInt(form.querySelector('[data-field="gp_plus"]').value) || 0;
+            const gp_ultra_100 = parseInt(form.querySelector('[data-field="gp_ultra_100"]').value) || 0;
+
+            // Calcular totales
+            const totalDiesel = do_do_plus + do_uls_plus;
+            const totalGasolina = ge_ge_plus + gp_plus + gp_ultra_100;
+
+            // Actualizar totales en el formulario
+            form.querySelector('.total-diesel').textContent = totalDiesel.toLocaleString();
+            form.querySelector('.total-gasolina').textContent = totalGasolina.toLocaleString();
+
+            // Actualizar estados visualmente
+            actualizarEstado(form.querySelector('.estado-diesel'), totalDiesel);
+            actualizarEstado(form.querySelector('.estado-gasolina'), totalGasolina);
+
+            // Efecto visual al cambiar valores
+            this.style.borderColor = '#28a745';
+            this.style.boxShadow = '0 0 0 0.2rem rgba(40, 167, 69, 0.25)';
+
+            setTimeout(() => {
+                this.style.borderColor = '';
+                this.style.boxShadow = '';
+            }, 1000);
+        });
+    });
+
+    function actualizarEstado(elemento, total) {
+        const volumeIndicator = elemento.querySelector('.volume-indicator');
+
+        if (total > 7000) {
+            elemento.className = 'status-badge estado-diesel bg-success text-white';
+            volumeIndicator.className = 'volume-indicator volume-high';
+            elemento.innerHTML = '<span class="volume-indicator volume-high"></span>ALTO';
+        } else if (total >= 3000) {
+            elemento.className = 'status-badge estado-diesel bg-warning text-dark';
+            volumeIndicator.className = 'volume-indicator volume-medium';
+            elemento.innerHTML = '<span class="volume-indicator volume-medium"></span>MEDIO';
+        } else {
+            elemento.className = 'status-badge estado-diesel bg-danger text-white';
+            volumeIndicator.className = 'volume-indicator volume-low';
+            elemento.innerHTML = '<span class="volume-indicator volume-low"></span>BAJO';
+        }
+    }
+
+    // Efectos de hover mejorados
+    document.querySelectorAll('.station-card').forEach(card => {
+        card.addEventListener('mouseenter', function() {
+            this.style.transform = 'translateY(-8px)';
+        });
+
+        card.addEventListener('mouseleave', function() {
+            this.style.transform = 'translateY(0)';
+        });
+    });
+
+    // Inicializar tooltips si es necesario
+    var tooltipTriggerList = [].slice.call(document.querySelectorAll('[data-bs-toggle="tooltip"]'));
+    var tooltipList = tooltipTriggerList.map(function (tooltipTriggerEl) {
+        return new bootstrap.Tooltip(tooltipTriggerEl);
+    });
+});
@@ -0,0 +1,53 @@
+"""Configuración común de las pruebas.
+
+app.py fija la URL de la base de datos al importarse, por eso se define antes
+de importarlo: una base SQLite temporal, o PRUEBAS_DATABASE_URL para correr la
+suite contra un PostgreSQL DEDICADO (sus tablas se borran en cada prueba).
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+_directorio = tempfile.mkdtemp(prefix='pruebas_combustibles_')
+os.environ['DATABASE_URL'] = (os.environ.get('PRUEBAS_DATABASE_URL')
+                              or 'sqlite:///' + os.path.join(_directorio, 'pruebas.db'))
+# La réplica de lectura es la misma base: las pruebas ven qué motor atiende cada consulta
+os.environ['DATABASE_REPLICA_URL'] = os.environ['DATABASE_URL']
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_directorio, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def modulo():
+    import app as modulo
+    return modulo
+
+
+@pytest.fixture
+def base(modulo, monkeypatch, tmp_path):
+    """Contexto de la aplicación con las tablas vacías"""
+    with modulo.app.app_context():
+        modulo.db.drop_all()
+        modulo.db.create_all()
+        # Las tablas nuevas repiten versiones de datos: nada en memoria debe sobrevivir
+        modulo.cache_fragmentos.vaciar()
+        modulo.estado_estaciones.vaciar()
+        # ni en disco: las exportaciones se identifican por esa misma versión
+        monkeypatch.setitem(modulo.app.config, 'EXPORTACION_CARPETA', str(tmp_path / 'exportaciones'))
+        modulo._trabajos_exportacion.clear()
+        yield modulo
+        modulo.db.session.remove()
+
+
+@pytest.fixture
+def cliente_admin(base):
+    import benchmark
+    return benchmark.cliente_con_sesion(base, user='admin', role='admin', funcionario='Administrador')
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def registro(base, codigo, provincia, municipio, fecha_hora, **volumenes):
+    return base.RegistroCombustible(
+        codigo=codigo, razon_social=codigo, zona='NORTE', provincia=provincia, municipio=municipio,
+        funcionario='Ana Gomez', fecha_hora=fecha_hora, **volumenes)
+
+
+@pytest.fixture
+def estaciones(base):
+    ahora = datetime.now().replace(microsecond=0)
+    base.db.session.add_all([
+        # Sólo cuenta el último registro de cada estación
+        registro(base, 'E1', 'P1', 'M1', ahora - timedelta(hours=2), do_do_plus=9000),
+        registro(base, 'E1', 'P1', 'M1', ahora, do_do_plus=8000, filas_do_do_plus=4),
+        registro(base, 'E2', 'P1', 'M2', ahora, do_do_plus=2000, gp_plus=2000, filas_do_do_plus=2),
+        registro(base, 'E3', 'P2', 'M3', ahora, ge_ge_plus=1000),
+    ])
+    base.db.session.commit()
+    base.db.session.remove()
+    return base
+
+
+def consultar(cliente, **parametros):
+    respuesta = cliente.get('/admin/agregados', query_string=parametros)
+    return respuesta.status_code, respuesta.get_json()
+
+
+def test_agrega_el_estado_actual_por_provincia(estaciones, cliente_admin):
+    estado, datos = consultar(cliente_admin, nivel='provincia')
+    assert estado == 200
+    assert datos['grupos'] == ['P1', 'P2']
+    assert datos['estaciones'] == [2, 1]
+    assert datos['volumen_por_producto']['do_do_plus'] == [10000, 0]
+    assert datos['volumen_por_grupo'] == {'dos': [10000, 0], 'ges': [2000, 1000]}
+    assert datos['volumen_total'] == [12000, 1000]
+    assert datos['estaciones_por_estado'] == {'ALTO': [1, 0], 'MEDIO': [1, 0], 'BAJO': [0, 1]}
+    assert datos['promedio_filas']['do_do_plus'] == [3.0, 0.0]
+
+
+def test_coincide_con_calcular_estado(estaciones):
+    totales = [sum(getattr(r, producto) or 0 for producto in estaciones.PRODUCTOS)
+               for r in estaciones.obtener_ultimos_registros()]
+    resultado = estaciones.agregar_por_nivel('zona')
+    for nombre in ('ALTO', 'MEDIO', 'BAJO'):
+        esperado = sum(1 for total in totales if estaciones.calcular_estado(total)['text'] == nombre)
+        assert sum(resultado['estaciones_por_estado'][nombre]) == esperado
+
+
+def test_bajar_de_nivel_filtra_el_grupo(estaciones, cliente_admin):
+    estado, datos = consultar(cliente_admin, nivel='municipio', provincia='P1')
+    assert estado == 200
+    assert datos['filtros'] == {'provincia': 'P1'}
+    assert datos['grupos'] == ['M1', 'M2']
+
+
+def test_sin_registros_devuelve_listas_vacias(base, cliente_admin):
+    estado, datos = consultar(cliente_admin, nivel='zona')
+    assert estado == 200
+    assert datos['grupos'] == [] and datos['estaciones_por_estado']['ALTO'] == []
+
+
+def test_parametros_no_validos(base, cliente_admin):
+    assert consultar(cliente_admin, nivel='barrio')[0] == 400
+    assert consultar(cliente_admin, fecha_inicio='ayer')[0] == 400
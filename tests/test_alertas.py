@@ -0,0 +1,94 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def alertas(base, monkeypatch):
+    monkeypatch.setitem(base.app.config, 'ALERTA_UMBRALES', 'total=3000')
+    monkeypatch.setitem(base.app.config, 'ALERTA_HISTERESIS', 0.1)
+    return base
+
+
+def escribir(base, total, fecha_hora, codigo='E1'):
+    registro = base.RegistroCombustible(
+        codigo=codigo, razon_social=codigo, zona='NORTE', provincia='P', municipio='M',
+        funcionario='Ana Gomez', do_do_plus=total, fecha_hora=fecha_hora)
+    base.db.session.add(registro)
+    generadas = base.evaluar_alertas([registro])
+    base.db.session.commit()
+    return [alerta.tipo for alerta in generadas]
+
+
+def test_histeresis_evita_alertas_intermitentes(alertas):
+    inicio = datetime(2024, 5, 1, 8)
+    totales = [5000, 2900, 3100, 2950, 3200, 3300, 2999]
+    tipos = [escribir(alertas, total, inicio + timedelta(hours=i)) for i, total in enumerate(totales)]
+    # Entra por debajo de 3000 y sólo sale al llegar a 3300
+    assert tipos == [[], ['BAJO'], [], [], [], ['RECUPERADO'], ['BAJO']]
+    assert alertas.AlertaCombustible.query.count() == 3
+
+
+def test_registro_historico_no_cambia_el_estado(alertas):
+    ahora = datetime(2024, 5, 1, 12)
+    assert escribir(alertas, 2000, ahora) == ['BAJO']
+    assert escribir(alertas, 9000, ahora - timedelta(days=1)) == []
+    estado = alertas.db.session.get(alertas.EstadoAlertaEstacion, ('E1', 'total'))
+    assert estado.en_alerta and estado.valor == 2000
+
+
+def test_cero_en_dos_no_cambia_el_estado(alertas, monkeypatch):
+    monkeypatch.setitem(alertas.app.config, 'ALERTA_UMBRALES', 'ges=1000')
+    assert escribir(alertas, 5000, datetime(2024, 5, 1, 8)) == []
+    assert alertas.db.session.get(alertas.EstadoAlertaEstacion, ('E1', 'ges')).en_alerta is False
+
+
+def test_primera_escritura_concurrente_continua_desde_el_estado_ganador(alertas):
+    if not alertas.es_postgresql():
+        pytest.skip('en SQLite las escrituras ya están serializadas')
+    # Otra transacción crea el estado de la estación y confirma mientras esta escritura lo intenta crear
+    otra = alertas.db.engine.connect()
+    transaccion = otra.begin()
+    otra.execute(alertas.EstadoAlertaEstacion.__table__.insert().values(
+        codigo='E1', nivel='total', en_alerta=True, valor=100, fecha_hora=datetime(2024, 5, 1, 7)))
+
+    def confirmar():
+        transaccion.commit()
+        otra.close()
+
+    threading.Timer(0.5, confirmar).start()
+    assert escribir(alertas, 5000, datetime(2024, 5, 1, 8)) == ['RECUPERADO']
+
+
+def test_umbral_desconocido(alertas):
+    with pytest.raises(ValueError):
+        alertas.leer_umbrales_alerta('total=3000,kerosene=10')
+
+
+def test_feed_por_cursor(alertas, cliente_admin):
+    inicio = datetime(2024, 5, 1, 8)
+    escribir(alertas, 1000, inicio, codigo='E1')
+    escribir(alertas, 1000, inicio, codigo='E2')
+    escribir(alertas, 8000, inicio + timedelta(hours=1), codigo='E1')
+    alertas.db.session.remove()
+
+    primera = cliente_admin.get('/admin/alertas', query_string={'limite': 2}).get_json()
+    assert [(a['codigo'], a['tipo']) for a in primera['alertas']] == [('E1', 'BAJO'), ('E2', 'BAJO')]
+    segunda = cliente_admin.get('/admin/alertas', query_string={'desde': primera['cursor']}).get_json()
+    assert [(a['codigo'], a['tipo']) for a in segunda['alertas']] == [('E1', 'RECUPERADO')]
+    vacia = cliente_admin.get('/admin/alertas', query_string={'desde': segunda['cursor']}).get_json()
+    assert vacia['alertas'] == [] and vacia['cursor'] == segunda['cursor']
+
+
+def test_inicializar_evalua_el_ultimo_registro(alertas):
+    ahora = datetime(2024, 5, 1, 12)
+    alertas.db.session.add_all([
+        alertas.RegistroCombustible(codigo=codigo, razon_social=codigo, zona='Z', provincia='P', municipio='M',
+                                    funcionario='F', do_do_plus=total, fecha_hora=fecha)
+        for codigo, total, fecha in [('E1', 1000, ahora - timedelta(hours=1)), ('E1', 5000, ahora),
+                                     ('E2', 500, ahora)]
+    ])
+    alertas.db.session.commit()
+    assert alertas.inicializar_alertas(lote=1) == {'estaciones': 2, 'alertas': 1}
+    assert [a.codigo for a in alertas.AlertaCombustible.query.all()] == ['E2']
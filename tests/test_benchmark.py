@@ -0,0 +1,61 @@
+import random
+from io import BytesIO
+
+import pytest
+
+import benchmark
+
+
+def test_generador_es_determinista():
+    a = benchmark.generar_estaciones(30, 4, random.Random(1))
+    b = benchmark.generar_estaciones(30, 4, random.Random(1))
+    assert a == b
+    estaciones, funcionarios = a
+    assert len({e['codigo'] for e in estaciones}) == 30
+    assert {e['funcionario'] for e in estaciones} == set(funcionarios)
+
+
+def test_poblar_base_datos_crea_historial_y_asignaciones(base):
+    estaciones, funcionarios = benchmark.poblar_base_datos(base, 20, 3, 4)
+    R = base.RegistroCombustible
+    assert R.query.count() == 60
+    assert base.AsignacionEstacion.query.count() == 20
+    assert base.Usuario.query.count() == 4
+    assert R.query.filter_by(tipo_registro='inicial').count() == 20
+    # El historial de cada estación queda ordenado en el tiempo
+    fechas = [r.fecha_hora for r in R.query.filter_by(codigo=estaciones[0]['codigo']).order_by(R.id)]
+    assert fechas == sorted(fechas)
+
+
+def test_csv_de_carga_se_acepta(base, cliente_admin):
+    estaciones, _ = benchmark.generar_estaciones(15, 3, random.Random(2))
+    contenido = benchmark.generar_csv_carga(estaciones, random.Random(3))
+    respuesta = cliente_admin.post('/admin/upload', data={'file': (BytesIO(contenido), 'carga.csv')},
+                                   content_type='multipart/form-data')
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['success']
+    assert base.RegistroCombustible.query.count() == 15
+
+
+def test_escala_mide_todas_las_rutas(base):
+    resultado = benchmark.ejecutar_escala(6, 2, 1)
+    assert resultado['filas_historial'] == 12
+    for ruta in ('obtener_ultimos_registros', 'export_csv', 'export_excel', 'export_csv_generacion',
+                 'export_excel_generacion', 'admin_dashboard', 'user_dashboard', 'upload_file'):
+        assert resultado['resultados'][ruta]['repeticiones'] == 1
+
+
+def test_exportar_retoma_el_trabajo_que_sigue_generandose(base, cliente_admin, monkeypatch):
+    benchmark.poblar_base_datos(base, 5, 2, 1)
+    # Sin espera el botón del panel redirige mientras el trabajo no termina
+    monkeypatch.setitem(base.app.config, 'EXPORTACION_ESPERA', 0)
+    respuesta = benchmark.exportar(cliente_admin, '/admin/export/csv', 'export_csv')
+    assert len(respuesta.get_data(as_text=True).splitlines()) == 6
+
+    def fallar(registros, archivo):
+        raise OSError('disco lleno')
+    monkeypatch.setattr(base, 'escribir_exportacion_excel', fallar)
+    with pytest.raises(RuntimeError, match='disco lleno'):
+        benchmark.exportar(cliente_admin, '/admin/export/excel', 'export_excel')
+    with pytest.raises(RuntimeError, match='disco lleno'):
+        benchmark.exportar_trabajo(cliente_admin, 'excel', {'fecha_inicio': '2020-01-01'}, 'export_excel')
@@ -0,0 +1,57 @@
+import csv
+import io
+import random
+
+import sqlalchemy as sa
+
+import benchmark
+
+
+def subir(cliente, contenido):
+    respuesta = cliente.post('/admin/upload', data={'file': (io.BytesIO(contenido), 'carga.csv')},
+                             content_type='multipart/form-data')
+    return respuesta.status_code, respuesta.get_json()
+
+
+def cambiar(contenido, fila, columna, valor):
+    filas = list(csv.reader(io.StringIO(contenido.decode('utf-8'))))
+    filas[fila][columna] = valor
+    salida = io.StringIO()
+    csv.writer(salida).writerows(filas)
+    return salida.getvalue().encode('utf-8')
+
+
+def test_archivo_repetido_se_rechaza(base, cliente_admin):
+    estaciones, _ = benchmark.generar_estaciones(5, 2, random.Random(1))
+    contenido = benchmark.generar_csv_carga(estaciones, random.Random(2))
+    assert subir(cliente_admin, contenido)[0] == 200
+    estado, datos = subir(cliente_admin, contenido)
+    assert estado == 409 and datos['duplicado']
+    assert base.CargaArchivo.query.count() == 1
+    assert base.RegistroCombustible.query.count() == 5
+
+
+def test_solo_se_insertan_las_filas_que_cambiaron(base, cliente_admin):
+    estaciones, _ = benchmark.generar_estaciones(5, 2, random.Random(1))
+    contenido = benchmark.generar_csv_carga(estaciones, random.Random(2))
+    subir(cliente_admin, contenido)
+    # Misma foto con otra fecha y una estación distinta; una fila mal formada
+    segunda = cambiar(cambiar(contenido, 1, 5, '123'), 2, 0, '')
+    for fila in range(1, 6):
+        segunda = cambiar(segunda, fila, 13, '2030-01-01 00:00:00')
+    estado, datos = subir(cliente_admin, segunda)
+    assert estado == 200
+    assert (datos['insertados'], datos['sin_cambios'], datos['rechazados']) == (1, 3, 1)
+    carga = base.CargaArchivo.query.order_by(base.CargaArchivo.id.desc()).first()
+    assert (carga.registros_procesados, carga.registros_sin_cambios, carga.registros_rechazados) == (1, 3, 1)
+    assert base.RegistroCombustible.query.count() == 6
+
+
+def test_asegurar_columnas_agrega_las_faltantes(base):
+    base.db.session.rollback()
+    with base.db.engine.begin() as conexion:
+        conexion.execute(sa.text('DROP INDEX ix_carga_hash_archivo'))
+        conexion.execute(sa.text('ALTER TABLE carga_archivo DROP COLUMN hash_archivo'))
+    base.asegurar_columnas()
+    columnas = {c['name'] for c in sa.inspect(base.db.engine).get_columns('carga_archivo')}
+    assert 'hash_archivo' in columnas
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import random
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def carpeta(base, monkeypatch, tmp_path):
+    monkeypatch.setitem(base.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return tmp_path / 'parciales'
+
+
+def iniciar(cliente, contenido):
+    datos = cliente.post('/admin/upload/parcial', json={
+        'nombre_archivo': 'carga.csv', 'tamano': len(contenido),
+        'sha256': hashlib.sha256(contenido).hexdigest()}).get_json()
+    assert datos['success']
+    return datos['id']
+
+
+def enviar(cliente, carga_id, offset, fragmento, checksum=None):
+    respuesta = cliente.put(f'/admin/upload/parcial/{carga_id}', query_string={'offset': offset}, data=fragmento,
+                            headers={'X-Checksum-Sha256': checksum or hashlib.sha256(fragmento).hexdigest()})
+    return respuesta.status_code, respuesta.get_json()
+
+
+def contenido_carga(n_estaciones=12):
+    estaciones, _ = benchmark.generar_estaciones(n_estaciones, 3, random.Random(1))
+    return benchmark.generar_csv_carga(estaciones, random.Random(2))
+
+
+def test_carga_completa_por_fragmentos(base, carpeta, cliente_admin):
+    contenido = contenido_carga()
+    carga_id = iniciar(cliente_admin, contenido)
+    mitad = len(contenido) // 2
+    assert enviar(cliente_admin, carga_id, 0, contenido[:mitad]) == (200, {'success': True, 'offset': mitad})
+    assert enviar(cliente_admin, carga_id, mitad, contenido[mitad:])[0] == 200
+
+    respuesta = cliente_admin.post(f'/admin/upload/parcial/{carga_id}/finalizar')
+    assert respuesta.status_code == 202
+    base.ejecutor_ingestas.submit(lambda: None).result()
+    estado = cliente_admin.get(f'/admin/upload/parcial/{carga_id}').get_json()
+    assert estado['estado'] == 'completada' and estado['resultado']['insertados'] == 12
+    assert not os.path.exists(carpeta / f'{carga_id}.part')
+    base.db.session.remove()
+    assert base.RegistroCombustible.query.count() == 12
+
+
+def test_offset_distinto_devuelve_el_confirmado(base, carpeta, cliente_admin):
+    contenido = contenido_carga()
+    carga_id = iniciar(cliente_admin, contenido)
+    enviar(cliente_admin, carga_id, 0, contenido[:100])
+    estado, datos = enviar(cliente_admin, carga_id, 50, contenido[50:150])
+    assert estado == 409 and datos['offset'] == 100
+
+
+def test_fragmento_corrupto_se_descarta(base, carpeta, cliente_admin):
+    contenido = contenido_carga()
+    carga_id = iniciar(cliente_admin, contenido)
+    enviar(cliente_admin, carga_id, 0, contenido[:100])
+    estado, datos = enviar(cliente_admin, carga_id, 100, contenido[100:200], checksum='0' * 64)
+    assert estado == 400 and datos['offset'] == 100
+    assert os.path.getsize(carpeta / f'{carga_id}.part') == 100
+
+
+def test_fragmento_y_cancelacion_respetan_el_bloqueo(base, carpeta, cliente_admin):
+    contenido = contenido_carga()
+    carga_id = iniciar(cliente_admin, contenido)
+    with open(carpeta / f'{carga_id}.part', 'r+b') as ocupado:
+        assert base.bloquear_carga_parcial(ocupado)
+        assert enviar(cliente_admin, carga_id, 0, contenido[:100])[0] == 409
+        assert cliente_admin.delete(f'/admin/upload/parcial/{carga_id}').status_code == 409
+        assert os.path.exists(carpeta / f'{carga_id}.json')
+    assert cliente_admin.delete(f'/admin/upload/parcial/{carga_id}').get_json()['success']
+    assert os.listdir(carpeta) == []
+    assert cliente_admin.get(f'/admin/upload/parcial/{carga_id}').status_code == 404
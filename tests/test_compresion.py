@@ -0,0 +1,68 @@
+import gzip
+import os
+import re
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def cliente(base):
+    benchmark.poblar_base_datos(base, 30, 2, 3)
+    return benchmark.cliente_con_sesion(base, user='admin', role='admin', funcionario='Administrador')
+
+
+def test_html_grande_se_comprime_con_gzip(cliente):
+    respuesta = cliente.get('/admin/dashboard', headers={'Accept-Encoding': 'gzip'})
+    assert respuesta.status_code == 200
+    assert respuesta.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in respuesta.headers['Vary']
+    assert b'</html>' in gzip.decompress(respuesta.data)
+
+
+def test_sin_accept_encoding_no_se_comprime(cliente):
+    respuesta = cliente.get('/admin/dashboard', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in respuesta.headers
+    assert b'</html>' in respuesta.data
+
+
+def test_respuesta_chica_no_se_comprime(base, monkeypatch):
+    cliente = base.app.test_client()
+    tamano = len(cliente.get('/login', headers={'Accept-Encoding': 'identity'}).data)
+    monkeypatch.setitem(base.app.config, 'COMPRESION_MIN_BYTES', tamano + 1)
+    respuesta = cliente.get('/login', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in respuesta.headers
+    assert len(respuesta.data) == tamano
+
+
+def test_brotli_si_esta_instalado(cliente, base):
+    if base.brotli is None:
+        pytest.skip('brotli no está instalado')
+    respuesta = cliente.get('/admin/dashboard', headers={'Accept-Encoding': 'gzip, br'})
+    assert respuesta.headers['Content-Encoding'] == 'br'
+    assert b'</html>' in base.brotli.decompress(respuesta.data)
+
+
+def test_estatico_con_huella_es_inmutable(base):
+    with base.app.test_request_context():
+        url = base.static_url('css/admin_dashboard.css')
+    assert re.fullmatch(r'/assets/css/admin_dashboard\.[0-9a-f]{12}\.css', url)
+    cliente = base.app.test_client()
+    respuesta = cliente.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert respuesta.status_code == 200
+    assert respuesta.headers['Cache-Control'] == base.CACHE_INMUTABLE
+    assert respuesta.headers['Content-Encoding'] == 'gzip'
+    with open(os.path.join(base.app.static_folder, 'css', 'admin_dashboard.css'), 'rb') as f:
+        assert gzip.decompress(respuesta.data) == f.read()
+
+    revalidada = cliente.get(url, headers={'Accept-Encoding': 'gzip',
+                                           'If-None-Match': respuesta.headers['ETag']})
+    assert revalidada.status_code == 304
+
+
+def test_huella_vieja_sirve_la_version_actual_sin_cache_permanente(base):
+    respuesta = base.app.test_client().get('/assets/css/admin_dashboard.000000000000.css')
+    assert respuesta.status_code == 200
+    assert respuesta.headers['Cache-Control'] != base.CACHE_INMUTABLE
+    assert base.app.test_client().get('/assets/css/no_existe.000000000000.css').status_code == 404
@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+VIEJA = 'pbkdf2:sha256:1000'
+ACTUAL = 'pbkdf2:sha256:2000'
+
+
+@pytest.fixture
+def usuario(base, monkeypatch):
+    monkeypatch.setitem(base.app.config, 'CONTRASENA_METODO', ACTUAL)
+    usuario = base.Usuario(username='ana', funcionario='Ana', rol='user',
+                           password_hash=generate_password_hash('clave', method=VIEJA))
+    base.db.session.add(usuario)
+    base.db.session.commit()
+    usuario_id = usuario.id
+    base.db.session.remove()
+    return usuario_id
+
+
+def iniciar_sesion(base, password):
+    return base.app.test_client().post('/login', data={'username': 'ana', 'password': password})
+
+
+def hash_guardado(base, usuario_id):
+    base.db.session.remove()
+    return base.db.session.get(base.Usuario, usuario_id).password_hash
+
+
+def test_login_recalcula_el_hash_con_la_politica_actual(base, usuario):
+    version_usuarios = base.version_datos()[1]
+    respuesta = iniciar_sesion(base, 'clave')
+    assert respuesta.status_code == 302 and respuesta.location.endswith('/user/dashboard')
+
+    nuevo = hash_guardado(base, usuario)
+    assert nuevo.startswith(ACTUAL + '$')
+    # El UPDATE directo no invalida los fragmentos de usuarios
+    assert base.version_datos()[1] == version_usuarios
+
+    # El hash nuevo sigue aceptando la contraseña y ya no se vuelve a escribir
+    assert iniciar_sesion(base, 'clave').status_code == 302
+    assert hash_guardado(base, usuario) == nuevo
+
+
+def test_contrasena_incorrecta_no_toca_el_hash(base, usuario):
+    anterior = hash_guardado(base, usuario)
+    respuesta = iniciar_sesion(base, 'otra')
+    assert respuesta.status_code == 200 and b'Credenciales incorrectas' in respuesta.data
+    assert hash_guardado(base, usuario) == anterior
+    assert iniciar_sesion(base, '').status_code == 200
+
+
+def test_prefijo_de_la_politica_completa_los_parametros(base, monkeypatch):
+    monkeypatch.setitem(base.app.config, 'CONTRASENA_METODO', 'scrypt')
+    prefijo = base.prefijo_politica_contrasena()
+    assert prefijo.startswith('scrypt:') and prefijo.count(':') == 3
+    usuario = base.Usuario(password_hash=generate_password_hash('x', method='scrypt'))
+    assert not usuario.hash_desactualizado()
+    usuario.password_hash = generate_password_hash('x', method=VIEJA)
+    assert usuario.hash_desactualizado()
+
+
+def test_pool_lleno_responde_503(base, usuario, monkeypatch):
+    verificador = base.VerificadorContrasenas(1, 0)
+    monkeypatch.setattr(base, 'verificador_contrasenas', verificador)
+    empezo, liberar = threading.Event(), threading.Event()
+
+    def verificacion_lenta():
+        empezo.set()
+        liberar.wait(10)
+    ocupado = threading.Thread(target=verificador.ejecutar, args=(verificacion_lenta,))
+    ocupado.start()
+    try:
+        assert empezo.wait(10)
+        respuesta = iniciar_sesion(base, 'clave')
+        assert respuesta.status_code == 503 and b'muchos inicios de sesi' in respuesta.data
+    finally:
+        liberar.set()
+        ocupado.join()
+    # El lugar se devuelve en el hilo del pool, al terminar la verificación
+    verificador.ejecutor.submit(lambda: None).result()
+    assert iniciar_sesion(base, 'clave').status_code == 302
+
+
+def test_verificacion_que_no_termina_a_tiempo(base):
+    verificador = base.VerificadorContrasenas(1, 1)
+    liberar = threading.Event()
+    with pytest.raises(base.VerificacionOcupada):
+        verificador.ejecutar(liberar.wait, 10, espera=0.05)
+    liberar.set()
+    # Sin hilos verifica en el hilo que llama
+    assert base.VerificadorContrasenas(0, 0).ejecutar(threading.get_ident) == threading.get_ident()
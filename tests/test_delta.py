@@ -0,0 +1,100 @@
+import argparse
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import exportar_delta
+
+
+def sembrar(base, cantidad, desde=0):
+    inicio = datetime(2024, 5, 1)
+    base.db.session.add_all([base.RegistroCombustible(
+        codigo=f'E{i:03d}', razon_social='Estación', zona='NORTE', provincia='P', municipio='M',
+        funcionario='Ana Gomez', do_do_plus=i, fecha_hora=inicio + timedelta(minutes=i)
+    ) for i in range(desde, desde + cantidad)])
+    base.db.session.commit()
+    base.db.session.remove()
+
+
+def pedir(cliente, **parametros):
+    respuesta = cliente.get('/admin/export/delta', query_string=parametros)
+    assert respuesta.status_code == 200
+    return respuesta
+
+
+def test_csv_por_tramos_sin_repetir_filas(base, cliente_admin):
+    sembrar(base, 25)
+    cursor, codigos = '0', []
+    while True:
+        respuesta = pedir(cliente_admin, cursor=cursor, limite=10)
+        filas = list(csv.DictReader(io.StringIO(respuesta.get_data(as_text=True))))
+        assert len(filas) == int(respuesta.headers['X-Filas'])
+        codigos += [fila['codigo'] for fila in filas]
+        cursor = respuesta.headers['X-Cursor-Siguiente']
+        if respuesta.headers['X-Hay-Mas'] == '0':
+            break
+    assert codigos == [f'E{i:03d}' for i in range(25)]
+
+    sembrar(base, 3, desde=25)
+    respuesta = pedir(cliente_admin, cursor=cursor, formato='ndjson')
+    filas = [json.loads(linea) for linea in respuesta.get_data(as_text=True).splitlines()]
+    assert [fila['codigo'] for fila in filas] == ['E025', 'E026', 'E027']
+    assert filas[0]['fecha_hora'] == '2024-05-01 00:25:00'
+
+
+def test_parametros_no_validos(base, cliente_admin):
+    assert cliente_admin.get('/admin/export/delta', query_string={'cursor': '1:2'}).status_code == 400
+    assert cliente_admin.get('/admin/export/delta', query_string={'formato': 'xml'}).status_code == 400
+
+
+def test_transaccion_lenta_no_se_saltea(base, cliente_admin):
+    if not base.es_postgresql():
+        pytest.skip('en SQLite los ids se confirman en orden')
+    sembrar(base, 2)
+    # Una transacción toma un id y confirma después de que otra ya confirmó uno mayor
+    lenta = base.db.engine.connect()
+    transaccion = lenta.begin()
+    tabla = base.RegistroCombustible.__table__
+    lenta.execute(tabla.insert().values(codigo='LENTA', razon_social='x', zona='Z', provincia='P', municipio='M',
+                                        funcionario='F', fecha_hora=datetime(2024, 5, 2)))
+    sembrar(base, 1, desde=2)
+
+    recibidos = []
+    cursor = '0'
+    for _ in range(3):
+        respuesta = pedir(cliente_admin, cursor=cursor, formato='ndjson')
+        recibidos += [json.loads(linea)['codigo'] for linea in respuesta.get_data(as_text=True).splitlines()]
+        cursor = respuesta.headers['X-Cursor-Siguiente']
+        if transaccion.is_active:
+            transaccion.commit()
+            lenta.close()
+    assert sorted(recibidos) == ['E000', 'E001', 'E002', 'LENTA']
+
+
+class ClientePrueba:
+    """Adapta el cliente de Flask a la interfaz de exportar_delta.Cliente"""
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def pedir_tramo(self, cursor, formato, limite):
+        respuesta = pedir(self.cliente, cursor=cursor, formato=formato, limite=limite)
+        cuerpo = io.BytesIO(respuesta.get_data())
+        cuerpo.headers = respuesta.headers
+        return cuerpo
+
+
+def test_cliente_reanuda_desde_el_cursor_guardado(base, cliente_admin, tmp_path):
+    sembrar(base, 7)
+    args = argparse.Namespace(cursor_archivo=str(tmp_path / 'cursor'), salida=str(tmp_path / 'delta.csv'),
+                              formato='csv', limite=3)
+    cliente = ClientePrueba(cliente_admin)
+    assert exportar_delta.sincronizar(cliente, args) == 7
+    sembrar(base, 2, desde=7)
+    assert exportar_delta.sincronizar(cliente, args) == 2
+    with open(args.salida, newline='') as f:
+        filas = list(csv.DictReader(f))
+    assert [fila['codigo'] for fila in filas] == [f'E{i:03d}' for i in range(9)]
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def agrupada(base, monkeypatch):
+    monkeypatch.setitem(base.app.config, 'ESCRITURA_AGRUPADA', True)
+    monkeypatch.setitem(base.app.config, 'ESCRITURA_AGRUPADA_MS', 50)
+    estaciones, funcionarios = benchmark.poblar_base_datos(base, 10, 1, 2)
+    base.db.session.remove()
+    return base, estaciones, funcionarios
+
+
+def actualizar(cliente, codigo, volumen):
+    respuesta = cliente.post('/user/actualizar_estacion', json={'codigo': codigo, 'do_do_plus': volumen})
+    return respuesta.status_code, respuesta.get_json()
+
+
+def test_escrituras_concurrentes_comparten_commits(agrupada):
+    base, estaciones, funcionarios = agrupada
+    commits = base.buffer_escritura.commits
+    respuestas = []
+
+    def escritor(i):
+        cliente = benchmark.cliente_con_sesion(base, user=f'escritor{i}', role='user', funcionario=funcionarios[0])
+        respuestas.append(actualizar(cliente, estaciones[i]['codigo'], 1000 + i))
+
+    hilos = [threading.Thread(target=escritor, args=(i,)) for i in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert all(estado == 200 for estado, _ in respuestas)
+    secuencias = {datos['secuencia'] for _, datos in respuestas}
+    assert len(secuencias) == 8
+    assert base.buffer_escritura.commits - commits < 8
+    # El id devuelto ya está confirmado y conserva los datos de la estación
+    for secuencia in secuencias:
+        registro = base.db.session.get(base.RegistroCombustible, secuencia)
+        assert registro.razon_social and registro.tipo_registro == 'actualizacion'
+
+
+def test_error_en_un_registro_no_arrastra_al_lote(agrupada, monkeypatch):
+    base, estaciones, funcionarios = agrupada
+    procesar = base.procesar_registros_nuevos
+
+    def procesar_con_falla(registros):
+        if any(registro.codigo == 'FALLA' for registro in registros):
+            raise ValueError('registro inválido')
+        procesar(registros)
+
+    monkeypatch.setattr(base, 'procesar_registros_nuevos', procesar_con_falla)
+    respuestas = {}
+
+    def escritor(codigo):
+        cliente = benchmark.cliente_con_sesion(base, user='escritor', role='user', funcionario=funcionarios[0])
+        respuestas[codigo] = actualizar(cliente, codigo, 500)[0]
+
+    hilos = [threading.Thread(target=escritor, args=(codigo,)) for codigo in (estaciones[0]['codigo'], 'FALLA')]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert respuestas == {estaciones[0]['codigo']: 200, 'FALLA': 500}
+    base.db.session.remove()
+    assert base.RegistroCombustible.query.filter_by(codigo='FALLA').count() == 0
+
+
+def test_login_guarda_el_usuario_y_el_dashboard_usa_sus_asignaciones(base):
+    usuario = base.Usuario(username='ana', funcionario='Ana Gomez', rol='user')
+    usuario.set_password('clave')
+    base.db.session.add(usuario)
+    base.db.session.flush()
+    for codigo, funcionario in (('E1', 'Otro'), ('E2', 'Ana Gomez')):
+        base.db.session.add(base.RegistroCombustible(
+            codigo=codigo, razon_social=codigo, zona='Z', provincia='P', municipio='M',
+            funcionario=funcionario, do_do_plus=100, fecha_hora=base.datetime.utcnow()))
+    usuario_id = usuario.id
+    base.db.session.add(base.AsignacionEstacion(usuario_id=usuario_id, codigo_estacion='E1'))
+    base.db.session.commit()
+    base.db.session.remove()
+
+    cliente = base.app.test_client()
+    cliente.post('/login', data={'username': 'ana', 'password': 'clave'})
+    with cliente.session_transaction() as sesion:
+        assert sesion['user_id'] == usuario_id
+    html = cliente.get('/user/dashboard').get_data(as_text=True)
+    assert 'E1' in html and 'E2' not in html
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def poblada(base):
+    estaciones, funcionarios = benchmark.poblar_base_datos(base, 30, 3, 3)
+    base.db.session.remove()
+    return base, estaciones, funcionarios
+
+
+def por_codigo(base, filas):
+    return {fila.codigo: base.fila_a_dict(fila) for fila in filas}
+
+
+def test_coincide_con_la_consulta(poblada):
+    base, _, _ = poblada
+    assert por_codigo(base, base.estado_estaciones.consultar()) == por_codigo(base, base.obtener_ultimas_filas())
+    assert base.estado_estaciones.resumen()['estaciones'] == 30
+
+
+def test_commit_del_proceso_se_aplica_sin_sondear(poblada):
+    base, estaciones, _ = poblada
+    base.estado_estaciones.consultar()
+    codigo = estaciones[0]['codigo']
+    base.db.session.add(base.RegistroCombustible(
+        codigo=codigo, razon_social='Nueva', zona='Z', provincia='P', municipio='M',
+        funcionario='F', do_do_plus=4321, fecha_hora=datetime.utcnow() + timedelta(minutes=1)))
+    base.db.session.commit()
+    cursor = base.estado_estaciones.cursor
+    actual = base.estado_estaciones.consultar(codigos=[codigo])
+    assert [e.do_do_plus for e in actual] == [4321]
+    assert base.estado_estaciones.cursor == cursor
+
+
+def test_borrado_recarga_el_estado(poblada):
+    base, estaciones, _ = poblada
+    base.estado_estaciones.consultar()
+    codigo = estaciones[0]['codigo']
+    base.RegistroCombustible.query.filter_by(codigo=codigo).delete()
+    base.db.session.commit()
+    version_registros, _ = base.version_datos()
+    actual = base.estado_estaciones.consultar(version=version_registros)
+    assert codigo not in por_codigo(base, actual) and len(actual) == 29
+
+
+def test_rango_anterior_al_ultimo_registro_no_se_responde(poblada):
+    base, _, _ = poblada
+    assert base.estado_estaciones.consultar(hasta=datetime(2000, 1, 1)) is None
+
+
+def test_dashboard_de_usuario_lee_su_ultima_escritura(poblada):
+    base, estaciones, funcionarios = poblada
+    propia = next(e for e in estaciones if e['funcionario'] == funcionarios[0])
+    cliente = benchmark.cliente_con_sesion(base, user='ana', role='user', funcionario=funcionarios[0])
+    html = cliente.get('/user/dashboard').get_data(as_text=True)
+    assert base.estado_estaciones.resumen()['cargado']
+    ajenas = [e['codigo'] for e in estaciones if e['funcionario'] != funcionarios[0]]
+    assert propia['codigo'] in html and not any(codigo in html for codigo in ajenas)
+
+    respuesta = cliente.post('/user/actualizar_estacion', json={'codigo': propia['codigo'], 'do_do_plus': 98765})
+    with cliente.session_transaction() as sesion:
+        assert sesion['ultima_secuencia'] == respuesta.get_json()['secuencia']
+    assert 'value="98765"' in cliente.get('/user/dashboard').get_data(as_text=True)
@@ -0,0 +1,115 @@
+import csv
+import io
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def poblada(base):
+    benchmark.poblar_base_datos(base, 5, 2, 1)
+    base.db.session.remove()
+    return base
+
+
+@pytest.fixture
+def generador(poblada, monkeypatch):
+    """Filas de cada CSV generado; liberar.clear() detiene la generación hasta liberar.set()"""
+    generador = SimpleNamespace(filas=[], liberar=threading.Event())
+    generador.liberar.set()
+    original = poblada.escribir_exportacion_csv
+
+    def escribir(registros, archivo):
+        generador.filas.append(len(registros))
+        generador.liberar.wait(10)
+        original(registros, archivo)
+
+    monkeypatch.setattr(poblada, 'escribir_exportacion_csv', escribir)
+    return generador
+
+
+def crear(cliente, **datos):
+    respuesta = cliente.post('/admin/export/trabajos', json={'formato': 'csv', **datos})
+    return respuesta.status_code, respuesta.get_json()
+
+
+def terminar(base, trabajo_id):
+    base._trabajos_exportacion[trabajo_id].result(timeout=10)
+
+
+def test_reutiliza_el_resultado_mientras_no_cambia_la_version(poblada, generador, cliente_admin):
+    estado, datos = crear(cliente_admin)
+    assert estado == 202
+    terminar(poblada, datos['id'])
+    estado, repetido = crear(cliente_admin)
+    assert estado == 200 and repetido['id'] == datos['id'] and repetido['estado'] == 'listo'
+
+    descarga = cliente_admin.get(repetido['descarga_url'])
+    filas = list(csv.reader(io.StringIO(descarga.get_data(as_text=True))))
+    assert filas[0] == poblada.CABECERA_EXPORTACION and len(filas) == 6
+    assert generador.filas == [5]
+
+    # Un registro nuevo cambia la versión y con ella el trabajo
+    registro = poblada.RegistroCombustible.query.first()
+    poblada.db.session.add(poblada.RegistroCombustible(
+        codigo='NUEVA', razon_social='Nueva', zona=registro.zona, provincia=registro.provincia,
+        municipio=registro.municipio, funcionario=registro.funcionario))
+    poblada.db.session.commit()
+    estado, nuevo = crear(cliente_admin)
+    assert estado == 202 and nuevo['id'] != datos['id']
+    terminar(poblada, nuevo['id'])
+    assert generador.filas == [5, 6]
+
+
+def test_peticiones_simultaneas_comparten_el_trabajo(poblada, generador, cliente_admin, monkeypatch):
+    monkeypatch.setitem(poblada.app.config, 'EXPORTACION_ESPERA', 0)
+    generador.liberar.clear()
+    _, primero = crear(cliente_admin)
+    _, segundo = crear(cliente_admin)
+    assert segundo['id'] == primero['id']
+    assert cliente_admin.get(primero['estado_url'] + '/descargar').status_code == 409
+    # El botón del dashboard no espera más de EXPORTACION_ESPERA y retoma el mismo trabajo
+    assert cliente_admin.get('/admin/export/csv').status_code == 302
+
+    generador.liberar.set()
+    terminar(poblada, primero['id'])
+    assert cliente_admin.get('/admin/export/csv').status_code == 200
+    assert generador.filas == [5]
+
+
+def test_cola_llena_rechaza_trabajos_nuevos(poblada, generador, cliente_admin, monkeypatch):
+    monkeypatch.setitem(poblada.app.config, 'EXPORTACION_PENDIENTES', 1)
+    generador.liberar.clear()
+    try:
+        estado, datos = crear(cliente_admin)
+        assert estado == 202
+        assert crear(cliente_admin, fecha_inicio='2020-01-01')[0] == 503
+        # Unirse al trabajo en curso no ocupa lugar en la cola
+        assert crear(cliente_admin)[1]['id'] == datos['id']
+    finally:
+        generador.liberar.set()
+    terminar(poblada, datos['id'])
+
+
+def test_poda_los_resultados_usados_hace_mas_tiempo(poblada, cliente_admin, monkeypatch):
+    monkeypatch.setitem(poblada.app.config, 'EXPORTACION_CACHE_MB', 0)
+    _, viejo = crear(cliente_admin)
+    terminar(poblada, viejo['id'])
+    _, nuevo = crear(cliente_admin, formato='excel')
+    terminar(poblada, nuevo['id'])
+
+    # El recién terminado se conserva aunque supere el límite, hasta que se descargue
+    carpeta = poblada.app.config['EXPORTACION_CARPETA']
+    assert sorted(os.listdir(carpeta)) == [f"{nuevo['id']}.{extension}" for extension in ('json', 'lock', 'xlsx')]
+    assert cliente_admin.get(viejo['estado_url']).status_code == 404
+    assert cliente_admin.get(nuevo['estado_url']).get_json()['estado'] == 'listo'
+
+
+def test_filtro_invalido(poblada, cliente_admin):
+    assert crear(cliente_admin, fecha_inicio='ayer')[0] == 400
+    assert crear(cliente_admin, formato='pdf')[0] == 400
+    assert cliente_admin.get('/admin/export/trabajos/no-existe').status_code == 404
@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def cliente(base):
+    benchmark.poblar_base_datos(base, 10, 2, 2)
+    base.db.session.remove()
+    return benchmark.cliente_con_sesion(base, user='admin', role='admin', funcionario='Administrador')
+
+
+def cargar(cliente, **parametros):
+    respuesta = cliente.get('/admin/dashboard', query_string=parametros)
+    assert respuesta.status_code == 200
+    return respuesta.get_data(as_text=True)
+
+
+def test_segunda_carga_sale_de_la_cache(base, cliente):
+    cargar(cliente)
+    aciertos = base.cache_fragmentos.aciertos
+    cargar(cliente)
+    assert base.cache_fragmentos.aciertos - aciertos == 6
+
+
+def test_registro_nuevo_invalida_los_fragmentos_de_registros(base, cliente):
+    assert 'NUEVA01' not in cargar(cliente)
+    base.db.session.add(base.RegistroCombustible(
+        codigo='NUEVA01', razon_social='Nueva', zona='NORTE', provincia='P', municipio='M',
+        funcionario='Ana Gomez', do_do_plus=5, fecha_hora=datetime.now()))
+    base.db.session.commit()
+    base.db.session.remove()
+    assert 'NUEVA01' in cargar(cliente)
+
+
+def test_editar_usuario_invalida_solo_los_fragmentos_de_usuarios(base, cliente):
+    cargar(cliente)
+    usuario = base.Usuario.query.first()
+    version_registros, version_usuarios = base.version_datos()
+    respuesta = cliente.post('/admin/editar_usuario', json={
+        'id': usuario.id, 'username': 'renombrado', 'funcionario': usuario.funcionario, 'rol': 'user'})
+    assert respuesta.get_json()['success']
+    base.db.session.remove()
+    assert base.version_datos() == (version_registros, version_usuarios + 1)
+    aciertos = base.cache_fragmentos.aciertos
+    assert 'renombrado' in cargar(cliente)
+    assert base.cache_fragmentos.aciertos - aciertos == 4
+
+
+def test_rollback_deshace_la_version(base):
+    antes = base.version_datos()
+    base.db.session.add(base.Usuario(username='temporal', funcionario='Temporal', rol='user', password_hash='x'))
+    base.db.session.flush()
+    base.db.session.rollback()
+    assert base.version_datos() == antes
+
+
+def test_filtro_distinto_no_comparte_fragmentos(base, cliente):
+    cargar(cliente)
+    aciertos = base.cache_fragmentos.aciertos
+    cargar(cliente, fecha_inicio='2020-01-01', fecha_fin='2020-01-02')
+    # Los fragmentos de usuarios y el pronóstico no dependen del filtro
+    assert base.cache_fragmentos.aciertos - aciertos == 3
+
+
+def test_lru_acotada_en_bytes(base):
+    cache = base.CacheFragmentos(max_bytes=3000, ttl=60)
+    for i in range(5):
+        cache.guardar('f', i, 1, 'x' * 900)
+    assert cache.bytes <= 3000
+    assert cache.obtener('f', 0, 1) is None
+    assert cache.obtener('f', 4, 1) == 'x' * 900
+    assert cache.obtener('f', 4, 2) is None
+    cache.guardar('grande', None, 1, 'x' * 5000)
+    assert cache.obtener('grande', None, 1) is None
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+import benchmark
+
+INICIO = datetime(2024, 3, 1)
+
+
+def sembrar(base, cantidad, codigo='E1'):
+    base.db.session.add_all([base.RegistroCombustible(
+        codigo=codigo, razon_social='Estación', zona='NORTE', provincia='P', municipio='M',
+        funcionario='Ana Gomez', do_do_plus=1000 + i, gp_plus=500, fecha_hora=INICIO + timedelta(hours=i)
+    ) for i in range(cantidad)])
+    base.db.session.commit()
+    base.db.session.remove()
+
+
+def pedir(cliente, codigo='E1', **parametros):
+    parametros = {'desde': '2024-03-01', 'hasta': '2024-03-31', **parametros}
+    return cliente.get(f'/admin/estaciones/{codigo}/historial', query_string=parametros)
+
+
+def test_lttb_conserva_extremos_y_picos(modulo):
+    serie = [(x, 10) for x in range(100)]
+    serie[57] = (57, 90)
+    reducida = modulo.lttb(serie, 10)
+    assert len(reducida) == 10
+    assert reducida[0] == serie[0] and reducida[-1] == serie[-1]
+    assert (57, 90) in reducida
+    assert modulo.lttb(serie[:5], 10) == serie[:5]
+
+
+def test_rango_poco_denso_se_lee_completo(base, cliente_admin):
+    sembrar(base, 30)
+    sembrar(base, 5, codigo='OTRA')
+    datos = pedir(cliente_admin, puntos=100).get_json()
+    assert datos['success'] and not datos['muestreado']
+    assert datos['registros_leidos'] == 30
+    serie = datos['series']['do_do_plus']
+    assert serie[0] == [int((INICIO - base.EPOCA).total_seconds() * 1000), 1000]
+    assert [valor for _, valor in serie] == [1000 + i for i in range(30)]
+    assert [valor for _, valor in datos['series']['total']] == [1500 + i for i in range(30)]
+
+
+def test_rango_denso_se_muestrea_con_el_presupuesto_de_puntos(base, cliente_admin):
+    # Con 5 puntos se leen completos hasta 100 registros; con más se toman 20 muestras
+    sembrar(base, 400)
+    datos = pedir(cliente_admin, puntos=5, hasta='2024-03-16').get_json()
+    assert datos['muestreado']
+    assert datos['registros_leidos'] == 5 * base.HISTORIAL_MUESTRAS_POR_PUNTO
+    assert all(len(serie) == 5 for serie in datos['series'].values())
+    # Las muestras cubren todo el rango: el primer registro y uno del último sub-intervalo
+    tiempos = [t for t, _ in datos['series']['total']]
+    assert tiempos[0] == int((INICIO - base.EPOCA).total_seconds() * 1000)
+    assert tiempos[-1] >= int((INICIO + timedelta(hours=360) - base.EPOCA).total_seconds() * 1000)
+
+
+def test_parametros_no_validos(base, cliente_admin):
+    assert pedir(cliente_admin, desde='marzo').status_code == 400
+    assert pedir(cliente_admin, desde='2024-04-01').status_code == 400
+    assert pedir(cliente_admin).get_json()['registros_leidos'] == 0
+    usuario = benchmark.cliente_con_sesion(base, user='ana', role='user', funcionario='Ana Gomez')
+    assert pedir(usuario).status_code == 403
@@ -0,0 +1,67 @@
+import csv
+import io
+from datetime import datetime, timedelta
+
+HOY = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+
+
+def registro(base, codigo, provincia, fecha_hora, total):
+    return base.RegistroCombustible(
+        codigo=codigo, razon_social=codigo, zona='NORTE', provincia=provincia, municipio='M',
+        funcionario='Ana Gomez', do_do_plus=total, fecha_hora=fecha_hora)
+
+
+def sembrar(base, inicio):
+    # E1 y E2 en P1, E3 en P2 aparece recién a las 12
+    base.db.session.add_all([
+        registro(base, 'E1', 'P1', inicio + timedelta(hours=8), 5000),
+        registro(base, 'E1', 'P1', inicio + timedelta(hours=14), 2000),
+        registro(base, 'E2', 'P1', inicio + timedelta(hours=9), 8000),
+        registro(base, 'E3', 'P2', inicio + timedelta(hours=12), 1000),
+    ])
+    base.db.session.commit()
+
+
+def volumenes(base, momento):
+    return {codigo: estados[0].volumen_total for codigo, estados in base.instantaneas([momento])}
+
+
+def test_instantanea_en_distintos_momentos(base):
+    inicio = HOY - timedelta(days=1)
+    sembrar(base, inicio)
+    assert volumenes(base, inicio + timedelta(hours=7)) == {}
+    assert volumenes(base, inicio + timedelta(hours=10)) == {'E1': 5000, 'E2': 8000}
+    assert volumenes(base, inicio + timedelta(hours=15)) == {'E1': 2000, 'E2': 8000, 'E3': 1000}
+
+
+def test_diferencia_por_estacion_y_provincia(base, cliente_admin):
+    inicio = HOY - timedelta(days=1)
+    sembrar(base, inicio)
+    respuesta = cliente_admin.get('/admin/instantanea/diferencia', query_string={
+        'antes': f'{inicio:%Y-%m-%d} 10:00', 'despues': f'{inicio:%Y-%m-%d} 15:00'})
+    datos = respuesta.get_json()
+    cambios = {e['codigo']: e['cambio']['volumen_total'] for e in datos['estaciones']}
+    assert cambios == {'E1': -3000, 'E2': 0, 'E3': 1000}
+    assert [(p['provincia'], p['cambio']['volumen_total']) for p in datos['provincias']] == [('P1', -3000), ('P2', 1000)]
+
+    respuesta = cliente_admin.get('/admin/instantanea/diferencia', query_string={
+        'antes': f'{inicio:%Y-%m-%d} 10:00', 'despues': f'{inicio:%Y-%m-%d} 15:00',
+        'nivel': 'provincia', 'formato': 'csv'})
+    filas = list(csv.reader(io.StringIO(respuesta.get_data(as_text=True))))
+    assert [fila[:2] for fila in filas[1:]] == [['P1', '2'], ['P2', '1']]
+
+
+def test_dias_compactados_usan_el_cierre_diario(base):
+    inicio = HOY - timedelta(days=30)
+    sembrar(base, inicio)
+    base.db.session.add(registro(base, 'E1', 'P1', HOY, 9000))
+    base.db.session.commit()
+    antes = volumenes(base, inicio + timedelta(hours=23))
+    base.db.session.remove()
+    base.compactar_historial(dias_retencion=7)
+    # Cada estación queda con su cierre del día
+    assert volumenes(base, inicio + timedelta(hours=23)) == antes
+
+
+def test_momento_no_valido(base, cliente_admin):
+    assert cliente_admin.get('/admin/instantanea', query_string={'momento': 'ayer'}).status_code == 400
@@ -0,0 +1,45 @@
+import random
+
+import pytest
+
+import benchmark
+import loadtest
+
+
+def test_parsear_mezcla():
+    mezcla = loadtest.parsear_mezcla('dashboard=1, actualizar=3', loadtest.ACCIONES_OFICIAL)
+    assert [(ruta, peso) for (ruta, _), peso in mezcla] == [
+        ('/user/dashboard', 1.0), ('/user/actualizar_estacion', 3.0)]
+    with pytest.raises(SystemExit):
+        loadtest.parsear_mezcla('borrar=1', loadtest.ACCIONES_OFICIAL)
+
+
+def test_resumen_por_ruta():
+    registro = loadtest.Registro()
+    for i in range(100):
+        registro.anotar('/a', (i + 1) / 1000, ok=i % 10 != 0)
+    registro.anotar('/b', 0.5, ok=True)
+    resumen = loadtest.resumir(registro, duracion=10)
+    assert resumen['/a']['peticiones'] == 100
+    assert resumen['/a']['tasa_error'] == 0.1
+    assert resumen['/a']['rps'] == 10
+    assert (resumen['/a']['p50_ms'], resumen['/a']['p95_ms'], resumen['/a']['p99_ms']) == (51.0, 95.0, 99.0)
+    assert resumen['/b']['errores'] == 0
+    assert loadtest.percentil([], 50) == 0
+
+
+def test_usuarios_sembrados_inician_sesion(base):
+    estaciones, funcionarios = loadtest.sembrar(base.app.config['SQLALCHEMY_DATABASE_URI'], 10, 2, 3)
+    cliente = base.app.test_client()
+    respuesta = cliente.post('/login', data={'username': funcionarios[0].split()[0].lower(),
+                                             'password': loadtest.PASSWORD_OFICIALES})
+    assert respuesta.status_code == 302
+    assert respuesta.headers['Location'].endswith('/user/dashboard')
+
+
+def test_multipart_se_acepta_en_la_carga(cliente_admin):
+    estaciones, _ = benchmark.generar_estaciones(5, 1, random.Random(1))
+    cuerpo, cabeceras = loadtest.multipart('file', 'carga.csv', benchmark.generar_csv_carga(estaciones, random.Random(2)))
+    respuesta = cliente_admin.post('/admin/upload', data=cuerpo, headers=cabeceras)
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['success']
@@ -0,0 +1,85 @@
+import json
+import pstats
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def almacen(base, monkeypatch, tmp_path):
+    monkeypatch.setattr(base.almacen_perfiles, 'carpeta', str(tmp_path))
+    monkeypatch.setitem(base.app.config, 'PERFILADO', True)
+    return base.almacen_perfiles
+
+
+def perfilar(cliente, ruta, modo):
+    respuesta = cliente.get(ruta, query_string={'perfilar': modo})
+    respuesta.get_data()
+    # El perfil se detiene y se guarda al cerrar la respuesta
+    respuesta.close()
+    return respuesta
+
+
+def test_muestreo_guarda_speedscope_y_tiempos_sql(almacen, cliente_admin):
+    respuesta = perfilar(cliente_admin, '/admin/dashboard', 'muestreo')
+    assert respuesta.status_code == 200
+    perfil_id = respuesta.headers['X-Perfil']
+
+    assert [p['id'] for p in cliente_admin.get('/admin/perfiles').get_json()['perfiles']] == [perfil_id]
+    datos = cliente_admin.get(f'/admin/perfiles/{perfil_id}').get_json()['perfil']
+    assert datos['modo'] == 'muestreo' and datos['endpoint'] == 'admin_dashboard' and datos['estado'] == 200
+    assert datos['consultas_sql'] == sum(s['veces'] for s in datos['sql']) > 0
+
+    descarga = cliente_admin.get(f'/admin/perfiles/{perfil_id}/descargar')
+    documento = json.loads(descarga.get_data())
+    assert documento['profiles'][0]['type'] == 'sampled'
+
+
+def test_cprofile_guarda_pstats(almacen, cliente_admin, tmp_path):
+    perfil_id = perfilar(cliente_admin, '/admin/dashboard', 'cprofile').headers['X-Perfil']
+    ruta = tmp_path / 'descarga.pstats'
+    ruta.write_bytes(cliente_admin.get(f'/admin/perfiles/{perfil_id}/descargar').get_data())
+    assert pstats.Stats(str(ruta)).total_calls > 0
+    assert cliente_admin.get(f'/admin/perfiles/{perfil_id}').get_json()['perfil']['funciones']
+
+
+def test_cprofile_ocupado_atiende_sin_perfil(base, almacen, cliente_admin):
+    assert base._lock_cprofile.acquire(blocking=False)
+    try:
+        respuesta = perfilar(cliente_admin, '/admin/dashboard', 'cprofile')
+    finally:
+        base._lock_cprofile.release()
+    assert respuesta.status_code == 200
+    assert respuesta.headers['X-Perfil-Estado'] == 'ocupado' and 'X-Perfil' not in respuesta.headers
+    assert almacen.listar() == []
+
+
+def test_la_marca_solo_vale_para_administradores(base, almacen):
+    cliente = benchmark.cliente_con_sesion(base, user='usuario', role='user', funcionario='F')
+    respuesta = perfilar(cliente, '/user/dashboard', 'muestreo')
+    assert 'X-Perfil' not in respuesta.headers and 'X-Perfil-Estado' not in respuesta.headers
+    assert almacen.listar() == []
+
+
+def test_perfilado_apagado_o_modo_invalido(base, almacen, cliente_admin, monkeypatch):
+    assert perfilar(cliente_admin, '/admin/dashboard', 'otro').headers['X-Perfil-Estado'] == 'modo no válido'
+    monkeypatch.setitem(base.app.config, 'PERFILADO', False)
+    assert 'X-Perfil' not in perfilar(cliente_admin, '/admin/dashboard', 'muestreo').headers
+    assert almacen.listar() == []
+
+
+def test_poda_los_perfiles_mas_antiguos(almacen, cliente_admin, monkeypatch):
+    monkeypatch.setattr(almacen, 'max_archivos', 2)
+    ids = [perfilar(cliente_admin, '/admin/dashboard', 'muestreo').headers['X-Perfil'] for _ in range(3)]
+    assert [p['id'] for p in almacen.listar()] == ids[:0:-1]
+    assert cliente_admin.get(f'/admin/perfiles/{ids[0]}').status_code == 404
+
+    monkeypatch.setattr(almacen, 'max_bytes', 0)
+    almacen.podar()
+    assert almacen.listar() == []
+
+
+def test_identificador_invalido(almacen, cliente_admin):
+    assert cliente_admin.get('/admin/perfiles/..%2Fapp').status_code == 404
+    assert cliente_admin.get('/admin/perfiles/20260101_000000_000000_abcd/descargar').status_code == 404
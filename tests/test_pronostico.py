@@ -0,0 +1,80 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def escribir(base, codigo, fecha_hora, **volumenes):
+    registro = base.RegistroCombustible(
+        codigo=codigo, razon_social=codigo, zona='NORTE', provincia='P', municipio='M',
+        funcionario='Ana Gomez', fecha_hora=fecha_hora, **volumenes)
+    base.db.session.add(registro)
+    base.procesar_registros_nuevos([registro])
+    base.db.session.commit()
+    return registro
+
+
+def tasa(base, codigo, producto='do_do_plus'):
+    return base.db.session.get(base.TasaConsumoEstacion, (codigo, producto))
+
+
+def test_tasa_y_vacio_estimado(base):
+    inicio = datetime(2024, 5, 1, 8)
+    escribir(base, 'E1', inicio, do_do_plus=1000)
+    assert tasa(base, 'E1').tasa is None
+    escribir(base, 'E1', inicio + timedelta(hours=2), do_do_plus=800)
+    estado = tasa(base, 'E1')
+    assert estado.tasa == pytest.approx(100)
+    assert estado.vacio_estimado == inicio + timedelta(hours=10)
+
+
+def test_recarga_solo_mueve_la_lectura(base):
+    inicio = datetime(2024, 5, 1, 8)
+    escribir(base, 'E1', inicio, do_do_plus=1000)
+    escribir(base, 'E1', inicio + timedelta(hours=1), do_do_plus=900)
+    escribir(base, 'E1', inicio + timedelta(hours=2), do_do_plus=5000)
+    estado = tasa(base, 'E1')
+    assert estado.tasa == pytest.approx(100) and estado.valor == 5000
+
+
+def test_recalcular_coincide_con_el_calculo_incremental(base):
+    rng = random.Random(7)
+    inicio = datetime(2024, 5, 1)
+    for codigo in ('E1', 'E2', 'E3'):
+        volumen, fecha_hora = 8000, inicio
+        for _ in range(30):
+            volumen = volumen - rng.randint(0, 400) if rng.random() > 0.1 else 9000
+            fecha_hora += timedelta(hours=rng.uniform(0.5, 3))
+            escribir(base, codigo, fecha_hora, do_do_plus=volumen, ge_ge_plus=rng.randint(0, 3000))
+    incremental = {(t.codigo, t.producto): (t.tasa, t.valor, t.vacio_estimado)
+                   for t in base.TasaConsumoEstacion.query.all()}
+    base.db.session.remove()
+
+    assert base.recalcular_tasas_consumo() == {'estaciones': 3, 'registros': 90}
+    lote = {(t.codigo, t.producto): (t.tasa, t.valor, t.vacio_estimado)
+            for t in base.TasaConsumoEstacion.query.all()}
+    assert lote.keys() == incremental.keys()
+    for clave, (valor_tasa, litros, _) in incremental.items():
+        assert lote[clave][1] == litros
+        assert lote[clave][0] == pytest.approx(valor_tasa, rel=1e-9)
+
+
+def test_api_y_dashboard(base, cliente_admin, monkeypatch):
+    ahora = datetime.utcnow().replace(microsecond=0)
+    escribir(base, 'E1', ahora - timedelta(hours=2), do_do_plus=1000)
+    escribir(base, 'E1', ahora, do_do_plus=500)  # 250 l/h: vacía en 2 horas
+    escribir(base, 'E2', ahora, do_do_plus=9000)
+    base.db.session.remove()
+
+    datos = cliente_admin.get('/admin/pronostico', query_string={'horas': 24}).get_json()
+    assert [(p['codigo'], p['producto']) for p in datos['pronostico']] == [('E1', 'do_do_plus')]
+    assert len(cliente_admin.get('/admin/pronostico', query_string={'codigo': 'E2'}).get_json()['pronostico']) == 5
+
+    llamadas = []
+    obtener = base.obtener_pronostico
+    monkeypatch.setattr(base, 'obtener_pronostico', lambda *a, **k: llamadas.append(1) or obtener(*a, **k))
+    for _ in range(2):
+        html = cliente_admin.get('/admin/dashboard').get_data(as_text=True)
+        assert 'E1' in html
+    # La segunda carga sale de la caché de fragmentos
+    assert len(llamadas) == 1
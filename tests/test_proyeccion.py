@@ -0,0 +1,40 @@
+import csv
+import io
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def poblada(base):
+    benchmark.poblar_base_datos(base, 40, 2, 3)
+    base.db.session.remove()
+    return base
+
+
+def test_filas_proyectadas_equivalen_a_las_instancias(poblada):
+    instancias = {r.codigo: r for r in poblada.obtener_ultimos_registros()}
+    filas = poblada.obtener_ultimas_filas()
+    assert len(filas) == len(instancias) == 40
+    for fila in filas:
+        registro = instancias[fila.codigo]
+        assert poblada.fila_a_dict(fila) == registro.to_dict()
+        # Las propiedades híbridas calculadas en SQL coinciden con las de Python
+        assert (fila.volumen_total, fila.volumen_dos, fila.volumen_ges) == (
+            registro.calcular_volumen_total(), registro.calcular_dos(), registro.calcular_ges())
+        assert fila.estado_volumen == registro.get_estado_volumen()['text']
+
+
+def test_estadisticas_iguales_con_filas_e_instancias(poblada):
+    assert (poblada.calcular_estadisticas_globales(poblada.obtener_ultimas_filas())
+            == poblada.calcular_estadisticas_globales(poblada.obtener_ultimos_registros()))
+
+
+def test_exportacion_csv_usa_las_filas_proyectadas(poblada, cliente_admin):
+    respuesta = cliente_admin.get('/admin/export/csv')
+    assert respuesta.status_code == 200
+    filas = list(csv.reader(io.StringIO(respuesta.get_data(as_text=True).lstrip('﻿'))))
+    assert filas[0] == poblada.CABECERA_EXPORTACION
+    esperadas = sorted([str(v) for v in poblada.fila_exportacion(f)] for f in poblada.obtener_ultimas_filas())
+    assert sorted(filas[1:]) == esperadas
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+import sqlalchemy as sa
+
+import benchmark
+
+
+@pytest.fixture
+def consultas(base):
+    """Cuenta los SELECT de datos que atiende cada motor (sin la verificación de la réplica)"""
+    base.estado_replica.disponible = True
+    base.estado_replica.verificada_en = 0.0
+    cuentas = {'primario': 0, 'replica': 0}
+    motores = {'primario': base.db.engines[None], 'replica': base.db.engines['replica']}
+
+    def contador(nombre):
+        def antes_de_ejecutar(conexion, cursor, sentencia, parametros, contexto, multiples):
+            if sentencia.lstrip().upper().startswith('SELECT') and 'registro_combustible' in sentencia:
+                cuentas[nombre] += 1
+        return antes_de_ejecutar
+
+    escuchas = [(motor, contador(nombre)) for nombre, motor in motores.items()]
+    for motor, escucha in escuchas:
+        sa.event.listen(motor, 'before_cursor_execute', escucha)
+    yield cuentas
+    for motor, escucha in escuchas:
+        sa.event.remove(motor, 'before_cursor_execute', escucha)
+
+
+@pytest.fixture
+def con_datos(base):
+    benchmark.poblar_base_datos(base, 5, 2, 1)
+    return base
+
+
+def test_ruta_marcada_lee_de_la_replica(con_datos, consultas):
+    cliente = benchmark.cliente_con_sesion(con_datos, user='admin', role='admin')
+    assert cliente.get('/admin/obtener_todas_estaciones').status_code == 200
+    assert consultas['replica'] > 0
+    assert consultas['primario'] == 0
+
+
+def test_sesion_que_acaba_de_escribir_lee_del_primario(con_datos, consultas):
+    cliente = benchmark.cliente_con_sesion(con_datos, user='admin', role='admin',
+                                           ultima_escritura=time.time())
+    assert cliente.get('/admin/obtener_todas_estaciones').status_code == 200
+    assert consultas['replica'] == 0
+    assert consultas['primario'] > 0
+
+
+def test_ruta_sin_marcar_lee_del_primario(con_datos, consultas):
+    usuario = con_datos.Usuario.query.first()
+    cliente = benchmark.cliente_con_sesion(con_datos, user=usuario.username, role='user',
+                                           funcionario=usuario.funcionario)
+    assert cliente.get('/user/dashboard').status_code == 200
+    assert consultas['replica'] == 0
+    assert consultas['primario'] > 0
+
+
+def test_replica_caida_vuelve_al_primario(con_datos, consultas):
+    con_datos.estado_replica.marcar_caida()
+    cliente = benchmark.cliente_con_sesion(con_datos, user='admin', role='admin')
+    assert cliente.get('/admin/obtener_todas_estaciones').status_code == 200
+    assert consultas['replica'] == 0
+    assert consultas['primario'] > 0
+
+
+def test_escritura_se_recuerda_en_la_sesion(con_datos):
+    cliente = benchmark.cliente_con_sesion(con_datos, user='admin', role='admin')
+    usuario = con_datos.Usuario.query.first()
+    respuesta = cliente.post('/admin/asignar_estaciones', json={
+        'usuario_id': usuario.id, 'estaciones': ['EST000000']})
+    assert respuesta.status_code == 200
+    with cliente.session_transaction() as sesion:
+        assert time.time() - sesion['ultima_escritura'] < 5
+
+
+@pytest.mark.parametrize('escribio, motor', [(False, 'replica'), (True, 'primario')])
+def test_exportacion_en_segundo_plano_hereda_la_decision_de_la_ruta(con_datos, consultas, escribio, motor):
+    cliente = benchmark.cliente_con_sesion(con_datos, user='admin', role='admin',
+                                           ultima_escritura=time.time() if escribio else 0)
+    datos = cliente.post('/admin/export/trabajos', json={'formato': 'csv'}).get_json()
+    con_datos._trabajos_exportacion[datos['id']].result(timeout=10)
+    assert cliente.get(datos['estado_url']).get_json()['filas'] == 5
+    assert consultas[motor] > 0
+    assert consultas['primario' if motor == 'replica' else 'replica'] == 0
@@ -0,0 +1,185 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+HOY = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+
+
+def registro(modulo, codigo, fecha_hora, volumen):
+    return modulo.RegistroCombustible(
+        codigo=codigo, razon_social=f'Estación {codigo}', zona='NORTE', provincia='P', municipio='M',
+        do_do_plus=volumen, do_uls_plus=0, ge_ge_plus=0, gp_plus=0, gp_ultra_100=0,
+        funcionario='Ana Gomez', fecha_hora=fecha_hora)
+
+
+def sembrar_historial(modulo, estaciones=('E1', 'E2'), dias=5, por_dia=4):
+    """Historial desde hace `dias` días hasta ayer; devuelve los volúmenes por (codigo, fecha)"""
+    volumenes = {}
+    for codigo in estaciones:
+        for d in range(dias, 0, -1):
+            for h in range(por_dia):
+                fecha_hora = HOY - timedelta(days=d) + timedelta(hours=3 * h)
+                volumen = 100 * d + 10 * h + len(volumenes)
+                volumenes.setdefault((codigo, fecha_hora.date()), []).append(volumen)
+                modulo.db.session.add(registro(modulo, codigo, fecha_hora, volumen))
+    modulo.db.session.commit()
+    return volumenes
+
+
+def ultimos_por_estacion(modulo):
+    R = modulo.RegistroCombustible
+    ultimos = {}
+    for r in R.query.order_by(R.fecha_hora, R.id):
+        ultimos[r.codigo] = (r.id, r.fecha_hora, r.do_do_plus)
+    return ultimos
+
+
+def resumidos_mas_crudos(modulo):
+    resumidos = modulo.db.session.query(
+        modulo.db.func.coalesce(modulo.db.func.sum(modulo.ResumenDiarioCombustible.registros), 0)).scalar()
+    return resumidos + modulo.RegistroCombustible.query.count()
+
+
+def test_conserva_el_ultimo_registro_de_cada_estacion(base):
+    sembrar_historial(base)
+    antes = ultimos_por_estacion(base)
+
+    resultado = base.compactar_historial(dias_retencion=1)
+
+    assert resultado['dias_compactados'] == 4
+    assert ultimos_por_estacion(base) == antes
+    # Cada registro está o en el resumen o crudo, nunca en los dos
+    assert resumidos_mas_crudos(base) == 40
+    assert resultado['registros_resumidos'] == resultado['registros_eliminados']
+
+
+def test_resumen_diario_con_valores_del_dia(base):
+    volumenes = sembrar_historial(base, estaciones=('E1',), dias=3)
+    base.compactar_historial(dias_retencion=1)
+
+    fecha = (HOY - timedelta(days=3)).date()
+    resumen = base.ResumenDiarioCombustible.query.filter_by(codigo='E1', fecha=fecha).one()
+    esperados = volumenes[('E1', fecha)]
+    assert resumen.registros == len(esperados)
+    assert (resumen.volumen_total_min, resumen.volumen_total_max) == (min(esperados), max(esperados))
+    assert resumen.volumen_total_suma == sum(esperados)
+    assert resumen.do_do_plus == esperados[-1]
+
+
+def test_reanudar_por_tramos_da_el_mismo_resultado(base):
+    sembrar_historial(base)
+    while base.compactar_historial(dias_retencion=1, limite_dias=1)['dias_compactados']:
+        pass
+    por_tramos = sorted((r.codigo, r.fecha, r.registros, r.volumen_total_suma)
+                        for r in base.ResumenDiarioCombustible.query)
+
+    base.db.session.rollback()
+    base.db.drop_all()
+    base.db.create_all()
+    sembrar_historial(base)
+    base.compactar_historial(dias_retencion=1)
+    de_una_vez = sorted((r.codigo, r.fecha, r.registros, r.volumen_total_suma)
+                        for r in base.ResumenDiarioCombustible.query)
+    assert por_tramos == de_una_vez
+
+
+def test_registro_tardio_se_resume_en_la_siguiente_pasada(base):
+    sembrar_historial(base, dias=3)
+    base.compactar_historial(dias_retencion=1)
+    # Llega tarde un registro de un día ya compactado
+    base.db.session.add(registro(base, 'E1', HOY - timedelta(days=3, hours=-1), 7))
+    base.db.session.commit()
+
+    base.compactar_historial(dias_retencion=1)
+
+    assert resumidos_mas_crudos(base) == 25
+    fecha = (HOY - timedelta(days=3)).date()
+    assert base.ResumenDiarioCombustible.query.filter_by(codigo='E1', fecha=fecha).one().registros == 5
+
+
+def test_sin_retencion_no_compacta(base):
+    sembrar_historial(base, dias=2)
+    assert base.compactar_historial(dias_retencion=0)['dias_compactados'] == 0
+    assert base.RegistroCombustible.query.count() == 16
+
+
+@pytest.fixture
+def particionada(base):
+    if not base.es_postgresql():
+        pytest.skip('el particionado nativo es exclusivo de PostgreSQL')
+    yield base
+    base.db.session.rollback()
+    base.db.session.execute(base.db.text(
+        f'DROP TABLE IF EXISTS {base.TABLA_REGISTROS}_sin_particionar CASCADE'))
+    base.db.session.commit()
+
+
+def test_particionado_conserva_los_datos(particionada):
+    m = particionada
+    sembrar_historial(m, dias=40, por_dia=1)
+    m.db.session.commit()
+
+    resultado = m.particionar_registros_postgresql()
+    m.db.session.rollback()
+
+    assert resultado['registros_copiados'] == 80
+    assert m.registros_particionados()
+    assert m.RegistroCombustible.query.count() == 80
+    assert m.particionar_registros_postgresql()['particionada'] is False
+
+
+def test_particion_nueva_recibe_los_registros_de_default(particionada):
+    m = particionada
+    sembrar_historial(m, dias=2, por_dia=1)
+    m.particionar_registros_postgresql()
+    m.db.session.rollback()
+    # Más allá de las particiones creadas por adelantado: cae en DEFAULT
+    lejano = m._sumar_meses(HOY.date(), 8)
+    futuro = datetime.combine(lejano, datetime.min.time()) + timedelta(days=9)
+    m.db.session.add_all([registro(m, 'E1', futuro, 1), registro(m, 'E2', futuro, 2)])
+    m.db.session.commit()
+
+    m.asegurar_particiones_mensuales(meses_adelante=8)
+    m.db.session.rollback()
+
+    cuenta = lambda tabla: m.db.session.execute(m.db.text(f'SELECT count(*) FROM {tabla}')).scalar()
+    assert cuenta(m._nombre_particion(lejano)) == 2
+    assert cuenta(f'{m.TABLA_REGISTROS}_default') == 0
+    assert m.RegistroCombustible.query.count() == 6
+    # Y la compactación, que crea particiones al terminar, no falla
+    m.db.session.rollback()
+    m.compactar_historial(dias_retencion=1)
+
+
+def test_registro_confirmado_durante_la_compactacion_no_se_pierde(base):
+    if not base.es_postgresql():
+        pytest.skip('en SQLite la compactación bloquea las escrituras concurrentes')
+    import sqlalchemy as sa
+    R = base.RegistroCombustible
+    dia = HOY - timedelta(days=30)
+    base.db.session.add_all([registro(base, 'E1', dia + timedelta(hours=h), 10) for h in range(10)])
+    base.db.session.add(registro(base, 'E1', HOY, 10))
+    base.db.session.commit()
+    # Otra transacción inserta un registro del día (con id menor) y confirma
+    # recién cuando la compactación ya calculó los agregados
+    lenta = base.db.engine.connect()
+    transaccion = lenta.begin()
+    lenta.execute(R.__table__.insert().values(
+        codigo='E1', razon_social='x', zona='NORTE', provincia='P', municipio='M',
+        funcionario='Ana Gomez', do_do_plus=10, fecha_hora=dia + timedelta(hours=20)))
+    base.db.session.add_all([registro(base, 'E1', dia + timedelta(hours=21 + h), 10) for h in range(3)])
+    base.db.session.commit()
+
+    def confirmar(sesion, contexto_flush):
+        if transaccion.is_active and any(isinstance(o, base.ResumenDiarioCombustible) for o in sesion.new):
+            transaccion.commit()
+    sa.event.listen(sa.orm.Session, 'after_flush', confirmar)
+    try:
+        base.compactar_historial(dias_retencion=7)
+    finally:
+        sa.event.remove(sa.orm.Session, 'after_flush', confirmar)
+        lenta.close()
+    assert not transaccion.is_active
+
+    base.compactar_historial(dias_retencion=7)
+    assert resumidos_mas_crudos(base) == 15
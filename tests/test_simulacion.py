@@ -0,0 +1,63 @@
+import io
+import random
+
+import pytest
+
+import benchmark
+import validacion_carga
+
+
+def simular(cliente, contenido):
+    respuesta = cliente.post('/admin/upload', data={'file': (io.BytesIO(contenido), 'carga.csv'), 'simular': '1'},
+                             content_type='multipart/form-data')
+    assert respuesta.status_code == 200
+    return respuesta.get_json()
+
+
+def archivo(n_estaciones):
+    estaciones, _ = benchmark.generar_estaciones(n_estaciones, 3, random.Random(1))
+    lineas = benchmark.generar_csv_carga(estaciones, random.Random(2)).decode('utf-8').splitlines()
+    lineas[3] = lineas[3].replace(lineas[3].split(',')[5], 'mucho', 1)
+    lineas[5] = lineas[5].rsplit(',', 1)[0] + ',ayer'
+    return ('\n'.join(lineas) + '\n').encode('utf-8')
+
+
+def test_parsear_fila():
+    mapa, faltantes = validacion_carga.mapear_columnas(benchmark.CABECERAS_CSV)
+    assert faltantes == []
+    fila = ['E1', 'Estación', 'NORTE', 'P', 'M', '1500.7', '0', '', '0', '0', 'Ana', '3', '0', '01/05/2024']
+    datos, error, aviso = validacion_carga.parsear_fila(fila, mapa)
+    assert error is None and aviso is None
+    assert datos['do_do_plus'] == 1500 and datos['ge_ge_plus'] == 0
+    assert datos['fecha_hora'].day == 1 and datos['fecha_hora'].month == 5
+    assert validacion_carga.parsear_fila(fila[:5], mapa)[1].startswith('Fila incompleta')
+    assert validacion_carga.parsear_fila([''] + fila[1:], mapa)[1] == 'Falta CODIGO'
+
+
+def test_simulacion_no_escribe_y_detalla_por_linea(base, cliente_admin):
+    datos = simular(cliente_admin, archivo(10))
+    assert datos['simulacion']
+    assert datos['resumen']['filas'] == 10
+    assert datos['resumen']['validas'] == 9
+    assert datos['errores'][0]['linea'] == 4
+    assert datos['avisos'] == [{'linea': 6, 'aviso': "Fecha no reconocida: 'ayer'"}]
+    assert base.RegistroCombustible.query.count() == 0
+    assert base.CargaArchivo.query.count() == 0
+
+
+@pytest.fixture
+def en_paralelo(base, monkeypatch):
+    monkeypatch.setattr(base, 'SIMULACION_LOTE', 7)
+    monkeypatch.setitem(base.app.config, 'CARGA_VALIDACION_PROCESOS', 2)
+    yield base
+    if base._pool_validacion is not None:
+        base._pool_validacion.shutdown()
+        base._pool_validacion = None
+
+
+def test_lotes_en_paralelo_dan_el_mismo_resultado(en_paralelo, cliente_admin, monkeypatch):
+    contenido = archivo(40)
+    paralelo = simular(cliente_admin, contenido)
+    monkeypatch.setitem(en_paralelo.app.config, 'CARGA_VALIDACION_PROCESOS', 1)
+    assert simular(cliente_admin, contenido) == paralelo
+    assert paralelo['resumen']['estaciones'] == 39
@@ -0,0 +1,60 @@
+import sqlite3
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def sqlite_ajustado(base):
+    if base.db.engine.dialect.name != 'sqlite' or not base.SQLITE_AJUSTADO:
+        pytest.skip('sólo aplica al perfil ajustado de SQLite')
+    return base
+
+
+def otra_conexion(modulo):
+    return sqlite3.connect(modulo.db.engine.url.database, timeout=0, isolation_level=None)
+
+
+def test_pragmas_al_conectar(sqlite_ajustado):
+    m = sqlite_ajustado
+    pragma = lambda nombre: m.db.session.execute(m.db.text(f'PRAGMA {nombre}')).scalar()
+    assert pragma('journal_mode') == 'wal'
+    assert pragma('busy_timeout') == m.SQLITE_PRAGMAS['busy_timeout']
+    assert pragma('synchronous') == 1  # NORMAL
+
+
+def test_transaccion_de_escritura_toma_el_bloqueo_al_empezar(sqlite_ajustado):
+    m = sqlite_ajustado
+    m.db.session.rollback()
+    otra = otra_conexion(m)
+    try:
+        with m.transaccion_escritura():
+            m.db.session.execute(m.db.text('SELECT 1'))
+            with pytest.raises(sqlite3.OperationalError, match='locked'):
+                otra.execute('BEGIN IMMEDIATE')
+        m.db.session.rollback()
+        otra.execute('BEGIN IMMEDIATE')
+        otra.execute('ROLLBACK')
+    finally:
+        otra.close()
+
+
+def test_lectura_no_bloquea_a_los_escritores(sqlite_ajustado):
+    m = sqlite_ajustado
+    m.db.session.rollback()
+    m.db.session.execute(m.db.text('SELECT 1'))
+    otra = otra_conexion(m)
+    try:
+        otra.execute('BEGIN IMMEDIATE')
+        otra.execute('ROLLBACK')
+    finally:
+        otra.close()
+        m.db.session.rollback()
+
+
+def test_escenario_concurrencia_sin_bloqueos(base):
+    resultado = benchmark.ejecutar_concurrencia(20, 2, 1, n_escritores=3, n_lectores=2)
+    assert resultado['escrituras'] > 0 and resultado['lecturas'] > 0
+    assert resultado['errores_escritura'] == resultado['errores_lectura'] == 0
+    assert resultado['database_is_locked'] == 0
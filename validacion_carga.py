@@ -0,0 +1,186 @@
+"""Lectura y validación de las filas de los archivos de carga.
+
+Sólo funciones puras, sin Flask ni base de datos: upload_file las usa fila por
+fila y la simulación de carga (?simular=1) las reparte entre procesos, que
+importan este módulo y no la aplicación.
+"""
+from datetime import datetime
+from functools import lru_cache
+
+COLUMNA_FECHA = 'FECHA Y HORA DE ACTUALIZACION'
+
+# Atributo de RegistroCombustible -> columna del archivo
+COLUMNAS_TEXTO = {
+    'codigo': 'CODIGO',
+    'razon_social': 'RAZON SOCIAL ANH',
+    'zona': 'ZONA',
+    'provincia': 'PROVINCIA',
+    'municipio': 'MUNICIPIO',
+    'funcionario': 'FUNCIONARIO',
+}
+COLUMNAS_NUMERICAS = {
+    'do_do_plus': 'DO/DO+ (LTS)',
+    'do_uls_plus': 'DO ULS+ (LTS)',
+    'ge_ge_plus': 'GE/GE+ (LTS)',
+    'gp_plus': 'GP+ (LTS)',
+    'gp_ultra_100': 'GPULTRA100 (LTS)',
+    'filas_do_do_plus': 'FILAS DO/DO+',
+    'filas_ge_ge_plus': 'FILAS GE/GE+',
+}
+COLUMNAS_REQUERIDAS = [
+    'CODIGO', 'RAZON SOCIAL ANH', 'ZONA', 'PROVINCIA', 'MUNICIPIO',
+    'DO/DO+ (LTS)', 'DO ULS+ (LTS)', 'GE/GE+ (LTS)', 'GP+ (LTS)',
+    'GPULTRA100 (LTS)', 'FUNCIONARIO', 'FILAS DO/DO+', 'FILAS GE/GE+'
+]
+FORMATOS_FECHA = ['%Y-%m-%d %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y']
+PRODUCTOS_CARGA = ('do_do_plus', 'do_uls_plus', 'ge_ge_plus', 'gp_plus', 'gp_ultra_100')
+
+
+def mapear_columnas(headers):
+    """Ubica cada columna en la cabecera del archivo.
+
+    Devuelve (mapa, faltantes). El mapa es un dict simple, serializable para
+    enviarlo a otros procesos.
+    """
+    headers = [h.strip().upper() for h in headers]
+
+    fecha_hora_columna = None
+    for i, header in enumerate(headers):
+        if 'FECHA' in header and 'HORA' in header and 'ACTUALIZACION' in header:
+            fecha_hora_columna = i
+            break
+    if fecha_hora_columna is None:
+        headers.append(COLUMNA_FECHA)
+        fecha_hora_columna = len(headers) - 1
+
+    def indice(columna):
+        for i, header in enumerate(headers):
+            if columna in header or header in columna:
+                return i
+        return -1
+
+    faltantes = [columna for columna in COLUMNAS_REQUERIDAS if indice(columna) == -1]
+    mapa = {
+        'n_columnas': len(headers),
+        'fecha': fecha_hora_columna,
+        'indices': {campo: indice(columna) for campo, columna in {**COLUMNAS_TEXTO, **COLUMNAS_NUMERICAS}.items()},
+    }
+    return mapa, faltantes
+
+
+@lru_cache(maxsize=4096)
+def leer_fecha(texto):
+    """Prueba los formatos aceptados; None si ninguno coincide.
+
+    Un archivo suele repetir pocas fechas distintas: se recuerdan las últimas.
+    """
+    for fmt in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def parsear_fila(row, mapa):
+    """Convierte una fila del archivo en los campos de un registro.
+
+    Devuelve (datos, error, aviso). Con error la fila se rechaza. Si la fecha
+    falta o no se reconoce, datos['fecha_hora'] es None (la carga usa la hora
+    actual) y, si no estaba vacía, se informa en aviso.
+    """
+    if len(row) < mapa['n_columnas'] - 1:
+        return None, f'Fila incompleta: {len(row)} columnas de {mapa["n_columnas"] - 1}', None
+
+    indices = mapa['indices']
+    datos = {}
+    for campo in COLUMNAS_TEXTO:
+        i = indices[campo]
+        datos[campo] = str(row[i]) if 0 <= i < len(row) else ''
+    if not datos['codigo']:
+        return None, 'Falta CODIGO', None
+    if not datos['funcionario']:
+        return None, 'Falta FUNCIONARIO', None
+
+    for campo, columna in COLUMNAS_NUMERICAS.items():
+        i = indices[campo]
+        valor = row[i] if 0 <= i < len(row) else ''
+        try:
+            datos[campo] = int(float(valor or 0))
+        except (ValueError, OverflowError):
+            return None, f'Valor no numérico en {columna}: {valor!r}', None
+
+    datos['fecha_hora'] = None
+    aviso = None
+    i = mapa['fecha']
+    texto = row[i].strip() if i < len(row) and row[i] else ''
+    if texto:
+        datos['fecha_hora'] = leer_fecha(texto)
+        if datos['fecha_hora'] is None:
+            aviso = f'Fecha no reconocida: {texto!r}'
+    return datos, None, aviso
+
+
+def validar_lote(mapa, filas, max_detalle):
+    """Valida [(linea, fila), ...] y resume el resultado del lote.
+
+    Corre en los procesos de la simulación: no toca la base de datos.
+    """
+    resultado = {
+        'filas': len(filas),
+        'validas': 0,
+        'errores': [],
+        'avisos': [],
+        'n_errores': 0,
+        'n_avisos': 0,
+        'codigos': set(),
+        'funcionarios': set(),
+        'fecha_min': None,
+        'fecha_max': None,
+        'volumen': dict.fromkeys(PRODUCTOS_CARGA, 0),
+    }
+    for linea, row in filas:
+        datos, error, aviso = parsear_fila(row, mapa)
+        if error:
+            resultado['n_errores'] += 1
+            if len(resultado['errores']) < max_detalle:
+                resultado['errores'].append({'linea': linea, 'error': error})
+            continue
+        if aviso:
+            resultado['n_avisos'] += 1
+            if len(resultado['avisos']) < max_detalle:
+                resultado['avisos'].append({'linea': linea, 'aviso': aviso})
+        resultado['validas'] += 1
+        resultado['codigos'].add(datos['codigo'])
+        resultado['funcionarios'].add(datos['funcionario'])
+        fecha = datos['fecha_hora']
+        if fecha is not None:
+            if resultado['fecha_min'] is None or fecha < resultado['fecha_min']:
+                resultado['fecha_min'] = fecha
+            if resultado['fecha_max'] is None or fecha > resultado['fecha_max']:
+                resultado['fecha_max'] = fecha
+        for producto in PRODUCTOS_CARGA:
+            resultado['volumen'][producto] += datos[producto]
+    return resultado
+
+
+def combinar_lotes(resultados, max_detalle):
+    """Une los resultados de validar_lote, en orden de archivo"""
+    total = {
+        'filas': 0, 'validas': 0, 'n_errores': 0, 'n_avisos': 0,
+        'errores': [], 'avisos': [], 'codigos': set(), 'funcionarios': set(),
+        'fecha_min': None, 'fecha_max': None, 'volumen': dict.fromkeys(PRODUCTOS_CARGA, 0),
+    }
+    for resultado in resultados:
+        for clave in ('filas', 'validas', 'n_errores', 'n_avisos'):
+            total[clave] += resultado[clave]
+        for clave in ('errores', 'avisos'):
+            total[clave].extend(resultado[clave][:max_detalle - len(total[clave])])
+        total['codigos'] |= resultado['codigos']
+        total['funcionarios'] |= resultado['funcionarios']
+        if resultado['fecha_min'] is not None:
+            total['fecha_min'] = min(filter(None, (total['fecha_min'], resultado['fecha_min'])))
+            total['fecha_max'] = max(filter(None, (total['fecha_max'], resultado['fecha_max'])))
+        for producto in PRODUCTOS_CARGA:
+            total['volumen'][producto] += resultado['volumen'][producto]
+    return total